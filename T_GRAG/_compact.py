@@ -0,0 +1,199 @@
+import asyncio
+import os
+import re
+from typing import Optional
+
+from ._utils import (
+    compute_mdhash_id,
+    encode_string_by_tiktoken,
+    load_json,
+    split_string_by_multi_markers,
+)
+from .base import BaseGraphStorage, BaseKVStorage
+from .prompt import GRAPH_FIELD_SEP, PROMPTS
+
+DESCRIPTION_ARCHIVE_NAMESPACE = "description_archive"
+# a compacted summary is only reused while the summary prompt is unchanged
+COMPACTION_PROMPT_VERSION = compute_mdhash_id(PROMPTS["summarize_entity_descriptions"])[:8]
+
+# _merge_nodes_then_upsert tags every description with the time it came from
+_TIME_MARKER = re.compile(r"-data from (.+?)-\s*$")
+
+
+def description_time(description: str) -> Optional[str]:
+    match = _TIME_MARKER.search(description.strip('"'))
+    return match.group(1) if match else None
+
+
+def archive_key(name: str, time: Optional[str]) -> str:
+    return compute_mdhash_id(f"{name}|{time}", prefix="desc-")
+
+
+def load_compacted_descriptions(working_dir: str) -> dict[str, dict[str, str]]:
+    """{entity name: {summary: source_id}} of the compacted node descriptions
+    in working_dir, in the shape of merged_nodes_descriptions_chunks.json"""
+    archive = load_json(
+        os.path.join(working_dir, f"kv_store_{DESCRIPTION_ARCHIVE_NAMESPACE}.json")
+    ) or {}
+    table = {}
+    for record in archive.values():
+        if "entity_name" in record:
+            table.setdefault(record["entity_name"], {})[record["summary"]] = record["source_id"]
+    return table
+
+
+class DescriptionCompactor:
+    """Summarize the description set of each (entity, time) that has grown
+    past ``max_tokens``.
+
+    Descriptions are grouped by their ``-data from {time}-`` tag, so the
+    per-time filtering of ``GraphRAG.asearch`` keeps working on the summary.
+    ``summarize(name, description)`` is called for ``batch_size`` groups at a
+    time.  The raw descriptions of every compacted group are kept in
+    ``archive`` next to their summary: a group whose raw set is unchanged
+    reuses the summary without a call, one that grew is summarized again
+    from the raw descriptions, and ``expand`` gives them back.
+    """
+
+    def __init__(
+        self,
+        summarize: callable,
+        archive: BaseKVStorage,
+        tiktoken_model_name: str = "gpt-4o",
+        max_tokens: int = 500,
+        batch_size: int = 64,
+    ):
+        self.summarize = summarize
+        self.archive = archive
+        self.tiktoken_model_name = tiktoken_model_name
+        self.max_tokens = max_tokens
+        self.batch_size = batch_size
+        self.stats = {}
+
+    async def _plan(self, name: str, description: str) -> list[dict]:
+        """Per-time groups of one description, compacted ones expanded to raw"""
+        groups = {}
+        for part in split_string_by_multi_markers(description, [GRAPH_FIELD_SEP]):
+            groups.setdefault(description_time(part), []).append(part)
+        records = await self.archive.get_by_ids([archive_key(name, t) for t in groups])
+        plan = []
+        for (time, parts), record in zip(groups.items(), records):
+            if record is not None and record["summary"] in parts:
+                parts = [p for p in parts if p != record["summary"]] + record["raw"]
+            plan.append(
+                {"time": time, "parts": parts, "raw": sorted(set(parts)), "record": record}
+            )
+        return plan
+
+    def _too_long(self, parts: list[str]) -> bool:
+        description = GRAPH_FIELD_SEP.join(parts)
+        tokens = encode_string_by_tiktoken(description, model_name=self.tiktoken_model_name)
+        return len(tokens) >= self.max_tokens
+
+    async def compact_items(self, items: dict[str, dict]) -> dict[str, str]:
+        """{name: compacted description} for the items whose description changed.
+
+        ``items`` maps a node or edge name to its ``description`` and
+        ``source_id``; the ``entity_name`` of nodes is stored with their
+        archived groups so the query side can map summaries back to chunks.
+        """
+        plans = await asyncio.gather(
+            *[self._plan(name, item["description"]) for name, item in items.items()]
+        )
+        todo, archived = [], {}
+        reused = 0
+        for (name, item), plan in zip(items.items(), plans):
+            for group in plan:
+                if not self._too_long(group["raw"]):
+                    group["summary"] = None
+                    continue
+                record = group["record"]
+                if (
+                    record is not None
+                    and record["raw"] == group["raw"]
+                    and record.get("prompt_version") == COMPACTION_PROMPT_VERSION
+                ):
+                    group["summary"] = record["summary"]
+                    reused += 1
+                else:
+                    todo.append((name, item, group))
+
+        for start in range(0, len(todo), self.batch_size):
+            batch = todo[start : start + self.batch_size]
+            summaries = await asyncio.gather(
+                *[
+                    self.summarize(name, GRAPH_FIELD_SEP.join(group["raw"]))
+                    for name, _, group in batch
+                ]
+            )
+            for (name, item, group), summary in zip(batch, summaries):
+                summary = summary.strip()
+                if group["time"] is not None:
+                    summary += f"-data from {group['time']}-"
+                group["summary"] = summary
+                archived[archive_key(name, group["time"])] = {
+                    "name": name,
+                    **({"entity_name": item["entity_name"]} if "entity_name" in item else {}),
+                    "time": group["time"],
+                    "raw": group["raw"],
+                    "summary": summary,
+                    "source_id": item.get("source_id", ""),
+                    "prompt_version": COMPACTION_PROMPT_VERSION,
+                }
+        if archived:
+            await self.archive.upsert(archived)
+
+        changed = {}
+        for (name, item), plan in zip(items.items(), plans):
+            parts = []
+            for group in plan:
+                parts.extend([group["summary"]] if group["summary"] else group["parts"])
+            description = GRAPH_FIELD_SEP.join(parts)
+            if description != item["description"]:
+                changed[name] = description
+        self.stats = {
+            "items": len(items),
+            "groups": sum(len(plan) for plan in plans),
+            "summarized": len(todo),
+            "reused": reused,
+            "changed": len(changed),
+        }
+        return changed
+
+    async def compact_graph(
+        self, graph: BaseGraphStorage
+    ) -> tuple[dict[str, dict], dict[tuple[str, str], dict]]:
+        """Compact every node and edge of ``graph`` in place, returns the
+        updated node and edge data"""
+        nodes = await graph.all_nodes()
+        edges = await graph.all_edges()
+        items = {
+            name: {**data, "entity_name": name}
+            for name, data in nodes.items()
+            if data.get("description")
+        }
+        # edges are archived under their sorted (src, tgt), as _op keys them
+        edge_names = {str(tuple(sorted(k))): k for k in edges}
+        items.update(
+            {
+                name: edges[k]
+                for name, k in edge_names.items()
+                if edges[k].get("description")
+            }
+        )
+        changed = await self.compact_items(items)
+        new_nodes, new_edges = {}, {}
+        for name, description in changed.items():
+            if name in edge_names:
+                src, tgt = edge_names[name]
+                new_edges[(src, tgt)] = {**edges[(src, tgt)], "description": description}
+                await graph.upsert_edge(src, tgt, new_edges[(src, tgt)])
+            else:
+                new_nodes[name] = {**nodes[name], "description": description}
+                await graph.upsert_node(name, new_nodes[name])
+        return new_nodes, new_edges
+
+    async def expand(self, name: str, description: str) -> str:
+        """``description`` with every compacted summary replaced by its raw descriptions"""
+        plan = await self._plan(name, description)
+        return GRAPH_FIELD_SEP.join(part for group in plan for part in group["parts"])
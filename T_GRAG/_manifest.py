@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Optional
+
+from ._utils import compute_mdhash_id, load_json, logger
+from .prompt import PROMPTS
+
+MANIFEST_FILE = "index_manifest.json"
+
+
+def file_fingerprint(file_name: str) -> Optional[str]:
+    """md5 of a file, None if it doesn't exist"""
+    if not os.path.exists(file_name):
+        return None
+    digest = hashlib.md5()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def prompt_versions(names: list[str]) -> dict[str, str]:
+    return {name: compute_mdhash_id(PROMPTS[name])[:8] for name in names}
+
+
+def _normalize(inputs: dict) -> dict:
+    # compare inputs the way they read back from the manifest
+    return json.loads(json.dumps(inputs, sort_keys=True, default=str))
+
+
+class IndexManifest:
+    """What produced the files of a working dir, one entry per pipeline stage.
+
+    An entry holds the stage inputs (doc hashes, prompt versions, model
+    names, chunking params, ...) and the md5 of the files it wrote.  A stage
+    is current while its inputs are the same and its outputs are untouched,
+    so a rerun can skip it.  A stage that knowingly rewrites the outputs of
+    an earlier one (compaction rewriting the graph of insert) passes it as
+    ``upstream`` to keep it current.
+    """
+
+    def __init__(self, working_dir: str):
+        self.working_dir = working_dir
+        self.file_name = os.path.join(working_dir, MANIFEST_FILE)
+        self.stages: dict[str, dict] = (load_json(self.file_name) or {}).get("stages", {})
+
+    def _fingerprint(self, name: str) -> Optional[str]:
+        return file_fingerprint(os.path.join(self.working_dir, name))
+
+    def outputs_intact(self, stage: str) -> bool:
+        entry = self.stages.get(stage)
+        return entry is not None and all(
+            self._fingerprint(name) == digest for name, digest in entry["outputs"].items()
+        )
+
+    def is_current(self, stage: str, inputs: dict) -> bool:
+        entry = self.stages.get(stage)
+        if entry is None or entry["inputs"] != _normalize(inputs):
+            return False
+        if not self.outputs_intact(stage):
+            logger.info(f"Outputs of {stage} changed since it ran in {self.working_dir}")
+            return False
+        return True
+
+    def record(self, stage: str, inputs: dict, outputs: list[str], upstream: tuple = ()):
+        """Record a finished stage with the outputs it wrote (missing files are skipped)"""
+        digests = {name: self._fingerprint(name) for name in outputs}
+        digests = {name: digest for name, digest in digests.items() if digest is not None}
+        self.stages[stage] = {
+            "inputs": _normalize(inputs),
+            "outputs": digests,
+            "at": datetime.now().isoformat(),
+        }
+        for name in upstream:
+            entry = self.stages.get(name)
+            if entry is None:
+                continue
+            for output in entry["outputs"]:
+                if output in digests:
+                    entry["outputs"][output] = digests[output]
+        self.save()
+
+    def invalidate(self, *stages: str):
+        for stage in stages:
+            self.stages.pop(stage, None)
+        self.save()
+
+    def save(self):
+        tmp_file = self.file_name + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"stages": self.stages}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.file_name)
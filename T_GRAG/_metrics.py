@@ -0,0 +1,231 @@
+import json
+import os
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from functools import wraps
+
+from ._utils import encode_string_by_tiktoken, logger, slot_wait_seconds
+from .base import BaseKVStorage
+
+# upper bounds (seconds) of the latency histogram buckets, the last one is open
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+@dataclass
+class StageUsage:
+    calls: int = 0
+    cache_hits: int = 0
+    errors: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    embedded_texts: int = 0
+    latency_seconds: float = 0.0
+    latency_histogram: list[int] = field(
+        default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1)
+    )
+
+    def observe_latency(self, latency: float):
+        self.latency_seconds += latency
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.latency_histogram[i] += 1
+                return
+        self.latency_histogram[-1] += 1
+
+    def merge(self, other: "StageUsage"):
+        for key in [
+            "calls",
+            "cache_hits",
+            "errors",
+            "prompt_tokens",
+            "completion_tokens",
+            "embedded_texts",
+            "latency_seconds",
+        ]:
+            setattr(self, key, getattr(self, key) + getattr(other, key))
+        self.latency_histogram = [
+            a + b for a, b in zip(self.latency_histogram, other.latency_histogram)
+        ]
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        labels = [f"le_{b:g}s" for b in LATENCY_BUCKETS] + ["gt_{:g}s".format(LATENCY_BUCKETS[-1])]
+        data["latency_histogram"] = dict(zip(labels, self.latency_histogram))
+        data["mean_latency_seconds"] = self.latency_seconds / self.calls if self.calls else 0.0
+        return data
+
+
+class _CacheHitProbe:
+    """Pass-through to the LLM cache that remembers whether a lookup hit"""
+
+    def __init__(self, kv: BaseKVStorage):
+        self._kv = kv
+        self.hit = False
+
+    async def get_by_id(self, id):
+        result = await self._kv.get_by_id(id)
+        if result is not None:
+            self.hit = True
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._kv, name)
+
+
+def _latency(start: float, waits: list[float]) -> float:
+    """Seconds since start, less the time spent waiting for limiter slots"""
+    return time.perf_counter() - start - waits[0]
+
+
+def _count_tokens(content, tiktoken_model_name: str) -> int:
+    if not content:
+        return 0
+    return len(encode_string_by_tiktoken(str(content), model_name=tiktoken_model_name))
+
+
+class UsageTracker:
+    """Per-stage call, cache, token and latency counters of one GraphRAG run.
+
+    Model and embedding funcs wrapped by ``wrap_model_func`` / ``wrap_embedding_func``
+    accept an extra ``stage`` keyword (``summary``, ``extract``, ``glean``,
+    ``loop_check``, ``answer``, ...) which is consumed here and never reaches the
+    underlying function.  Counters are kept per stage and per model.
+    """
+
+    def __init__(self, tiktoken_model_name: str = "gpt-4o", token_prices: dict = None):
+        self.tiktoken_model_name = tiktoken_model_name
+        # {model name: (usd per 1k prompt tokens, usd per 1k completion tokens)}
+        self.token_prices = token_prices or {}
+        self.reset()
+
+    def reset(self, run: str = None):
+        self.run = run
+        self.started_at = datetime.now().isoformat()
+        self.stages: dict[str, StageUsage] = defaultdict(StageUsage)
+        self.models: dict[str, StageUsage] = defaultdict(StageUsage)
+
+    def record(
+        self,
+        stage: str,
+        model: str,
+        latency: float,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        embedded_texts: int = 0,
+        cache_hit: bool = False,
+        error: bool = False,
+    ):
+        for usage in (self.stages[stage], self.models[model]):
+            usage.calls += 1
+            usage.cache_hits += int(cache_hit)
+            usage.errors += int(error)
+            usage.prompt_tokens += prompt_tokens
+            usage.completion_tokens += completion_tokens
+            usage.embedded_texts += embedded_texts
+            usage.observe_latency(latency)
+
+    def wrap_model_func(
+        self,
+        func,
+        model: str,
+        hashing_kv: BaseKVStorage = None,
+        default_stage: str = "answer",
+    ):
+        @wraps(func)
+        async def tracked_func(prompt, system_prompt=None, history_messages=[], **kwargs):
+            stage = kwargs.pop("stage", default_stage)
+            probe = _CacheHitProbe(hashing_kv) if hashing_kv is not None else None
+            prompt_tokens = (
+                _count_tokens(prompt, self.tiktoken_model_name)
+                + _count_tokens(system_prompt, self.tiktoken_model_name)
+                + sum(
+                    _count_tokens(m["content"], self.tiktoken_model_name)
+                    for m in history_messages
+                )
+            )
+            waits = [0.0]
+            token = slot_wait_seconds.set(waits)
+            start = time.perf_counter()
+            try:
+                response = await func(
+                    prompt,
+                    system_prompt=system_prompt,
+                    history_messages=history_messages,
+                    hashing_kv=probe,
+                    **kwargs,
+                )
+            except Exception:
+                self.record(stage, model, _latency(start, waits), prompt_tokens, error=True)
+                raise
+            finally:
+                slot_wait_seconds.reset(token)
+            cache_hit = probe is not None and probe.hit
+            self.record(
+                stage,
+                model,
+                _latency(start, waits),
+                prompt_tokens=0 if cache_hit else prompt_tokens,
+                completion_tokens=0
+                if cache_hit
+                else _count_tokens(response, self.tiktoken_model_name),
+                cache_hit=cache_hit,
+            )
+            return response
+
+        return tracked_func
+
+    def wrap_embedding_func(self, func, model: str = "embedding", default_stage: str = "embed"):
+        @wraps(func)
+        async def tracked_func(texts, *args, **kwargs):
+            stage = kwargs.pop("stage", None) or (
+                "query_embed" if kwargs.get("query") else default_stage
+            )
+            waits = [0.0]
+            token = slot_wait_seconds.set(waits)
+            start = time.perf_counter()
+            try:
+                embeddings = await func(texts, *args, **kwargs)
+            except Exception:
+                self.record(stage, model, _latency(start, waits), error=True)
+                raise
+            finally:
+                slot_wait_seconds.reset(token)
+            self.record(
+                stage,
+                model,
+                _latency(start, waits),
+                prompt_tokens=sum(_count_tokens(t, self.tiktoken_model_name) for t in texts),
+                embedded_texts=len(texts),
+            )
+            return embeddings
+
+        return tracked_func
+
+    def snapshot(self) -> dict:
+        totals = StageUsage()
+        for usage in self.stages.values():
+            totals.merge(usage)
+        cost = 0.0
+        for model, usage in self.models.items():
+            prompt_price, completion_price = self.token_prices.get(model, (0.0, 0.0))
+            cost += (
+                usage.prompt_tokens * prompt_price
+                + usage.completion_tokens * completion_price
+            ) / 1000
+        return {
+            "run": self.run,
+            "started_at": self.started_at,
+            "stages": {k: v.to_dict() for k, v in sorted(self.stages.items())},
+            "models": {k: v.to_dict() for k, v in sorted(self.models.items())},
+            "totals": totals.to_dict(),
+            "estimated_cost": cost,
+        }
+
+    def write(self, file_name: str):
+        """Append the current snapshot as one JSON line"""
+        os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+        with open(file_name, "a", encoding="utf-8") as f:
+            f.write(json.dumps(self.snapshot(), ensure_ascii=False) + "\n")
+        logger.info(f"Usage report of {self.run} appended to {file_name}")
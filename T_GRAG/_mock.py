@@ -0,0 +1,478 @@
+"""Deterministic, offline stand-ins for the LLM and embedding backends.
+
+Everything here is a pure function of its input, so indexing and querying can be
+benchmarked without network access and two runs over the same corpus produce the
+same graph.  Three entry points are provided:
+
+- ``mock_complete`` / ``make_mock_complete``: drop-in ``best_model_func`` /
+  ``cheap_model_func`` that recognise the internal prompts (summary, entity
+  extraction, gleaning, if-loop check, time parsing) and answer them in the
+  format the parsers in ``_op`` expect.
+- ``mock_embedding`` / ``make_mock_embedding``: feature-hashing embedding of a
+  configurable dimension.
+- ``serve_mock_openai``: a tiny OpenAI-compatible HTTP server backed by the two
+  functions above, for scripts that talk to ``--base-url`` directly.
+"""
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from hashlib import blake2b
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from ._utils import (
+    compute_args_hash,
+    limited_attempt,
+    limits_attempts,
+    logger,
+    wrap_embedding_func_with_attrs,
+)
+from .base import BaseKVStorage
+from .prompt import GRAPH_FIELD_SEP, PROMPTS
+
+
+@dataclass
+class MockLatency:
+    """Latency distribution of a mock backend call, in seconds.
+
+    ``distribution`` is one of ``fixed``, ``uniform`` (mean +- spread),
+    ``normal`` (stddev = spread) or ``lognormal`` (sigma = spread).  The sample is
+    seeded by the request itself, so a replay sleeps exactly as long as before.
+    """
+
+    distribution: str = "fixed"
+    mean: float = 0.0
+    spread: float = 0.0
+    seed: int = 0
+
+    def sample(self, key: str) -> float:
+        if self.mean <= 0 and self.spread <= 0:
+            return 0.0
+        rng = random.Random(f"{self.seed}-{key}")
+        if self.distribution == "fixed":
+            value = self.mean
+        elif self.distribution == "uniform":
+            value = rng.uniform(self.mean - self.spread, self.mean + self.spread)
+        elif self.distribution == "normal":
+            value = rng.gauss(self.mean, self.spread)
+        elif self.distribution == "lognormal":
+            value = self.mean * rng.lognormvariate(0.0, self.spread)
+        else:
+            raise ValueError(f"Unknown latency distribution {self.distribution}")
+        return max(0.0, value)
+
+    @classmethod
+    def parse(cls, spec: str, seed: int = 0) -> "MockLatency":
+        """Build from a ``distribution[,mean[,spread]]`` string, e.g. ``lognormal,0.8,0.3``"""
+        parts = [p.strip() for p in spec.split(",") if p.strip()]
+        if not parts:
+            return cls(seed=seed)
+        return cls(
+            distribution=parts[0],
+            mean=float(parts[1]) if len(parts) > 1 else 0.0,
+            spread=float(parts[2]) if len(parts) > 2 else 0.0,
+            seed=seed,
+        )
+
+
+def _stable_int(content: str) -> int:
+    return int.from_bytes(blake2b(content.encode(), digest_size=8).digest(), "big")
+
+
+def _template_prefix(template: str) -> str:
+    return template[: template.find("{")].strip()[:120]
+
+
+def _text_after(content: str, marker: str, end_marker: str = None) -> str:
+    start = content.rfind(marker)
+    if start < 0:
+        return content
+    content = content[start + len(marker) :]
+    if end_marker is not None and end_marker in content:
+        content = content[: content.find(end_marker)]
+    return content.strip()
+
+
+def detect_prompt_kind(prompt: str) -> str:
+    """Map a rendered prompt back to the PROMPTS entry it was built from"""
+    stripped = prompt.strip()
+    if stripped == PROMPTS["entiti_continue_extraction"].strip():
+        return "glean"
+    if stripped == PROMPTS["entiti_if_loop_extraction"].strip():
+        return "loop_check"
+    for kind in [
+        "summary",
+        "summary_entity_extraction",
+        "entity_extraction",
+        "merge_extraction",
+        "time",
+    ]:
+        if stripped.startswith(_template_prefix(PROMPTS[kind])):
+            return kind
+    return "answer"
+
+
+_ENTITY_CANDIDATE = re.compile(r"\b[A-Z][\w&\-]*(?:\s+[A-Z][\w&\-]*)*")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_YEAR = re.compile(r"\b(1[89]\d{2}|20\d{2})\b")
+
+
+def _entity_candidates(text: str) -> list[str]:
+    seen = {}
+    for match in _ENTITY_CANDIDATE.finditer(text):
+        name = match.group(0).strip()
+        if len(name) < 3:
+            continue
+        seen.setdefault(name.upper(), name)
+    return list(seen.values())
+
+
+def _sentence_with(text: str, name: str) -> str:
+    for sentence in _SENTENCE_END.split(text):
+        if name in sentence:
+            return " ".join(sentence.split())[:240]
+    return f"{name} is mentioned in the text."
+
+
+def _format_records(text: str, names: list[str]) -> list[str]:
+    tuple_delimiter = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+    entity_types = PROMPTS["DEFAULT_ENTITY_TYPES"]
+    records = []
+    for name in names:
+        entity_type = entity_types[_stable_int(name) % len(entity_types)]
+        description = _sentence_with(text, name).replace('"', "")
+        records.append(
+            tuple_delimiter.join(
+                ['("entity"', f'"{name}"', f'"{entity_type}"', f'"{description}")']
+            )
+        )
+    for source, target in zip(names, names[1:]):
+        strength = _stable_int(f"{source}->{target}") % 10 + 1
+        records.append(
+            tuple_delimiter.join(
+                [
+                    '("relationship"',
+                    f'"{source}"',
+                    f'"{target}"',
+                    f'"{source} and {target} appear together in the text."',
+                    f"{strength})",
+                ]
+            )
+        )
+    return records
+
+
+def _extraction_text(prompt: str) -> str:
+    return _text_after(prompt, "Text: ", "\n######################")
+
+
+def _already_extracted(history_messages: list[dict]) -> int:
+    return sum(
+        m["content"].count('("entity"')
+        for m in history_messages
+        if m.get("role") == "assistant"
+    )
+
+
+def _extraction_history_text(history_messages: list[dict]) -> str:
+    for message in history_messages:
+        if message.get("role") == "user" and detect_prompt_kind(
+            message["content"]
+        ) in ("entity_extraction", "summary_entity_extraction"):
+            return _extraction_text(message["content"])
+    return ""
+
+
+def mock_response(
+    prompt: str,
+    system_prompt: str = None,
+    history_messages: list[dict] = [],
+    max_entities: int = 8,
+) -> str:
+    """Answer ``prompt`` the way a well-behaved model would, deterministically"""
+    kind = detect_prompt_kind(prompt)
+    record_delimiter = PROMPTS["DEFAULT_RECORD_DELIMITER"]
+    completion_delimiter = PROMPTS["DEFAULT_COMPLETION_DELIMITER"]
+    if kind == "summary":
+        text = _text_after(prompt, "###text:", "####output:")
+        words = re.sub(r"[*#+|`]", " ", text).split()
+        return " ".join(words[: max(40, len(words) // 3)])
+    if kind in ("entity_extraction", "summary_entity_extraction"):
+        text = _extraction_text(prompt)
+        names = _entity_candidates(text)[:max_entities]
+        records = f"\n{record_delimiter}\n".join(_format_records(text, names)) + (
+            f"\n{completion_delimiter}"
+        )
+        if kind == "entity_extraction":
+            return records
+        words = re.sub(r"[*#+|`]", " ", text).split()
+        summary = " ".join(words[: max(40, len(words) // 3)])
+        return f"{summary}\n{PROMPTS['DEFAULT_SUMMARY_DELIMITER']}\n{records}"
+    if kind in ("glean", "loop_check"):
+        text = _extraction_history_text(history_messages)
+        emitted = _already_extracted(history_messages)
+        remaining = _entity_candidates(text)[emitted:]
+        if kind == "loop_check":
+            return "YES" if remaining else "NO"
+        names = remaining[:max_entities]
+        if not names:
+            return completion_delimiter
+        return f"\n{record_delimiter}\n".join(_format_records(text, names)) + (
+            f"\n{completion_delimiter}"
+        )
+    if kind == "merge_extraction":
+        # names whose words start with all words of a shorter name are merged into it
+        names = [n.strip() for n in _text_after(prompt, "entity_names=", "\noutput:").split(",")]
+        groups = []
+        for name in sorted(dict.fromkeys(n for n in names if n), key=len):
+            words = name.upper().split()
+            for group in groups:
+                if words[: len(group[0].split())] == group[0].upper().split():
+                    group.append(name)
+                    break
+            else:
+                groups.append([name])
+        return "<SEP>".join("---".join(group) for group in groups)
+    if kind == "time":
+        question = _text_after(prompt, "question:", "\nAnswer:")
+        years = list(dict.fromkeys(_YEAR.findall(question)))
+        if not years:
+            return "[time=None, type=5]"
+        if len(years) == 1:
+            return f"[time={years[0]}, type=1]"
+        if re.search(r"\b(between|from)\b", question, re.IGNORECASE):
+            return f"[time={years[0]}-{years[-1]}, type=3]"
+        return f"[time={GRAPH_FIELD_SEP.join(years)}, type=2]"
+    digest = compute_args_hash(system_prompt, prompt)[:8]
+    context = " ".join(prompt.split())
+    return f"Mock answer {digest}: {context[:200]}"
+
+
+def make_mock_complete(
+    latency: MockLatency = None, model: str = "mock", max_entities: int = 8
+):
+    """Build a ``best_model_func`` compatible mock, optionally with simulated latency"""
+    latency = latency or MockLatency()
+
+    @limits_attempts
+    async def mock_complete_if_cache(
+        prompt, system_prompt=None, history_messages=[], **kwargs
+    ) -> str:
+        hashing_kv: BaseKVStorage = kwargs.pop("hashing_kv", None)
+        on_delta = kwargs.pop("on_delta", None)
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.extend(history_messages)
+        messages.append({"role": "user", "content": prompt})
+        args_hash = compute_args_hash(model, messages)
+        if hashing_kv is not None:
+            if_cache_return = await hashing_kv.get_by_id(args_hash)
+            if if_cache_return is not None:
+                return if_cache_return["return"]
+
+        delay = latency.sample(args_hash)
+        response = mock_response(
+            prompt,
+            system_prompt=system_prompt,
+            history_messages=history_messages,
+            max_entities=max_entities,
+        )
+        async with limited_attempt():
+            if on_delta is None:
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                # generate the response over the simulated latency, a few words at a time
+                pieces = re.findall(r"\S*\s*", response)[:-1] or [response]
+                pieces = ["".join(pieces[i : i + 4]) for i in range(0, len(pieces), 4)]
+                for piece in pieces:
+                    if delay > 0:
+                        await asyncio.sleep(delay / len(pieces))
+                    on_delta(piece)
+
+        if hashing_kv is not None:
+            await hashing_kv.upsert({args_hash: {"return": response, "model": model}})
+        return response
+
+    return mock_complete_if_cache
+
+
+mock_complete = make_mock_complete()
+
+
+_EMBED_TOKEN = re.compile(r"\w+")
+
+
+def hash_embedding(texts: list[str], embedding_dim: int) -> np.ndarray:
+    """Signed feature hashing of words and word bigrams, L2-normalised"""
+    vectors = np.zeros((len(texts), embedding_dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        words = _EMBED_TOKEN.findall(text.lower())
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            h = _stable_int(feature)
+            vectors[row, h % embedding_dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def make_mock_embedding(
+    embedding_dim: int = 1536, max_token_size: int = 8192, latency: MockLatency = None
+):
+    """Build an ``EmbeddingFunc`` that hashes texts into ``embedding_dim`` dimensions"""
+    latency = latency or MockLatency()
+
+    @wrap_embedding_func_with_attrs(
+        embedding_dim=embedding_dim, max_token_size=max_token_size
+    )
+    async def mock_embedding(texts: list[str], query=None, **kwargs) -> np.ndarray:
+        delay = latency.sample(compute_args_hash(texts))
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return hash_embedding(texts, embedding_dim)
+
+    return mock_embedding
+
+
+mock_embedding = make_mock_embedding()
+
+
+def _approx_tokens(content: str) -> int:
+    return max(1, len(content) // 4)
+
+
+class _MockOpenAIHandler(BaseHTTPRequestHandler):
+    server_version = "MockOpenAI/0.1"
+
+    def log_message(self, format, *args):
+        logger.debug(f"mock openai: {format % args}")
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(
+                200,
+                {"object": "list", "data": [{"id": "mock", "object": "model"}]},
+            )
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        latency: MockLatency = self.server.latency
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            messages = request.get("messages", [])
+            system_prompt = None
+            if messages and messages[0].get("role") == "system":
+                system_prompt = messages[0]["content"]
+                messages = messages[1:]
+            prompt = messages[-1]["content"] if messages else ""
+            content = mock_response(
+                prompt,
+                system_prompt=system_prompt,
+                history_messages=messages[:-1],
+                max_entities=self.server.max_entities,
+            )
+            time.sleep(latency.sample(compute_args_hash(request.get("model"), messages)))
+            prompt_tokens = sum(_approx_tokens(m["content"]) for m in messages)
+            completion_tokens = _approx_tokens(content)
+            self._send_json(
+                200,
+                {
+                    "id": f"chatcmpl-{compute_args_hash(content)[:12]}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "mock"),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                },
+            )
+        elif self.path.rstrip("/").endswith("/embeddings"):
+            texts = request.get("input", [])
+            if isinstance(texts, str):
+                texts = [texts]
+            time.sleep(latency.sample(compute_args_hash(texts)))
+            vectors = hash_embedding(texts, self.server.embedding_dim)
+            prompt_tokens = sum(_approx_tokens(t) for t in texts)
+            self._send_json(
+                200,
+                {
+                    "object": "list",
+                    "model": request.get("model", "mock"),
+                    "data": [
+                        {"object": "embedding", "index": i, "embedding": v.tolist()}
+                        for i, v in enumerate(vectors)
+                    ],
+                    "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+                },
+            )
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+
+def serve_mock_openai(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    latency: MockLatency = None,
+    embedding_dim: int = 1536,
+    max_entities: int = 8,
+    background: bool = True,
+) -> ThreadingHTTPServer:
+    """Start an OpenAI-compatible server on ``host:port`` (``port=0`` picks a free one).
+
+    Point ``--base-url`` at ``http://{host}:{server.server_port}/v1``.  With
+    ``background=True`` the server runs in a daemon thread and is returned
+    immediately; call ``server.shutdown()`` to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), _MockOpenAIHandler)
+    server.latency = latency or MockLatency()
+    server.embedding_dim = embedding_dim
+    server.max_entities = max_entities
+    logger.info(f"Mock OpenAI server listening on {host}:{server.server_port}")
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        server.serve_forever()
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible mock server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", default="fixed", help="distribution[,mean[,spread]]")
+    parser.add_argument("--embedding-dim", type=int, default=1536)
+    cli_args = parser.parse_args()
+    serve_mock_openai(
+        host=cli_args.host,
+        port=cli_args.port,
+        latency=MockLatency.parse(cli_args.latency),
+        embedding_dim=cli_args.embedding_dim,
+        background=False,
+    )
@@ -1,10 +1,12 @@
 import os
 from dataclasses import dataclass
+from functools import partial
 
 from .._utils import load_json, logger, write_json
 from ..base import (
     BaseKVStorage,
 )
+from .flush import StorageFlusher
 
 
 @dataclass
@@ -14,12 +16,23 @@ class JsonKVStorage(BaseKVStorage):
         self._file_name = os.path.join(working_dir, f"kv_store_{self.namespace}.json")
         self._data = load_json(self._file_name) or {}
         logger.info(f"Load KV {self.namespace} with {len(self._data)} data")
+        self._flusher = StorageFlusher(
+            f"KV {self.namespace}",
+            # a shallow copy, values are replaced by upsert and not changed in place
+            lambda: partial(write_json, dict(self._data), self._file_name),
+            debounce=self.global_config.get("storage_flush_debounce", 0.0),
+            max_wait=self.global_config.get("storage_flush_max_wait", 30.0),
+            dirty=not os.path.exists(self._file_name),
+        )
 
     async def all_keys(self) -> list[str]:
         return list(self._data.keys())
 
     async def index_done_callback(self):
-        write_json(self._data, self._file_name)
+        await self._flusher.request()
+
+    async def flush(self):
+        await self._flusher.flush()
 
     async def get_by_id(self, id):
         return self._data.get(id, None)
@@ -40,7 +53,15 @@ class JsonKVStorage(BaseKVStorage):
         return set([s for s in data if s not in self._data])
 
     async def upsert(self, data: dict[str, dict]):
-        self._data.update(data)
+        if data:
+            self._data.update(data)
+            self._flusher.mark_dirty()
+
+    async def delete(self, ids: list[str]):
+        removed = [self._data.pop(id, None) for id in ids]
+        if any(value is not None for value in removed):
+            self._flusher.mark_dirty()
 
     async def drop(self):
         self._data = {}
+        self._flusher.mark_dirty()
@@ -109,11 +109,23 @@ class HNSWVectorStorage(BaseVectorStorage):
         self._current_elements = self._index.get_current_count()
         return ids
 
+    async def delete(self, ids: list[str]):
+        # hnswlib can't remove points, deleted labels are tombstoned and
+        # skipped by knn_query until upsert adds them again
+        logger.info(f"Deleting {len(ids)} vectors from {self.namespace}")
+        for id in ids:
+            id_int = xxhash.xxh32_intdigest(id.encode())
+            if self._metadata.pop(id_int, None) is not None:
+                self._index.mark_deleted(id_int)
+
     async def query(self, query: str, top_k: int = 5) -> list[dict]:
-        if self._current_elements == 0:
+        # _current_elements counts tombstoned labels too, knn_query fails when
+        # asked for more neighbours than there are live ones
+        live_elements = len(self._metadata)
+        if live_elements == 0:
             return []
 
-        top_k = min(top_k, self._current_elements)
+        top_k = min(top_k, live_elements)
 
         if top_k > self.ef_search:
             logger.warning(
@@ -6,6 +6,7 @@ from nano_vectordb import NanoVectorDB
 
 from .._utils import logger
 from ..base import BaseVectorStorage
+from .flush import StorageFlusher
 
 
 @dataclass
@@ -24,6 +25,23 @@ class NanoVectorDBStorage(BaseVectorStorage):
         self.cosine_better_than_threshold = self.global_config.get(
             "query_better_than_threshold", self.cosine_better_than_threshold
         ) #better_than_threshold 参数是一个阈值，用于过滤掉不满足条件的结果。
+        self._flusher = StorageFlusher(
+            f"vdb {self.namespace}",
+            # NanoVectorDB can't be snapshotted cheaply, changes wait for the write instead
+            lambda: self._save_client,
+            debounce=self.global_config.get("storage_flush_debounce", 0.0),
+            max_wait=self.global_config.get("storage_flush_max_wait", 30.0),
+            dirty=not os.path.exists(self._client_file_name),
+        )
+
+    def _save_client(self):
+        tmp_file = f"{self._client_file_name}.tmp"
+        self._client.storage_file = tmp_file
+        try:
+            self._client.save()
+        finally:
+            self._client.storage_file = self._client_file_name
+        os.replace(tmp_file, self._client_file_name)
 
 
 
@@ -50,9 +68,17 @@ class NanoVectorDBStorage(BaseVectorStorage):
         embeddings = np.concatenate(embeddings_list)
         for i, d in enumerate(list_data):
             d["__vector__"] = embeddings[i]
-        results = self._client.upsert(datas=list_data)
+        async with self._flusher.lock():
+            results = self._client.upsert(datas=list_data)
+        self._flusher.mark_dirty()
         return results
 
+    async def delete(self, ids: list[str]):
+        logger.info(f"Deleting {len(ids)} vectors from {self.namespace}")
+        async with self._flusher.lock():
+            self._client.delete(ids)
+        self._flusher.mark_dirty()
+
     async def query(self, query: str, top_k=5):
         embedding = await self.embedding_func([query],query=True)
         embedding = embedding[0] #这行代码从返回的嵌入向量列表中提取第一个向量，即查询字符串的向量表示。
@@ -67,4 +93,7 @@ class NanoVectorDBStorage(BaseVectorStorage):
         return results
 
     async def index_done_callback(self):
-        self._client.save()
+        await self._flusher.request()
+
+    async def flush(self):
+        await self._flusher.flush()
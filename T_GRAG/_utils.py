@@ -1,12 +1,15 @@
 import asyncio
+import contextvars
 import html
 import json
 import logging
 import os
 import re
 import numbers
+import time
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
-from functools import wraps
+from functools import lru_cache, partial, wraps
 from hashlib import md5
 from typing import Any, Union
 
@@ -133,6 +136,11 @@ def decode_tokens_by_tiktoken(tokens: list[int], model_name: str = "gpt-4o"):
     return content
 
 
+@lru_cache(maxsize=None)
+def get_tiktoken_encoder(model_name: str = "gpt-4o") -> tiktoken.Encoding:
+    return tiktoken.encoding_for_model(model_name)
+
+
 def truncate_list_by_token_size(list_data: list, key: callable, max_token_size: int):
     """Truncate a list of data by token size"""
     if max_token_size <= 0:
@@ -150,8 +158,11 @@ def compute_mdhash_id(content, prefix: str = ""):
 
 
 def write_json(json_obj, file_name):
-    with open(file_name, "w", encoding="utf-8") as f:
+    # write a temp file and rename it, a crash mid-write keeps the old file
+    tmp_file = f"{file_name}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
         json.dump(json_obj, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, file_name)
 
 
 def load_json(file_name):
@@ -161,6 +172,64 @@ def load_json(file_name):
         return json.load(f)
 
 
+class ExtractionCheckpoint:
+    """Append-only JSONL log of per-chunk entity extraction results.
+
+    Every finished chunk is written and fsync'ed right away, so a crashed or
+    killed insert resumes from the chunks that are already extracted.
+    """
+
+    FILE_NAME = "extraction_checkpoint.jsonl"
+
+    def __init__(self, working_dir: str):
+        self.file_name = os.path.join(working_dir, self.FILE_NAME)
+
+    def load(self) -> dict[str, tuple[dict, dict, dict]]:
+        """chunk key -> (nodes, edges, summary) of every checkpointed chunk"""
+        results = {}
+        if not os.path.exists(self.file_name):
+            return results
+        torn = False
+        good_lines = []
+        with open(self.file_name, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # torn last line of a killed process
+                    torn = True
+                    continue
+                good_lines.append(line if line.endswith("\n") else line + "\n")
+                edges = {(src, tgt): v for src, tgt, v in record["edges"]}
+                results[record["chunk_key"]] = (record["nodes"], edges, record["summary"])
+        if torn:
+            # rewrite without it, so the next append starts on a fresh line; into
+            # a temp file renamed over the log, so a crash here loses nothing
+            tmp_file = f"{self.file_name}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                f.writelines(good_lines)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.file_name)
+        return results
+
+    def append(self, chunk_key: str, nodes: dict, edges: dict, summary: dict):
+        record = {
+            "chunk_key": chunk_key,
+            "nodes": nodes,
+            "edges": [[src, tgt, v] for (src, tgt), v in edges.items()],
+            "summary": summary,
+        }
+        with open(self.file_name, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self):
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
+
+
 # it's dirty to type, so it's a good way to have fun
 def pack_user_ass_to_openai_messages(*args: str):
     roles = ["user", "assistant"]
@@ -242,8 +311,213 @@ def limit_async_func_call(max_size: int, waitting_time: float = 0.0001):
             while __current_size >= max_size:
                 await asyncio.sleep(waitting_time)
             __current_size += 1
-            result = await func(*args, **kwargs)
-            __current_size -= 1
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                # a call that raised gives its slot back too
+                __current_size -= 1
+
+        return wait_func
+
+    return final_decro
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """Whether an exception means the backend is saturated (429s, timeouts)"""
+    if type(error).__name__ == "RetryError" and hasattr(error, "last_attempt"):
+        # tenacity gave up; judge by the last underlying exception
+        error = error.last_attempt.exception() or error
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    if getattr(error, "status_code", None) in (429, 503):
+        return True
+    return type(error).__name__ in (
+        "RateLimitError",
+        "APITimeoutError",
+        "ReadTimeout",
+        "Timeout",
+    )
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD (additive increase, multiplicative decrease) concurrency limit.
+
+    The limit grows by ``increase_step`` after every ``limit`` healthy calls and
+    shrinks by ``decrease_factor`` on an overload error or on a call slower than
+    ``latency_target`` seconds (0 disables the latency signal).  Decreases are at
+    most once per ``decrease_cooldown`` seconds so one storm of 429s only halves
+    the limit once.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        floor: int = 1,
+        ceiling: int = 64,
+        latency_target: float = 0.0,
+        increase_step: int = 1,
+        decrease_factor: float = 0.5,
+        decrease_cooldown: float = 1.0,
+        waitting_time: float = 0.0001,
+    ):
+        if floor < 1 or ceiling < floor:
+            raise ValueError(f"Invalid concurrency bounds floor={floor}, ceiling={ceiling}")
+        self.floor = floor
+        self.ceiling = ceiling
+        self.limit = min(max(initial, floor), ceiling)
+        self.latency_target = latency_target
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self._waitting_time = waitting_time
+        self._in_flight = 0
+        self._healthy_streak = 0
+        self._last_decrease = float("-inf")
+        self._stats = dict(
+            calls=0,
+            successes=0,
+            overload_errors=0,
+            other_errors=0,
+            slow_calls=0,
+            increases=0,
+            decreases=0,
+            peak_in_flight=0,
+            min_limit=self.limit,
+            max_limit=self.limit,
+        )
+        self._latency_ewma = None
+
+    async def acquire(self):
+        while self._in_flight >= self.limit:
+            await asyncio.sleep(self._waitting_time)
+        self._in_flight += 1
+        self._stats["calls"] += 1
+        self._stats["peak_in_flight"] = max(self._stats["peak_in_flight"], self._in_flight)
+
+    def release(self, latency: float, error: BaseException = None):
+        self._in_flight -= 1
+        if error is not None:
+            if is_overload_error(error):
+                self._stats["overload_errors"] += 1
+                self._decrease()
+            else:
+                self._stats["other_errors"] += 1
+            return
+        self._stats["successes"] += 1
+        self._latency_ewma = (
+            latency
+            if self._latency_ewma is None
+            else 0.8 * self._latency_ewma + 0.2 * latency
+        )
+        if self.latency_target > 0 and latency > self.latency_target:
+            self._stats["slow_calls"] += 1
+            self._decrease()
+            return
+        self._healthy_streak += 1
+        if self._healthy_streak >= self.limit and self.limit < self.ceiling:
+            self.limit = min(self.ceiling, self.limit + self.increase_step)
+            self._healthy_streak = 0
+            self._stats["increases"] += 1
+            self._stats["max_limit"] = max(self._stats["max_limit"], self.limit)
+
+    def _decrease(self):
+        self._healthy_streak = 0
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_cooldown:
+            return
+        self._last_decrease = now
+        new_limit = max(self.floor, int(self.limit * self.decrease_factor))
+        if new_limit < self.limit:
+            self.limit = new_limit
+            self._stats["decreases"] += 1
+            self._stats["min_limit"] = min(self._stats["min_limit"], self.limit)
+
+    def snapshot(self) -> dict:
+        return dict(
+            current_limit=self.limit,
+            floor=self.floor,
+            ceiling=self.ceiling,
+            in_flight=self._in_flight,
+            latency_ewma=self._latency_ewma,
+            **self._stats,
+        )
+
+
+# the adaptive limiter of the model call running in this task, see limited_attempt
+_attempt_limiter: contextvars.ContextVar = contextvars.ContextVar(
+    "attempt_limiter", default=None
+)
+# [seconds] the tracked call running in this task waited for limiter slots,
+# which UsageTracker leaves out of the call's latency
+slot_wait_seconds: contextvars.ContextVar = contextvars.ContextVar(
+    "slot_wait_seconds", default=None
+)
+
+
+def limits_attempts(func):
+    """Mark a model or embedding func that runs each attempt of its own retry
+    under ``limited_attempt``"""
+    func.limits_attempts = True
+    return func
+
+
+@asynccontextmanager
+async def limited_attempt():
+    """One request to the backend under the adaptive limiter of the calling
+    GraphRAG, if any.
+
+    Model funcs with a retry of their own put this around each attempt, inside
+    the retry, so the limiter sees every 429 the retry would otherwise absorb,
+    and doesn't hold a slot over the backoff sleeps or a cache lookup.
+    """
+    limiter = _attempt_limiter.get()
+    if limiter is None:
+        yield
+        return
+    queued = time.perf_counter()
+    await limiter.acquire()
+    start = time.perf_counter()
+    waits = slot_wait_seconds.get()
+    if waits is not None:
+        waits[0] += start - queued
+    try:
+        yield
+    except BaseException as e:
+        limiter.release(time.perf_counter() - start, e)
+        raise
+    limiter.release(time.perf_counter() - start)
+
+
+def limit_async_func_call_adaptive(limiter: AdaptiveConcurrencyLimiter):
+    """Like limit_async_func_call, but the limit is driven by an AdaptiveConcurrencyLimiter.
+
+    A func marked with ``limits_attempts`` takes a slot per attempt (see
+    limited_attempt); any other func takes one for the whole call.
+    """
+
+    def final_decro(func):
+        if getattr(func, "limits_attempts", False):
+
+            @wraps(func)
+            async def attempt_func(*args, **kwargs):
+                token = _attempt_limiter.set(limiter)
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    _attempt_limiter.reset(token)
+
+            return attempt_func
+
+        @wraps(func)
+        async def wait_func(*args, **kwargs):
+            await limiter.acquire()
+            start = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except BaseException as e:
+                limiter.release(time.perf_counter() - start, e)
+                raise
+            limiter.release(time.perf_counter() - start)
             return result
 
         return wait_func
@@ -259,3 +533,112 @@ def wrap_embedding_func_with_attrs(**kwargs):
         return new_func
 
     return final_decro
+
+
+class EmbeddingMicroBatcher:
+    """Coalesce concurrent embedding calls and run a sync encoder off the event loop.
+
+    Calls arriving within ``max_wait`` seconds of each other are merged into one
+    ``encode(texts, query=...)`` call of at most ``batch_size`` texts, run in
+    ``executor`` (a single worker thread by default, pass a ProcessPoolExecutor
+    together with a picklable module level ``encode`` for a worker process).
+    Query and document calls are batched separately so prompt modes never mix.
+    Each caller gets back its own slice of the result.
+    """
+
+    def __init__(self, encode, batch_size: int = 32, max_wait: float = 0.005, executor=None):
+        self.encode = encode
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._executor = executor
+        self._pending: dict[Any, list] = {}
+        self._timers: dict[Any, asyncio.TimerHandle] = {}
+
+    def __deepcopy__(self, memo):
+        # shared by every asdict(global_config) copy, like the encoder it wraps
+        return self
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="embedding"
+            )
+        return self._executor
+
+    async def __call__(self, texts: list[str], query=None, **kwargs) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        key = (query, tuple(sorted(kwargs.items())))
+        future = loop.create_future()
+        pending = self._pending.setdefault(key, [])
+        pending.append((list(texts), future))
+        if sum(len(t) for t, _ in pending) >= self.batch_size:
+            self._flush(key)
+        elif len(pending) == 1:
+            self._timers[key] = loop.call_later(self.max_wait, self._flush, key)
+        return await future
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        pending = self._pending.pop(key, None)
+        if pending:
+            asyncio.get_running_loop().create_task(self._encode_pending(key, pending))
+
+    async def _encode_pending(self, key, pending: list):
+        loop = asyncio.get_running_loop()
+        query, kwargs = key[0], dict(key[1])
+        texts = [t for caller_texts, _ in pending for t in caller_texts]
+        try:
+            embeddings = []
+            for i in range(0, len(texts), self.batch_size):
+                embeddings.append(
+                    await loop.run_in_executor(
+                        self.executor,
+                        # a partial, unlike a lambda, pickles to a worker process
+                        partial(
+                            self.encode, texts[i : i + self.batch_size], query=query, **kwargs
+                        ),
+                    )
+                )
+            embeddings = np.concatenate(embeddings) if embeddings else np.empty((0,))
+        except BaseException as e:
+            # also on cancellation, no caller may wait for a batch that never comes
+            for _, future in pending:
+                if not future.done():
+                    if isinstance(e, asyncio.CancelledError):
+                        future.cancel()
+                    else:
+                        future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        start = 0
+        for caller_texts, future in pending:
+            if not future.done():
+                future.set_result(embeddings[start : start + len(caller_texts)])
+            start += len(caller_texts)
+
+
+def wrap_embedding_func_with_microbatch(
+    embedding_dim: int,
+    max_token_size: int,
+    batch_size: int = 32,
+    max_wait: float = 0.005,
+    executor=None,
+):
+    """Turn a sync ``encode(texts, query=None)`` into a micro-batched EmbeddingFunc"""
+
+    def final_decro(func) -> EmbeddingFunc:
+        return EmbeddingFunc(
+            embedding_dim=embedding_dim,
+            max_token_size=max_token_size,
+            func=EmbeddingMicroBatcher(
+                func, batch_size=batch_size, max_wait=max_wait, executor=executor
+            ),
+        )
+
+    return final_decro
@@ -20,6 +20,8 @@ class QueryParam:
     local_max_token_for_text_unit: int = 5200  # 12000 * 0.33
     local_max_token_for_local_context: int = 1000  # 12000 * 0.4
     local_community_single_one: bool = False
+    # use the stored chunk summaries instead of the full chunk text in the context
+    use_chunk_summaries: bool = False
 
 
 
@@ -68,6 +70,10 @@ class StorageNameSpace:
         """commit the storage operations after indexing"""
         pass
 
+    async def flush(self):
+        """write the storage operations now, also under a debounced flush policy"""
+        await self.index_done_callback()
+
     async def query_done_callback(self):
         """commit the storage operations after querying"""
         pass
@@ -87,6 +93,10 @@ class BaseVectorStorage(StorageNameSpace):
         """
         raise NotImplementedError
 
+    async def delete(self, ids: list[str]):
+        """Remove the vectors of ids, unknown ids are ignored"""
+        raise NotImplementedError
+
 
 @dataclass
 class BaseKVStorage(Generic[T], StorageNameSpace):
@@ -108,6 +118,10 @@ class BaseKVStorage(Generic[T], StorageNameSpace):
     async def upsert(self, data: dict[str, T]):
         raise NotImplementedError
 
+    async def delete(self, ids: list[str]):
+        """Remove ids, unknown ids are ignored"""
+        raise NotImplementedError
+
     async def drop(self):
         raise NotImplementedError
 
@@ -139,6 +153,12 @@ class BaseGraphStorage(StorageNameSpace):
     ) -> Union[list[tuple[str, str]], None]:
         raise NotImplementedError
 
+    async def all_nodes(self) -> dict[str, dict]:
+        raise NotImplementedError
+
+    async def all_edges(self) -> dict[tuple[str, str], dict]:
+        raise NotImplementedError
+
     async def upsert_node(self, node_id: str, node_data: dict[str, str]):
         raise NotImplementedError
 
@@ -147,6 +167,13 @@ class BaseGraphStorage(StorageNameSpace):
     ):
         raise NotImplementedError
 
+    async def delete_node(self, node_id: str):
+        """Remove a node and its edges"""
+        raise NotImplementedError
+
+    async def delete_edge(self, source_node_id: str, target_node_id: str):
+        raise NotImplementedError
+
     async def clustering(self, algorithm: str):
         raise NotImplementedError
 
@@ -1,18 +1,177 @@
 from typing import Union
+import copy
+import json
 import pickle
 import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from openai import BadRequestError
 from collections import defaultdict
 import dspy
-from nano_graphrag.base import (
+from ..base import (
     BaseGraphStorage,
+    BaseKVStorage,
     BaseVectorStorage,
     TextChunkSchema,
 )
-from nano_graphrag.prompt import PROMPTS
-from nano_graphrag._utils import logger, compute_mdhash_id
-from nano_graphrag.entity_extraction.module import TypedEntityRelationshipExtractor
-from nano_graphrag._op import _merge_edges_then_upsert, _merge_nodes_then_upsert
+from ..prompt import PROMPTS
+from .._utils import logger, compute_mdhash_id
+from .module import TypedEntityRelationshipExtractor
+from .._op import _chunk_contributions, _merge_edges_then_upsert, _merge_nodes_then_upsert
+
+DSPY_PREDICTION_NAMESPACE = "dspy_predictions"
+
+
+def load_entity_extractor(global_config: dict) -> TypedEntityRelationshipExtractor:
+    entity_extractor = TypedEntityRelationshipExtractor(num_refine_turns=1, self_refine=True)
+    if global_config.get("use_compiled_dspy_entity_relationship", False):
+        entity_extractor.load(global_config["entity_relationship_module_path"])
+    return entity_extractor
+
+
+def dspy_module_version(entity_extractor: dspy.Module) -> str:
+    """Short hash of everything that changes what the extractor predicts:
+    its settings, its (compiled) predictor state and the LM it calls"""
+    try:
+        state = entity_extractor.dump_state()
+    except AttributeError:
+        state = {name: str(p) for name, p in entity_extractor.named_predictors()}
+    lm = getattr(entity_extractor, "lm", None) or dspy.settings.lm
+    version = {
+        "module": type(entity_extractor).__name__,
+        "entity_types": getattr(entity_extractor, "entity_types", None),
+        "self_refine": getattr(entity_extractor, "self_refine", None),
+        "num_refine_turns": getattr(entity_extractor, "num_refine_turns", None),
+        "state": state,
+        "lm": getattr(lm, "model", None) or getattr(lm, "kwargs", {}).get("model"),
+    }
+    return compute_mdhash_id(json.dumps(version, sort_keys=True, default=str))[:8]
+
+
+class DSPyExtractionEngine:
+    """Run a DSPy entity/relationship extractor over chunks on its own
+    bounded thread pool.
+
+    DSPy modules are sync, so every prediction takes a thread; ``max_workers``
+    threads of a dedicated pool run them, and at most that many chunks are
+    submitted at a time, instead of one ``asyncio.to_thread`` per chunk on
+    the default executor.  With a ``cache`` KV storage the entities and
+    relationships of a chunk are stored under the hash of its content and
+    ``module_version``, so re-running an insert, or running one over chunks
+    seen before, only predicts the new ones; recompiling the module or
+    switching the LM changes the version.  ``metrics`` reports cache hits,
+    failures and chunks/sec.
+    """
+
+    def __init__(
+        self,
+        entity_extractor: dspy.Module,
+        max_workers: int = 8,
+        cache: BaseKVStorage = None,
+    ):
+        self.entity_extractor = entity_extractor
+        self.max_workers = max_workers
+        self.cache = cache
+        self.module_version = dspy_module_version(entity_extractor)
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="dspy-extract"
+        )
+        self._slots = asyncio.Semaphore(max_workers)
+        self._started = time.perf_counter()
+        self._predict_seconds = 0.0
+        self._chunks = 0
+        self._cache_hits = 0
+        self._failed = 0
+
+    def cache_key(self, content: str) -> str:
+        return compute_mdhash_id(f"{self.module_version}|{content}", prefix="dspy-")
+
+    def _predict(self, content: str) -> tuple[list[dict], list[dict]]:
+        prediction = self.entity_extractor(input_text=content)
+        return prediction.entities, prediction.relationships
+
+    async def predict(self, content: str) -> tuple[list[dict], list[dict]]:
+        """(entities, relationships) of one chunk, fresh copies that the caller may change"""
+        self._chunks += 1
+        key = self.cache_key(content)
+        if self.cache is not None:
+            cached = await self.cache.get_by_id(key)
+            if cached is not None:
+                self._cache_hits += 1
+                return copy.deepcopy(cached["entities"]), copy.deepcopy(cached["relationships"])
+
+        loop = asyncio.get_running_loop()
+        async with self._slots:
+            start = time.perf_counter()
+            try:
+                entities, relationships = await loop.run_in_executor(
+                    self._pool, self._predict, content
+                )
+            except BadRequestError as e:
+                logger.error(f"Error in {type(self.entity_extractor).__name__}: {e}")
+                self._failed += 1
+                return [], []
+            finally:
+                self._predict_seconds += time.perf_counter() - start
+
+        if self.cache is not None:
+            await self.cache.upsert(
+                {
+                    key: {
+                        "entities": copy.deepcopy(entities),
+                        "relationships": copy.deepcopy(relationships),
+                        "module_version": self.module_version,
+                    }
+                }
+            )
+        return entities, relationships
+
+    def metrics(self) -> dict:
+        seconds = time.perf_counter() - self._started
+        return {
+            "workers": self.max_workers,
+            "module_version": self.module_version,
+            "chunks": self._chunks,
+            "cache_hits": self._cache_hits,
+            "failed": self._failed,
+            "predict_seconds": round(self._predict_seconds, 3),
+            "seconds": round(seconds, 3),
+            "chunks_per_sec": round(self._chunks / seconds, 2) if seconds else 0.0,
+        }
+
+    def log_metrics(self):
+        logger.info(
+            "[DSPy Extraction] {chunks} chunks ({cache_hits} cached, {failed} failed) "
+            "on {workers} workers, {seconds}s, {chunks_per_sec} chunks/sec, "
+            "module {module_version}".format(**self.metrics())
+        )
+
+    async def aclose(self):
+        self._pool.shutdown(wait=False)
+        if self.cache is not None:
+            await self.cache.flush()
+
+
+def _open_engine(global_config: dict) -> DSPyExtractionEngine:
+    cache = None
+    if global_config.get("enable_dspy_prediction_cache", True):
+        cache = global_config["key_string_value_json_storage_cls"](
+            namespace=DSPY_PREDICTION_NAMESPACE, global_config=global_config
+        )
+    return DSPyExtractionEngine(
+        load_entity_extractor(global_config),
+        max_workers=global_config.get("dspy_extract_workers", 8),
+        cache=cache,
+    )
+
+
+def _print_progress(engine: DSPyExtractionEngine, processed: int, entities: int, relations: int):
+    now_ticks = PROMPTS["process_tickers"][processed % len(PROMPTS["process_tickers"])]
+    print(
+        f"{now_ticks} Processed {processed} chunks ({engine._cache_hits} cached), {entities} entities(duplicated), {relations} relations(duplicated)\r",
+        end="",
+        flush=True,
+    )
 
 
 async def generate_dataset(
@@ -21,10 +180,7 @@ async def generate_dataset(
     save_dataset: bool = True,
     global_config: dict = {},
 ) -> list[dspy.Example]:
-    entity_extractor = TypedEntityRelationshipExtractor(num_refine_turns=1, self_refine=True)
-
-    if global_config.get("use_compiled_dspy_entity_relationship", False):
-        entity_extractor.load(global_config["entity_relationship_module_path"])
+    engine = _open_engine(global_config)
 
     ordered_chunks = list(chunks.items())
     already_processed = 0
@@ -37,31 +193,24 @@ async def generate_dataset(
         nonlocal already_processed, already_entities, already_relations
         chunk_dp = chunk_key_dp[1]
         content = chunk_dp["content"]
-        try:
-            prediction = await asyncio.to_thread(entity_extractor, input_text=content)
-            entities, relationships = prediction.entities, prediction.relationships
-        except BadRequestError as e:
-            logger.error(f"Error in TypedEntityRelationshipExtractor: {e}")
-            entities, relationships = [], []
+        entities, relationships = await engine.predict(content)
         example = dspy.Example(
             input_text=content, entities=entities, relationships=relationships
         ).with_inputs("input_text")
         already_entities += len(entities)
         already_relations += len(relationships)
         already_processed += 1
-        now_ticks = PROMPTS["process_tickers"][
-            already_processed % len(PROMPTS["process_tickers"])
-        ]
-        print(
-            f"{now_ticks} Processed {already_processed} chunks, {already_entities} entities(duplicated), {already_relations} relations(duplicated)\r",
-            end="",
-            flush=True,
-        )
+        _print_progress(engine, already_processed, already_entities, already_relations)
         return example
 
-    examples = await asyncio.gather(
-        *[_process_single_content(c) for c in ordered_chunks]
-    )
+    try:
+        examples = await asyncio.gather(
+            *[_process_single_content(c) for c in ordered_chunks]
+        )
+    finally:
+        print()
+        await engine.aclose()
+    engine.log_metrics()
     filtered_examples = [
         example
         for example in examples
@@ -83,11 +232,13 @@ async def extract_entities_dspy(
     knwoledge_graph_inst: BaseGraphStorage,
     entity_vdb: BaseVectorStorage,
     global_config: dict,
+    chunk_summaries: BaseKVStorage = None,
+    chunk_contributions: BaseKVStorage = None,
 ) -> Union[BaseGraphStorage, None]:
-    entity_extractor = TypedEntityRelationshipExtractor(num_refine_turns=1, self_refine=True)
-
-    if global_config.get("use_compiled_dspy_entity_relationship", False):
-        entity_extractor.load(global_config["entity_relationship_module_path"])
+    """Drop-in ``GraphRAG.entity_extraction_func`` extracting with
+    TypedEntityRelationshipExtractor through a DSPyExtractionEngine; DSPy
+    extraction has no chunk summaries, so ``chunk_summaries`` is unused"""
+    engine = _open_engine(global_config)
 
     ordered_chunks = list(chunks.items())
     already_processed = 0
@@ -99,12 +250,7 @@ async def extract_entities_dspy(
         chunk_key = chunk_key_dp[0]
         chunk_dp = chunk_key_dp[1]
         content = chunk_dp["content"]
-        try:
-            prediction = await asyncio.to_thread(entity_extractor, input_text=content)
-            entities, relationships = prediction.entities, prediction.relationships
-        except BadRequestError as e:
-            logger.error(f"Error in TypedEntityRelationshipExtractor: {e}")
-            entities, relationships = [], []
+        entities, relationships = await engine.predict(content)
 
         maybe_nodes = defaultdict(list)
         maybe_edges = defaultdict(list)
@@ -122,27 +268,25 @@ async def extract_entities_dspy(
             already_relations += 1
 
         already_processed += 1
-        now_ticks = PROMPTS["process_tickers"][
-            already_processed % len(PROMPTS["process_tickers"])
-        ]
-        print(
-            f"{now_ticks} Processed {already_processed} chunks, {already_entities} entities(duplicated), {already_relations} relations(duplicated)\r",
-            end="",
-            flush=True,
-        )
+        _print_progress(engine, already_processed, already_entities, already_relations)
         return dict(maybe_nodes), dict(maybe_edges)
 
-    results = await asyncio.gather(
-        *[_process_single_content(c) for c in ordered_chunks]
-    )
-    print()
+    try:
+        results = await asyncio.gather(
+            *[_process_single_content(c) for c in ordered_chunks]
+        )
+    finally:
+        print()
+        await engine.aclose()
+    engine.log_metrics()
     maybe_nodes = defaultdict(list)
     maybe_edges = defaultdict(list)
     for m_nodes, m_edges in results:
         for k, v in m_nodes.items():
             maybe_nodes[k].extend(v)
         for k, v in m_edges.items():
-            maybe_edges[k].extend(v)
+            # it's undirected graph
+            maybe_edges[tuple(sorted(k))].extend(v)
     all_entities_data = await asyncio.gather(
         *[
             _merge_nodes_then_upsert(k, v, knwoledge_graph_inst, global_config)
@@ -155,6 +299,8 @@ async def extract_entities_dspy(
             for k, v in maybe_edges.items()
         ]
     )
+    if chunk_contributions is not None:
+        await chunk_contributions.upsert(_chunk_contributions(maybe_nodes, maybe_edges))
     if not len(all_entities_data):
         logger.warning("Didn't extract any entities, maybe your LLM is not working")
         return None
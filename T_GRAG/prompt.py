@@ -812,6 +812,58 @@ Output:
 """
 
 
+PROMPTS[
+    "summary_entity_extraction"
+] = """-Goal-
+Summarize the text document below and, in the same answer, identify all entities of the given types and all relationships among them.
+
+-Steps-
+1. Write a summary of the text in plain paragraphs. Cover the vast majority of the details, name entities explicitly instead of using pronouns, keep every time-related detail, and avoid quotation marks, lists and special symbols. Do not introduce it with "Here is the summary" or similar.
+Then output {summary_delimiter} on its own line.
+
+2. Identify all entities. For each identified entity, extract the following information:
+- entity_name: Name of the entity, capitalized
+- entity_type: One of the following types: [{entity_types}]
+- entity_description: Comprehensive description of the entity's attributes and activities
+Format each entity as ("entity"{tuple_delimiter}<entity_name>{tuple_delimiter}<entity_type>{tuple_delimiter}<entity_description>
+
+3. From the entities identified in step 2, identify all pairs of (source_entity, target_entity) that are *clearly related* to each other.
+For each pair of related entities, extract the following information:
+- source_entity: name of the source entity, as identified in step 2
+- target_entity: name of the target entity, as identified in step 2
+- relationship_description: explanation as to why you think the source entity and the target entity are related to each other
+- relationship_strength: a numeric score indicating strength of the relationship between the source entity and target entity
+ Format each relationship as ("relationship"{tuple_delimiter}<source_entity>{tuple_delimiter}<target_entity>{tuple_delimiter}<relationship_description>{tuple_delimiter}<relationship_strength>)
+
+4. After the summary, return in English a single list of all the entities and relationships identified in steps 2 and 3. Use **{record_delimiter}** as the list delimiter.
+
+5. When finished, output {completion_delimiter}
+
+######################
+-Example-
+######################
+Entity_types: [person, technology, mission, organization, location]
+Text:
+Tension threaded through the dialogue of beeps and static as communications with Washington buzzed in the background. Their connection to the stars solidified, the team moved to address the crystallizing warning, shifting from passive recipients to active participants, and Operation: Dulce hummed with the newfound frequency of their daring.
+#############
+Output:
+The team receives communications from Washington while working on Operation: Dulce. After a warning, the team changes from passive recipients of messages to active participants, and Operation: Dulce evolves to interact and prepare.
+{summary_delimiter}
+("entity"{tuple_delimiter}"Washington"{tuple_delimiter}"location"{tuple_delimiter}"Washington is a location where communications are being received, indicating its importance in the decision-making process."){record_delimiter}
+("entity"{tuple_delimiter}"Operation: Dulce"{tuple_delimiter}"mission"{tuple_delimiter}"Operation: Dulce is described as a mission that has evolved to interact and prepare, indicating a significant shift in objectives and activities."){record_delimiter}
+("entity"{tuple_delimiter}"The team"{tuple_delimiter}"organization"{tuple_delimiter}"The team is portrayed as a group of individuals who have transitioned from passive observers to active participants in a mission."){record_delimiter}
+("relationship"{tuple_delimiter}"The team"{tuple_delimiter}"Washington"{tuple_delimiter}"The team receives communications from Washington, which influences their decision-making process."{tuple_delimiter}7){record_delimiter}
+("relationship"{tuple_delimiter}"The team"{tuple_delimiter}"Operation: Dulce"{tuple_delimiter}"The team is directly involved in Operation: Dulce, executing its evolved objectives and activities."{tuple_delimiter}9){completion_delimiter}
+#############################
+-Real Data-
+######################
+Entity_types: {entity_types}
+Text: {input_text}
+######################
+Output:
+"""
+
+
 PROMPTS[
     "summarize_entity_descriptions"
 ] = """You are a helpful assistant responsible for generating a comprehensive summary of the data provided below.
@@ -843,6 +895,7 @@ PROMPTS["DEFAULT_ENTITY_TYPES"] = ["organization", "person", "geo", "event"]
 PROMPTS["DEFAULT_TUPLE_DELIMITER"] = "<|>"
 PROMPTS["DEFAULT_RECORD_DELIMITER"] = "##"
 PROMPTS["DEFAULT_COMPLETION_DELIMITER"] = "<|COMPLETE|>"
+PROMPTS["DEFAULT_SUMMARY_DELIMITER"] = "<|SUMMARY_END|>"
 
 PROMPTS[
     "local_rag_response"
@@ -2,12 +2,31 @@ import os
 import sys
 import logging
 import argparse
+import asyncio
+import socket
+import weakref
+from functools import wraps
 from pathlib import Path
+import networkx as nx
 from openai import AsyncOpenAI
 from time_graphrag import GraphRAG, QueryParam
 from time_graphrag.base import BaseKVStorage
-from time_graphrag._utils import compute_args_hash, wrap_embedding_func_with_attrs
-from sentence_transformers import SentenceTransformer
+from time_graphrag._manifest import IndexManifest
+from time_graphrag._op import get_chunks
+from time_graphrag._queue import WorkQueue, collect_partial_indexes
+from time_graphrag._storage import JsonKVStorage
+from time_graphrag._utils import (
+    EmbeddingFunc,
+    compute_args_hash,
+    compute_mdhash_id,
+    limits_attempts,
+    wrap_embedding_func_with_microbatch,
+)
+from time_graphrag._canonicalize import ALIASES_FILE, EntityCanonicalizer, save_aliases
+from time_graphrag._llm import _create_completion
+from time_graphrag._embedding import BulkEmbeddingExecutor, HashEncoder, SentenceTransformerEncoder
+from time_graphrag._mock import MockLatency, make_mock_complete, make_mock_embedding
+from time_graphrag.prompt import GRAPH_FIELD_SEP
 import numpy as np
 
 # Add parent directory to path for module imports
@@ -30,11 +49,176 @@ def parse_args():
         default=os.getenv("LLM_MODEL", "qwen"),
         help="Name of the chat model"
     )
+    parser.add_argument(
+        "--cheap-model",
+        default=os.getenv("CHEAP_LLM_MODEL", ""),
+        help="Cheaper chat model for the stages in --cheap-stages (default: --model)"
+    )
+    parser.add_argument(
+        "--cheap-stages",
+        default=os.getenv("CHEAP_STAGES", "summary,loop_check"),
+        help="Comma separated LLM call stages routed to --cheap-model, e.g. summary,loop_check,glean"
+    )
+    parser.add_argument(
+        "--fused-extraction",
+        action="store_true",
+        help="Summarize and extract each chunk with one LLM call instead of two"
+    )
+    parser.add_argument(
+        "--stream-records",
+        action="store_true",
+        help="Stream extraction answers and merge each record as it arrives (implies the streaming extraction pipeline)"
+    )
+    parser.add_argument(
+        "--dspy-extraction",
+        action="store_true",
+        help="Extract entities with the DSPy TypedEntityRelationshipExtractor (calls --model directly, not with --mock)"
+    )
+    parser.add_argument(
+        "--dspy-workers",
+        type=int,
+        default=8,
+        help="Threads running DSPy predictions"
+    )
+    parser.add_argument(
+        "--dspy-module",
+        default=None,
+        help="Compiled DSPy entity/relationship module to load"
+    )
+    parser.add_argument(
+        "--max-gleaning",
+        type=int,
+        default=1,
+        help="Maximum number of gleaning rounds per chunk"
+    )
+    parser.add_argument(
+        "--adaptive-gleaning",
+        action="store_true",
+        help="Skip gleaning rounds and loop checks that the yield signals already decide"
+    )
+    parser.add_argument(
+        "--canonicalize",
+        action="store_true",
+        help="Merge duplicate entity names within each year, then write the cross-year alias map for merge.py"
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Re-index changed year files in place: extract only new chunks and retract removed ones"
+    )
+    parser.add_argument(
+        "--compact-descriptions",
+        action="store_true",
+        help="Summarize each entity's oversized description set with the cheap model after indexing a year"
+    )
     parser.add_argument(
         "--embed-dir",
         default=os.getenv("EMBED_MODEL_DIR", "./models/embed"),
         help="Local path to the SentenceTransformer model"
     )
+    parser.add_argument(
+        "--index-dir",
+        default=os.getenv("INDEX_DIR", "./index/index_time"),
+        help="Root directory of the per-year working dirs"
+    )
+    parser.add_argument(
+        "--mock",
+        action="store_true",
+        help="Use the deterministic offline LLM/embedding backend instead of the API"
+    )
+    parser.add_argument(
+        "--mock-latency",
+        default=os.getenv("MOCK_LATENCY", "fixed"),
+        help="Simulated mock latency as distribution[,mean[,spread]], e.g. lognormal,0.8,0.3"
+    )
+    parser.add_argument(
+        "--mock-embedding-dim",
+        type=int,
+        default=1024,
+        help="Dimension of the mock hashing embedding"
+    )
+    parser.add_argument(
+        "--embedding-workers",
+        type=int,
+        default=int(os.getenv("EMBEDDING_WORKERS", "0")),
+        help="Embed on this many CPU worker processes, each loading the model once (0: one model on cuda:0)"
+    )
+    parser.add_argument(
+        "--adaptive-concurrency",
+        action="store_true",
+        help="Let an AIMD controller tune LLM/embedding concurrency instead of a fixed 16"
+    )
+    parser.add_argument(
+        "--adaptive-ceiling",
+        type=int,
+        default=int(os.getenv("ADAPTIVE_CEILING", "64")),
+        help="Most concurrent LLM (and embedding) calls the AIMD controller may reach; with --adaptive-concurrency it replaces --global-max-async as the shared limit"
+    )
+    parser.add_argument(
+        "--parallel-years",
+        type=int,
+        default=int(os.getenv("PARALLEL_YEARS", "1")),
+        help="Number of year indexes built concurrently in one event loop"
+    )
+    parser.add_argument(
+        "--global-max-async",
+        type=int,
+        default=int(os.getenv("GLOBAL_MAX_ASYNC", "16")),
+        help="Concurrent LLM calls shared by all year builds (embedding calls get a separate limit of the same size)"
+    )
+    parser.add_argument(
+        "--shared-llm-cache",
+        action="store_true",
+        help="Keep one LLM response cache in --index-dir for all years (implied by --parallel-years > 1)"
+    )
+    parser.add_argument(
+        "--dataset-dir",
+        default=os.getenv("DATASET_DIR", "./Dataset/audi_md"),
+        help="Directory of the per-year Markdown files"
+    )
+    parser.add_argument(
+        "--queue",
+        default=os.getenv("WORK_QUEUE", ""),
+        help="SQLite work queue shared by the workers (default: <index-dir>/work_queue.sqlite)"
+    )
+    parser.add_argument(
+        "--enqueue",
+        action="store_true",
+        help="Split every year file into chunk-range work items and add them to the queue"
+    )
+    parser.add_argument(
+        "--work",
+        action="store_true",
+        help="Claim work items from the queue until it is drained; run any number of these on hosts sharing the index dir"
+    )
+    parser.add_argument(
+        "--collect",
+        action="store_true",
+        help="Combine the partial indexes of the finished work items into the year working dirs"
+    )
+    parser.add_argument(
+        "--chunks-per-item",
+        type=int,
+        default=16,
+        help="Chunks per work item"
+    )
+    parser.add_argument(
+        "--lease-seconds",
+        type=float,
+        default=300,
+        help="How long a work item stays with a worker that stopped sending heartbeats"
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=3,
+        help="Attempts per work item before it is marked failed"
+    )
+    parser.add_argument(
+        "--worker-id",
+        default=f"{socket.gethostname()}-{os.getpid()}",
+        help="Name of this worker in the queue"
+    )
     parser.add_argument(
         "--log-level",
         default=os.getenv("LOG_LEVEL", "WARNING"),
@@ -53,7 +237,9 @@ logging.getLogger("time_graphrag").setLevel(logging.INFO)
 API_KEY = args.api_key
 BASE_URL = args.base_url
 MODEL   = args.model
+CHEAP_MODEL = args.cheap_model or MODEL
 
+@limits_attempts
 async def model_if_cache(
     prompt,
     system_prompt=None,
@@ -68,6 +254,7 @@ async def model_if_cache(
     and messages.
     """
     client = AsyncOpenAI(api_key=API_KEY, base_url=BASE_URL)
+    model = kwargs.pop("model", MODEL)
     messages = []
 
     if system_prompt:
@@ -75,50 +262,166 @@ async def model_if_cache(
 
     # Extract the cache storage if provided
     hashing_kv: BaseKVStorage = kwargs.pop("hashing_kv", None)
+    on_delta = kwargs.pop("on_delta", None)
 
     messages.extend(history_messages)
     messages.append({"role": "user", "content": prompt})
 
     # Check cache for existing response
     if hashing_kv is not None:
-        args_hash = compute_args_hash(MODEL, messages)
+        args_hash = compute_args_hash(model, messages)
         cached = await hashing_kv.get_by_id(args_hash)
         if cached is not None:
             return cached["return"]
 
-    # Make the API call
-    response = await client.chat.completions.create(
-        model=MODEL,
-        messages=messages,
-        **kwargs
+    # Make the API call, streaming the answer to on_delta if given; each
+    # attempt takes its own slot of the adaptive limiter, if enabled
+    content = await _create_completion(
+        client, on_delta, model=model, messages=messages, **kwargs
     )
 
     # Store response in cache if applicable
     if hashing_kv is not None:
         await hashing_kv.upsert({
             args_hash: {
-                "return": response.choices[0].message.content,
-                "model": MODEL
+                "return": content,
+                "model": model
             }
         })
 
-    return response.choices[0].message.content
+    return content
 
-# Initialize the embedding model
-EMBED_MODEL = SentenceTransformer(
-    args.embed_dir,
-    device="cuda:0"
-)
+@limits_attempts
+async def cheap_model_if_cache(prompt, system_prompt=None, history_messages=[], **kwargs) -> str:
+    """
+    Same as model_if_cache, but against the cheaper --cheap-model.
+    """
+    return await model_if_cache(
+        prompt, system_prompt=system_prompt, history_messages=history_messages,
+        model=CHEAP_MODEL, **kwargs
+    )
+
+BULK_EMBEDDER = None
+if args.embedding_workers > 0:
+    # Index-time embedding sharded across CPU worker processes
+    BULK_EMBEDDER = BulkEmbeddingExecutor(
+        HashEncoder(args.mock_embedding_dim)
+        if args.mock
+        else SentenceTransformerEncoder(args.embed_dir, device="cpu"),
+        num_workers=args.embedding_workers,
+    )
+
+if args.mock:
+    # Offline benchmarking: deterministic completions and hashing embeddings
+    model_if_cache = make_mock_complete(
+        latency=MockLatency.parse(args.mock_latency), model=MODEL
+    )
+    cheap_model_if_cache = make_mock_complete(
+        latency=MockLatency.parse(args.mock_latency), model=CHEAP_MODEL
+    )
+
+if BULK_EMBEDDER is not None:
+    local_embedding = BULK_EMBEDDER.embedding_func()
+elif args.mock:
+    local_embedding = make_mock_embedding(
+        embedding_dim=args.mock_embedding_dim,
+        latency=MockLatency.parse(args.mock_latency),
+    )
+else:
+    from sentence_transformers import SentenceTransformer
 
-@wrap_embedding_func_with_attrs(
-    embedding_dim=EMBED_MODEL.get_sentence_embedding_dimension(),
-    max_token_size=EMBED_MODEL.max_seq_length,
+    # Initialize the embedding model
+    EMBED_MODEL = SentenceTransformer(
+        args.embed_dir,
+        device="cuda:0"
+    )
+
+    @wrap_embedding_func_with_microbatch(
+        embedding_dim=EMBED_MODEL.get_sentence_embedding_dimension(),
+        max_token_size=EMBED_MODEL.max_seq_length,
+    )
+    def local_embedding(texts: list[str], query=None) -> np.ndarray:
+        """
+        Compute normalized sentence embeddings using a local SentenceTransformer model.
+        Runs in a worker thread on batches coalesced from concurrent callers.
+        """
+        return EMBED_MODEL.encode(texts, normalize_embeddings=True)
+
+def shared_limit(max_size):
+    """
+    Decorator factory: every function wrapped by the returned decorator takes
+    a slot of the same asyncio.Semaphore of max_size slots, released however
+    the call ends. Each event loop (one per asyncio.run) gets its own.
+    """
+    semaphores = weakref.WeakKeyDictionary()
+
+    def final_decro(func):
+        @wraps(func)
+        async def wait_func(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            if loop not in semaphores:
+                semaphores[loop] = asyncio.Semaphore(max_size)
+            async with semaphores[loop]:
+                return await func(*args, **kwargs)
+
+        return wait_func
+
+    return final_decro
+
+# One limit and (optionally) one LLM response cache across all year builds, so
+# running several GraphRAG instances at once doesn't multiply the API load.
+# Both model funcs share the LLM limit; embeddings have a limit of their own.
+# With --adaptive-concurrency the AIMD limiters do the limiting, per attempt;
+# the shared limits only cap them at their ceiling instead of a fixed size below it.
+GLOBAL_MAX_ASYNC = args.adaptive_ceiling if args.adaptive_concurrency else args.global_max_async
+global_llm_limit = shared_limit(GLOBAL_MAX_ASYNC)
+embedding_limit = shared_limit(GLOBAL_MAX_ASYNC)
+SHARED_LLM_CACHE = (
+    JsonKVStorage(namespace="llm_response_cache", global_config={"working_dir": args.index_dir})
+    # queue workers on several hosts would overwrite each other's cache file
+    if (args.shared_llm_cache or args.parallel_years > 1) and not args.work
+    else None
 )
-async def local_embedding(texts: list[str]) -> np.ndarray:
+
+DSPY_EXTRACTION = {}
+if args.dspy_extraction:
+    import dspy
+    from time_graphrag.entity_extraction.extract import extract_entities_dspy
+
+    # DSPy calls the model itself, past model_if_cache and the global limit;
+    # --dspy-workers bounds its concurrency instead
+    if hasattr(dspy, "LM"):
+        dspy_lm = dspy.LM(f"openai/{MODEL}", api_key=API_KEY, api_base=BASE_URL)
+    else:
+        dspy_lm = dspy.OpenAI(model=MODEL, api_key=API_KEY, api_base=BASE_URL)
+    dspy.settings.configure(lm=dspy_lm)
+    DSPY_EXTRACTION = dict(
+        entity_extraction_func=extract_entities_dspy,
+        dspy_extract_workers=args.dspy_workers,
+        use_compiled_dspy_entity_relationship=args.dspy_module is not None,
+        entity_relationship_module_path=args.dspy_module,
+    )
+
+def with_shared_cache(func):
     """
-    Compute normalized sentence embeddings using a local SentenceTransformer model.
+    Route the response cache of a model function to SHARED_LLM_CACHE, if enabled
+    and the caller passes no cache. GraphRAG passes SHARED_LLM_CACHE itself
+    (shared_llm_response_cache), wrapped so its usage report sees the hits.
     """
-    return EMBED_MODEL.encode(texts, normalize_embeddings=True)
+    @wraps(func)
+    async def cached_func(prompt, system_prompt=None, history_messages=[], **kwargs):
+        if SHARED_LLM_CACHE is not None and kwargs.get("hashing_kv") is None:
+            kwargs["hashing_kv"] = SHARED_LLM_CACHE
+        return await func(prompt, system_prompt=system_prompt, history_messages=history_messages, **kwargs)
+    return cached_func
+
+shared_model_func = global_llm_limit(with_shared_cache(model_if_cache))
+shared_cheap_model_func = global_llm_limit(with_shared_cache(cheap_model_if_cache))
+shared_embedding = EmbeddingFunc(
+    embedding_dim=local_embedding.embedding_dim,
+    max_token_size=local_embedding.max_token_size,
+    func=embedding_limit(local_embedding),
+)
 
 def remove_if_exist(filepath):
     """
@@ -130,10 +433,17 @@ def remove_if_exist(filepath):
 def insert(working_dir, filepath, timestamp):
     """
     Read the content of the given file and insert it into a GraphRAG index.
+    """
+    asyncio.run(ainsert(working_dir, filepath, timestamp))
+
+async def ainsert(working_dir, filepath, timestamp, chunk_range=None):
+    """
+    Read the content of the given file and insert it into a GraphRAG index.
 
     :param working_dir: Directory where the index will be stored
     :param filepath: Path to the Markdown file containing the text
     :param timestamp: A string representing the time context (e.g., year)
+    :param chunk_range: Only index the chunks in [start, end) (a queue work item)
     """
     from time import time
 
@@ -144,36 +454,232 @@ def insert(working_dir, filepath, timestamp):
     # Initialize GraphRAG with caching and embedding settings
     rag = GraphRAG(
         working_dir=working_dir,
-        enable_llm_cache=True,
-        best_model_func=model_if_cache,
-        cheap_model_func=model_if_cache,
-        embedding_func=local_embedding,
-        time=timestamp
+        shared_llm_response_cache=SHARED_LLM_CACHE,
+        best_model_func=shared_model_func,
+        cheap_model_func=shared_cheap_model_func,
+        embedding_func=shared_embedding,
+        time=timestamp,
+        model_routing_policy={
+            stage: "cheap_model" for stage in args.cheap_stages.split(",") if stage
+        },
+        enable_adaptive_concurrency=args.adaptive_concurrency,
+        adaptive_concurrency_ceiling=args.adaptive_ceiling,
+        entity_extract_fused_summary=args.fused_extraction,
+        entity_extract_max_gleaning=args.max_gleaning,
+        entity_extract_adaptive_gleaning=args.adaptive_gleaning,
+        entity_canonicalize=args.canonicalize,
+        entity_extract_streaming=args.stream_records,
+        entity_extract_stream_records=args.stream_records,
+        **DSPY_EXTRACTION,
+        write_usage_report=True,
+        model_names={
+            "best_model": MODEL,
+            "cheap_model": CHEAP_MODEL,
+            "embedding": "mock" if args.mock else args.embed_dir,
+        },
     )
 
     start = time()
-    rag.insert(text)
-    print("Indexing time:", time() - start)
+    if args.update and chunk_range is None:
+        await rag.aupdate(text)
+    else:
+        await rag.ainsert(text, chunk_range=chunk_range)
+    if args.compact_descriptions:
+        print(f"[{timestamp}] Description compaction:", await rag.acompact_descriptions())
+    if SHARED_LLM_CACHE is not None:
+        await SHARED_LLM_CACHE.index_done_callback()
+    print(f"[{timestamp}] Indexing time:", time() - start)
+    if args.adaptive_concurrency:
+        print(f"[{timestamp}] Concurrency:", rag.concurrency_metrics())
+    if BULK_EMBEDDER is not None:
+        print(f"[{timestamp}] Bulk embedding:", BULK_EMBEDDER.metrics())
+    totals = rag.usage_snapshot()["totals"]
+    print(
+        f"[{timestamp}] "
+        "Usage: calls={calls} cache_hits={cache_hits} prompt_tokens={prompt_tokens} "
+        "completion_tokens={completion_tokens}".format(**totals)
+    )
 
-def batch_insert(directory):
+def batch_insert(directory, parallel_years=None):
     """
     Process all Markdown files in the specified directory, building
     a separate index for each based on its filename (e.g., year.md).
+    Up to parallel_years (default --parallel-years) years are built at once.
     """
+    asyncio.run(abatch_insert(directory, parallel_years or args.parallel_years))
+
+async def abatch_insert(directory, parallel_years=1):
     # List all files in the directory
     files = os.listdir(directory)
     # Filter and sort by filename (without extension)
     names = sorted(f.split(".")[0] for f in files)
-    
-    for name in names:
-        print(f"Starting index build for {name}")
-        work_dir = f"./index/index_time/{name}"
-        os.makedirs(work_dir, exist_ok=True)
+    # Years are independent: each one writes only to its own working dir
+    pending = iter(names)
+
+    async def worker():
+        for name in pending:
+            print(f"Starting index build for {name}")
+            work_dir = os.path.join(args.index_dir, name)
+            os.makedirs(work_dir, exist_ok=True)
+            file_path = os.path.join(directory, f"{name}.md")
+            await ainsert(work_dir, file_path, str(name))
+            print(f"Completed index for {name}")
+
+    await asyncio.gather(*[worker() for _ in range(max(1, parallel_years))])
+
+def open_queue():
+    return WorkQueue(
+        args.queue or os.path.join(args.index_dir, "work_queue.sqlite"),
+        lease_seconds=args.lease_seconds,
+        max_attempts=args.max_attempts,
+    )
+
+def enqueue_years(directory):
+    """
+    Add one work item per --chunks-per-item chunks of every year file. Items
+    are keyed by document hash and chunk range, so enqueueing again only adds
+    the items of changed files.
+    """
+    queue = open_queue()
+    items = {}
+    for name in sorted(f.split(".")[0] for f in os.listdir(directory)):
         file_path = os.path.join(directory, f"{name}.md")
-        insert(work_dir, file_path, str(name))
-        print(f"Completed index for {name}")
+        with open(file_path, encoding="utf-8-sig") as f:
+            text = f.read().strip()
+        doc_id = compute_mdhash_id(text, prefix="doc-")
+        # same chunking as GraphRAG.ainsert with its defaults
+        chunks = get_chunks(
+            {doc_id: {"content": text}},
+            chunk_func=GraphRAG.chunk_func,
+            tiktoken_model_name=GraphRAG.tiktoken_model_name,
+            overlap_token_size=GraphRAG.chunk_overlap_token_size,
+            max_token_size=GraphRAG.chunk_token_size,
+        )
+        num_chunks = max((c["chunk_order_index"] for c in chunks.values()), default=-1) + 1
+        for start in range(0, num_chunks, args.chunks_per_item):
+            end = min(start + args.chunks_per_item, num_chunks)
+            items[compute_mdhash_id(f"{doc_id}|{start}|{end}", prefix="item-")] = {
+                "time": name,
+                "path": file_path,
+                "doc_id": doc_id,
+                "chunk_range": [start, end],
+            }
+    added = queue.enqueue(items)
+    print(f"Enqueued {added} new work items ({len(items)} in total):", queue.counts())
+
+async def heartbeat(queue, item_id):
+    """
+    Keep the lease of item_id while it is being indexed.
+    """
+    while True:
+        await asyncio.sleep(args.lease_seconds / 3)
+        if not await asyncio.to_thread(queue.heartbeat, item_id, args.worker_id):
+            print(f"[{args.worker_id}] Lost the lease of {item_id}, its result will be dropped")
+            return
+
+async def awork():
+    """
+    Claim and index work items until the queue is drained. Each item is
+    indexed into its own partial working dir, <index-dir>/<year>/parts/<item>.<worker>,
+    so a worker that lost its lease never writes into the dir of the one
+    that took the item over.
+    """
+    queue = open_queue()
+    # the queue calls block on its database lock, keep them off the event loop
+    # like heartbeat does
+    while True:
+        claimed = await asyncio.to_thread(queue.claim, args.worker_id)
+        if claimed is None:
+            if await asyncio.to_thread(queue.is_drained):
+                break
+            # other workers still hold items, wait for them or their leases to run out
+            await asyncio.sleep(min(10, args.lease_seconds / 3))
+            continue
+        item_id, item = claimed
+        part_dir = os.path.join(
+            args.index_dir, item["time"], "parts", f"{item_id}.{args.worker_id}"
+        )
+        os.makedirs(part_dir, exist_ok=True)
+        print(f"[{args.worker_id}] {item['time']} chunks {item['chunk_range']}")
+        keep_lease = asyncio.create_task(heartbeat(queue, item_id))
+        try:
+            await ainsert(part_dir, item["path"], item["time"], chunk_range=tuple(item["chunk_range"]))
+        except Exception as e:
+            await asyncio.to_thread(queue.fail, item_id, args.worker_id, repr(e))
+            print(f"[{args.worker_id}] {item_id} failed: {e!r}")
+            continue
+        finally:
+            keep_lease.cancel()
+        if not await asyncio.to_thread(queue.complete, item_id, args.worker_id, part_dir):
+            print(f"[{args.worker_id}] {item_id} was taken over by another worker, dropping {part_dir}")
+    print(f"[{args.worker_id}] Queue drained:", queue.counts())
+
+def collect_years():
+    """
+    Build each year working dir from the partial indexes of its finished
+    work items. Years with unfinished items of their current file are skipped.
+    """
+    queue = open_queue()
+    by_doc = {}
+    for item in queue.items():
+        by_doc.setdefault(item["payload"]["doc_id"], []).append(item)
+    for doc_id, items in by_doc.items():
+        year = items[0]["payload"]["time"]
+        with open(items[0]["payload"]["path"], encoding="utf-8-sig") as f:
+            if compute_mdhash_id(f.read().strip(), prefix="doc-") != doc_id:
+                continue  # items of an older version of the file
+        unfinished = [item["item_id"] for item in items if item["state"] != "done"]
+        if unfinished:
+            print(f"[{year}] {len(unfinished)} work items are not done, skipping")
+            continue
+        working_dir = os.path.join(args.index_dir, year)
+        part_dirs = sorted(item["output"] for item in items)
+        manifest = IndexManifest(working_dir)
+        inputs = {"parts": part_dirs}
+        if manifest.is_current("collect", inputs):
+            continue
+        print(f"[{year}] Collected:", collect_partial_indexes(part_dirs, working_dir))
+        manifest.record(
+            "collect",
+            inputs,
+            ["kv_store_full_docs.json", "kv_store_text_chunks.json", "graph_chunk_entity_relation.graphml"],
+        )
+
+async def canonicalize_years(index_dir):
+    """
+    Find entities duplicated across the year graphs (e.g. "AUDI AG" in one
+    year, "AUDI" in the next) and write the alias map that merge.py applies.
+    """
+    entities = {}
+    for name in sorted(os.listdir(index_dir)):
+        graph_file = os.path.join(index_dir, name, "graph_chunk_entity_relation.graphml")
+        if not os.path.exists(graph_file):
+            continue
+        for node_id, node_data in nx.read_graphml(graph_file).nodes(data=True):
+            entity = entities.setdefault(
+                node_id, {"entity_type": node_data.get("entity_type", ""), "weight": 0}
+            )
+            entity["weight"] += len(node_data.get("source_id", "").split(GRAPH_FIELD_SEP))
+
+    canonicalizer = EntityCanonicalizer(llm_func=shared_model_func, embedding_func=shared_embedding)
+    aliases = await canonicalizer.canonicalize(entities)
+    save_aliases(aliases, os.path.join(index_dir, ALIASES_FILE))
+    if SHARED_LLM_CACHE is not None:
+        await SHARED_LLM_CACHE.index_done_callback()
+    print("Cross-year canonicalization:", canonicalizer.stats)
 
 if __name__ == "__main__":
     # Example usage: process all files in './Dataset/audi_md'
-    dataset_dir = './Dataset/audi_md'
-    batch_insert(dataset_dir)
+    dataset_dir = args.dataset_dir
+    # Multi-worker indexing: --enqueue once, --work in any number of processes
+    # on hosts sharing --index-dir, then --collect before merge.py
+    if args.enqueue:
+        enqueue_years(dataset_dir)
+    if args.work:
+        asyncio.run(awork())
+    if args.collect:
+        collect_years()
+    if not (args.enqueue or args.work or args.collect):
+        batch_insert(dataset_dir)
+    if args.canonicalize:
+        asyncio.run(canonicalize_years(args.index_dir))
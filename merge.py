@@ -1,11 +1,45 @@
 import os
 import json
+import argparse
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
 import networkx as nx
+from time_graphrag._canonicalize import ALIASES_FILE, load_aliases, resolve_aliases, save_aliases
+from time_graphrag._chunk_store import CHUNK_REFS_FILE, MergedChunkStore
+from time_graphrag._manifest import IndexManifest
 
 # Define source and destination directories
 ROOT_DIR = './index/index_time'
 MERGED_DIR = './index/merge'
-os.makedirs(MERGED_DIR, exist_ok=True)
+
+# Files of a year working dir that feed the merge
+YEAR_FILES = [
+    'kv_store_full_docs.json',
+    'kv_store_text_chunks.json',
+    'graph_chunk_entity_relation.graphml',
+    'kv_store_chunk_summaries.json',
+    'kv_store_description_archive.json',
+    ALIASES_FILE,
+]
+MANIFEST_FILE = 'merge_manifest.json'
+# Files the merge writes, hashed into index_manifest.json of the merged dir
+MERGED_FILES = [
+    'kv_store_full_docs.json',
+    'kv_store_text_chunks.json',
+    CHUNK_REFS_FILE,
+    'kv_store_chunk_summaries.json',
+    'kv_store_description_archive.json',
+    'merged_graph.graphml',
+    ALIASES_FILE,
+]
+# Per-query slice files derived from the merged graph by GraphRAG.search_graph
+DERIVED_FILES = [
+    'vdb_entities.json',
+    'graph_chunk_entity_relation.graphml',
+]
 
 def remove_if_exists(path):
     """
@@ -14,92 +48,266 @@ def remove_if_exists(path):
     if os.path.exists(path):
         os.remove(path)
 
-# Remove any previous merged files to start fresh
-remove_if_exists(os.path.join(MERGED_DIR, 'kv_store_full_docs.json'))
-remove_if_exists(os.path.join(MERGED_DIR, 'kv_store_text_chunks.json'))
-remove_if_exists(os.path.join(MERGED_DIR, 'graph_chunk_entity_relation.graphml'))
+def load_json_file(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
 
-# Collect all subdirectories under the root directory
-working_dirs = [
-    os.path.join(ROOT_DIR, subdir)
-    for subdir in os.listdir(ROOT_DIR)
-    if os.path.isdir(os.path.join(ROOT_DIR, subdir))
-]
+def write_json_file(data, path):
+    # write a temp file and rename it, a crash mid-write keeps the old file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as out_f:
+        json.dump(data, out_f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+def year_fingerprint(wd):
+    """
+    md5 over the merge inputs of one year working dir.
+    """
+    digest = hashlib.md5()
+    for name in YEAR_FILES:
+        path = os.path.join(wd, name)
+        digest.update(name.encode())
+        if not os.path.exists(path):
+            digest.update(b'<missing>')
+            continue
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def load_year(wd, aliases=None):
+    """
+    Parse the merge inputs of one year working dir. Runs in a worker process,
+    so it only returns plain data: full docs, text chunks, chunk summaries,
+    archived raw descriptions of compacted description sets and the node and
+    edge lists of the year graph, with entity names mapped through the
+    cross-year aliases.
+    """
+    aliases = aliases or {}
+    # === Load full documents ===
+    with open(os.path.join(wd, 'kv_store_full_docs.json'), 'r', encoding='utf-8') as f:
+        full_docs = json.load(f)
+
+    # === Load text chunks (their time is the subdirectory name) ===
+    with open(os.path.join(wd, 'kv_store_text_chunks.json'), 'r', encoding='utf-8') as f:
+        chunks = json.load(f)
+
+    # === Load chunk summaries (keyed by chunk id and prompt version) ===
+    summaries = load_json_file(os.path.join(wd, 'kv_store_chunk_summaries.json'), {})
 
-# === Merge full documents from each subdirectory ===
-full_docs = {}
-for wd in working_dirs:
-    file_path = os.path.join(wd, 'kv_store_full_docs.json')
-    with open(file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-        full_docs.update(data)
-
-# Write the combined dictionary of full documents
-with open(os.path.join(MERGED_DIR, 'kv_store_full_docs.json'), 'w', encoding='utf-8') as out_f:
-    json.dump(full_docs, out_f, ensure_ascii=False, indent=4)
-
-print("Successfully merged full documents.")
-
-# === Merge text chunks and annotate with their source timestamp ===
-chunks = {}
-for wd in working_dirs:
-    file_path = os.path.join(wd, 'kv_store_text_chunks.json')
-    with open(file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-        timestamp = os.path.basename(wd)  # Use subdirectory name as timestamp
-        for key, chunk in data.items():
-            chunk["time"] = f"data from {timestamp}"
-        chunks.update(data)
-
-# Save the enriched, merged text chunks
-with open(os.path.join(MERGED_DIR, 'kv_store_text_chunks.json'), 'w', encoding='utf-8') as out_f:
-    json.dump(chunks, out_f, ensure_ascii=False, indent=4)
-
-print("Successfully merged text chunks with timestamps.")
-
-# === Merge multiple GraphML files into a single graph ===
-merged_graph = nx.Graph()
-merged_node_conflicts = 0
-merged_edge_conflicts = 0
-
-for wd in working_dirs:
+    # === Load compacted descriptions (keyed by entity name and time) ===
+    archive = load_json_file(os.path.join(wd, 'kv_store_description_archive.json'), {})
+
+    # === Load the year GraphML ===
     graph_file = os.path.join(wd, 'graph_chunk_entity_relation.graphml')
     if not os.path.exists(graph_file):
-        continue
-
-    # Load the individual graph
+        return full_docs, chunks, summaries, archive, [], []
     g = nx.read_graphml(graph_file)
+    nodes = [(aliases.get(n, n), attrs) for n, attrs in g.nodes(data=True)]
+    edges = [
+        (aliases.get(u, u), aliases.get(v, v), attrs)
+        for u, v, attrs in g.edges(data=True)
+        if aliases.get(u, u) != aliases.get(v, v)  # both ends are the same entity now
+    ]
+    return full_docs, chunks, summaries, archive, nodes, edges
+
+class GraphAggregator:
+    """
+    Collect node and edge attributes of several graphs into per-key lists and
+    join each of them with <SEP> once, instead of concatenating on every
+    conflict (quadratic for entities present in every year).
+    """
+
+    def __init__(self, graph=None):
+        self.nodes = {}
+        self.edges = {}
+        self.node_conflicts = 0
+        self.edge_conflicts = 0
+        if graph is not None:
+            # Values of an existing merged graph are already joined
+            for node_id, attrs in graph.nodes(data=True):
+                self.nodes[node_id] = {k: [v] for k, v in attrs.items()}
+            for u, v, attrs in graph.edges(data=True):
+                self.edges[(u, v)] = {k: [val] for k, val in attrs.items()}
+
+    @staticmethod
+    def _add(target, attrs):
+        for key, val in attrs.items():
+            target.setdefault(key, []).append(val)
+
+    def add(self, nodes, edges):
+        # Merge nodes, combining attributes on conflict
+        for node_id, attrs in nodes:
+            if node_id in self.nodes:
+                self.node_conflicts += 1
+            self._add(self.nodes.setdefault(node_id, {}), attrs)
+
+        # Merge edges (undirected), combining attributes on conflict
+        for u, v, attrs in edges:
+            key = (v, u) if (v, u) in self.edges else (u, v)
+            if key in self.edges:
+                self.edge_conflicts += 1
+            self._add(self.edges.setdefault(key, {}), attrs)
+
+    @staticmethod
+    def _materialize(attrs):
+        return {
+            key: vals[0] if len(vals) == 1 else "<SEP>".join(str(v) for v in vals)
+            for key, vals in attrs.items()
+        }
+
+    def to_graph(self):
+        merged_graph = nx.Graph()
+        for node_id, attrs in self.nodes.items():
+            merged_graph.add_node(node_id, **self._materialize(attrs))
+        for (u, v), attrs in self.edges.items():
+            merged_graph.add_edge(u, v, **self._materialize(attrs))
+        return merged_graph
+
+def merge(root_dir=ROOT_DIR, merged_dir=MERGED_DIR, full=False, workers=None):
+    """
+    Merge the year working dirs under root_dir into merged_dir.
+
+    Years are tracked by fingerprint in merge_manifest.json, so only new years
+    are read and appended to the existing merged graph and chunk store. The
+    chunk store holds each chunk content once with the years it appears in
+    and per-year references to it (see MergedChunkStore).
+    Conflicting attributes are concatenated with <SEP> and can't be taken
+    apart again, so a changed or removed year, a changed cross-year alias map
+    (root_dir/entity_aliases.json, see index_time.py --canonicalize) or
+    full=True rebuilds the merged stores from scratch. Year dirs are parsed by `workers` processes
+    (default: one per new year, up to the CPU count).
+    """
+    os.makedirs(merged_dir, exist_ok=True)
+    manifest_path = os.path.join(merged_dir, MANIFEST_FILE)
+    docs_path = os.path.join(merged_dir, 'kv_store_full_docs.json')
+    chunks_path = os.path.join(merged_dir, 'kv_store_text_chunks.json')
+    chunk_refs_path = os.path.join(merged_dir, CHUNK_REFS_FILE)
+    summaries_path = os.path.join(merged_dir, 'kv_store_chunk_summaries.json')
+    archive_path = os.path.join(merged_dir, 'kv_store_description_archive.json')
+    graph_path = os.path.join(merged_dir, 'merged_graph.graphml')
+    aliases_path = os.path.join(merged_dir, ALIASES_FILE)
+
+    # Collect all subdirectories under the root directory
+    years = sorted(
+        subdir
+        for subdir in os.listdir(root_dir)
+        if os.path.isdir(os.path.join(root_dir, subdir))
+    )
+    fingerprints = {year: year_fingerprint(os.path.join(root_dir, year)) for year in years}
+    cross_year_aliases = load_aliases(os.path.join(root_dir, ALIASES_FILE))
+    aliases_fingerprint = hashlib.md5(
+        json.dumps(cross_year_aliases, sort_keys=True).encode()
+    ).hexdigest()
+
+    manifest = load_json_file(manifest_path, {"years": {}})
+    merged_years = manifest["years"]
+    stale = [
+        year for year, entry in merged_years.items()
+        if fingerprints.get(year) != entry["fingerprint"]
+    ]
+    # manifests written before the alias map existed were merged without aliases
+    merged_aliases = manifest.get("aliases", hashlib.md5(b"{}").hexdigest())
+    aliases_changed = bool(merged_years) and merged_aliases != aliases_fingerprint
+    # merged files edited or lost since they were written can't be appended to
+    index_manifest = IndexManifest(merged_dir)
+    outputs_changed = "merge" in index_manifest.stages and not index_manifest.outputs_intact("merge")
+    if full or stale or aliases_changed or outputs_changed or not os.path.exists(graph_path):
+        if stale and not full:
+            print(f"Years changed or removed since the last merge: {stale}, rebuilding.")
+        elif aliases_changed and not full:
+            print("Cross-year entity aliases changed since the last merge, rebuilding.")
+        elif outputs_changed and not full:
+            print("Merged files changed since the last merge, rebuilding.")
+        merged_years = {}
+        full_docs, summaries, archive, aggregator = {}, {}, {}, GraphAggregator()
+        chunk_store = MergedChunkStore()
+    else:
+        full_docs = load_json_file(docs_path, {})
+        chunk_store = MergedChunkStore.load(merged_dir)
+        summaries = load_json_file(summaries_path, {})
+        archive = load_json_file(archive_path, {})
+        aggregator = GraphAggregator(nx.read_graphml(graph_path))
+
+    new_years = [year for year in years if year not in merged_years]
+    if not new_years:
+        print("Merged index is up to date.")
+        return
+
+    start = time.perf_counter()
+    wds = [os.path.join(root_dir, year) for year in new_years]
+    workers = min(workers or os.cpu_count() or 1, len(wds))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            loaded = list(pool.map(partial(load_year, aliases=cross_year_aliases), wds))
+    else:
+        loaded = [load_year(wd, cross_year_aliases) for wd in wds]
+    parse_seconds = time.perf_counter() - start
+
+    # Apply in sorted year order, whatever order the workers finished in
+    for year, (year_docs, year_chunks, year_summaries, year_archive, nodes, edges) in zip(new_years, loaded):
+        full_docs.update(year_docs)
+        chunk_store.add_time(year, year_chunks)
+        summaries.update(year_summaries)
+        archive.update(year_archive)
+        aggregator.add(nodes, edges)
+        merged_years[year] = {
+            "fingerprint": fingerprints[year],
+            "merged_at": datetime.now().isoformat(),
+        }
+        print(f"Merged year {year}.")
+
+    # Write the combined full documents and enriched text chunks
+    write_json_file(full_docs, docs_path)
+    write_json_file(chunk_store.chunks, chunks_path)
+    write_json_file(chunk_store.refs, chunk_refs_path)
+    write_json_file(summaries, summaries_path)
+    write_json_file(archive, archive_path)
+    print("Successfully merged full documents and text chunks: {chunks} unique chunks, "
+          "{references} year references, {shared} shared by several years.".format(**chunk_store.stats()))
+
+    # Every alias of every year to its final name, for the query side
+    all_aliases = {}
+    for year in years:
+        all_aliases.update(load_aliases(os.path.join(root_dir, year, ALIASES_FILE)))
+    all_aliases.update(cross_year_aliases)
+    save_aliases(resolve_aliases(all_aliases), aliases_path)
+
+    merged_graph = aggregator.to_graph()
+    merge_seconds = time.perf_counter() - start
+    read_items = sum(len(nodes) + len(edges) for _, _, _, _, nodes, edges in loaded)
+    print(f"Graph merge complete: {aggregator.node_conflicts} node attribute conflicts, "
+          f"{aggregator.edge_conflicts} edge attribute conflicts.")
+    print(f"Merged {len(new_years)} years ({read_items} nodes and edges) with {workers} "
+          f"workers in {merge_seconds:.2f}s (parse {parse_seconds:.2f}s), "
+          f"{read_items / max(merge_seconds, 1e-9):.0f} items/s.")
+    print(f"Final graph contains {merged_graph.number_of_nodes()} nodes "
+          f"and {merged_graph.number_of_edges()} edges.")
+
+    # Write out the merged graph
+    nx.write_graphml(merged_graph, f"{graph_path}.tmp")
+    os.replace(f"{graph_path}.tmp", graph_path)
+
+    # Slice graph and entity vectors were built from the old merged graph
+    for name in DERIVED_FILES:
+        remove_if_exists(os.path.join(merged_dir, name))
+
+    # Record the fingerprints last, so an interrupted merge is redone
+    write_json_file({"years": merged_years, "aliases": aliases_fingerprint}, manifest_path)
+    index_manifest.record(
+        "merge", {"years": fingerprints, "aliases": aliases_fingerprint}, MERGED_FILES
+    )
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Merge per-year indexes into one time-aware index")
+    parser.add_argument("--root-dir", default=ROOT_DIR, help="Directory holding one working dir per year")
+    parser.add_argument("--merged-dir", default=MERGED_DIR, help="Output directory of the merged index")
+    parser.add_argument("--full", action="store_true", help="Rebuild the merged index from scratch")
+    parser.add_argument("--workers", type=int, default=None, help="Processes parsing year dirs (default: one per new year, up to the CPU count)")
+    return parser.parse_args()
 
-    # Merge nodes, combining attributes on conflict
-    for node_id, attrs in g.nodes(data=True):
-        if node_id not in merged_graph:
-            merged_graph.add_node(node_id, **attrs)
-        else:
-            existing = merged_graph.nodes[node_id]
-            for key, val in attrs.items():
-                if key in existing:
-                    existing[key] = f"{existing[key]}<SEP>{val}"
-                else:
-                    existing[key] = val
-            merged_node_conflicts += 1
-
-    # Merge edges, combining attributes on conflict
-    for u, v, attrs in g.edges(data=True):
-        if merged_graph.has_edge(u, v):
-            existing = merged_graph[u][v]
-            for key, val in attrs.items():
-                if key in existing:
-                    existing[key] = f"{existing[key]}<SEP>{val}"
-                else:
-                    existing[key] = val
-            merged_edge_conflicts += 1
-        else:
-            merged_graph.add_edge(u, v, **attrs)
-
-print(f"Graph merge complete: {merged_node_conflicts} node attribute conflicts, "
-      f"{merged_edge_conflicts} edge attribute conflicts.")
-print(f"Final graph contains {merged_graph.number_of_nodes()} nodes "
-      f"and {merged_graph.number_of_edges()} edges.")
-
-# Write out the merged graph
-nx.write_graphml(merged_graph, os.path.join(MERGED_DIR, 'merged_graph.graphml'))
+if __name__ == "__main__":
+    args = parse_args()
+    merge(args.root_dir, args.merged_dir, full=args.full, workers=args.workers)
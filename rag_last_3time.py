@@ -5,7 +5,7 @@ import argparse
 from openai import AsyncOpenAI
 from T_GRAG import GraphRAG, QueryParam
 from T_GRAG.base import BaseKVStorage
-from T_GRAG._utils import compute_args_hash, wrap_embedding_func_with_attrs
+from T_GRAG._utils import compute_args_hash, wrap_embedding_func_with_microbatch
 from sentence_transformers import SentenceTransformer
 import numpy as np
 from T_GRAG.prompt import PROMPTS
@@ -70,11 +70,12 @@ def remove_if_exist(file):
 
 EMBED_MODEL = SentenceTransformer(args.embed_dir, trust_remote_code=True, device="cuda:0")
 
-@wrap_embedding_func_with_attrs(
+# Concurrent calls are coalesced into batches and encoded in a worker thread
+@wrap_embedding_func_with_microbatch(
     embedding_dim=EMBED_MODEL.get_sentence_embedding_dimension(),
     max_token_size=EMBED_MODEL.max_seq_length,
 )
-async def local_embedding(texts: list[str], query=None) -> np.ndarray:
+def local_embedding(texts: list[str], query=None) -> np.ndarray:
     if query is None:
         return EMBED_MODEL.encode(texts, normalize_embeddings=True)
     elif query is True:
@@ -109,8 +110,6 @@ def deal_llm_output(llm_answer):
 
 def query(question, query_time, type):
     # Remove previous run artifacts
-    remove_if_exist(f"{WORKING_DIR}/vdb_entities.json")
-    remove_if_exist(f"{WORKING_DIR}/graph_chunk_entity_relation.graphml")
     remove_if_exist(f"{WORKING_DIR}/kv_store_llm_response_cache.json")
     
     rag = GraphRAG(
@@ -0,0 +1,304 @@
+import asyncio
+import json
+import os
+import re
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+
+from .prompt import PROMPTS
+
+ALIASES_FILE = "entity_aliases.json"
+
+# legal form suffixes dropped from the blocking key, "AUDI AG" -> "AUDI"
+LEGAL_SUFFIXES = {
+    "AG", "INC", "LTD", "LIMITED", "CO", "CORP", "CORPORATION", "COMPANY",
+    "GMBH", "LLC", "PLC", "SA", "SE", "NV", "BV", "KG",
+}
+UNKNOWN_TYPES = {"", "UNKNOWN"}
+
+
+def _display_name(name: str) -> str:
+    return name.strip().strip('"').strip()
+
+
+def normalize_entity_name(name: str) -> str:
+    """Blocking key of an entity name: case, punctuation, a leading THE and
+    trailing legal form suffixes don't matter"""
+    key = unicodedata.normalize("NFKC", name).upper()
+    words = re.sub(r"[^\w\s]", " ", key).split()
+    if len(words) > 1 and words[0] == "THE":
+        words = words[1:]
+    while len(words) > 1 and words[-1] in LEGAL_SUFFIXES:
+        words.pop()
+    return " ".join(words)
+
+
+def _char_ngrams(key: str, n: int) -> set[str]:
+    padded = f" {key} "
+    return {padded[i : i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+
+def _normalize_type(entity_type: str) -> str:
+    return _display_name(entity_type or "").upper()
+
+
+def resolve_aliases(aliases: dict[str, str]) -> dict[str, str]:
+    """Follow alias chains (a -> b -> c becomes a -> c, b -> c), drop self maps"""
+    resolved = {}
+    for alias in aliases:
+        seen = {alias}
+        canonical = aliases[alias]
+        while canonical in aliases and canonical not in seen:
+            seen.add(canonical)
+            canonical = aliases[canonical]
+        if canonical != alias:
+            resolved[alias] = canonical
+    return resolved
+
+
+def load_aliases(file_name: str) -> dict[str, str]:
+    if not os.path.exists(file_name):
+        return {}
+    with open(file_name, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_aliases(aliases: dict[str, str], file_name: str):
+    with open(file_name, "w", encoding="utf-8") as f:
+        json.dump(dict(sorted(aliases.items())), f, ensure_ascii=False, indent=2)
+
+
+def apply_aliases(aliases: dict[str, str], maybe_nodes: dict, maybe_edges: dict):
+    """Rename extracted nodes and edges to their canonical names.
+
+    Nodes that end up with the same name are concatenated, edges are re-keyed
+    (undirected) and the ones between two aliases of the same entity dropped.
+    """
+    if not aliases:
+        return maybe_nodes, maybe_edges
+    nodes = defaultdict(list)
+    for name, dps in maybe_nodes.items():
+        canonical = aliases.get(name, name)
+        for dp in dps:
+            dp["entity_name"] = canonical
+        nodes[canonical].extend(dps)
+    edges = defaultdict(list)
+    for (src, tgt), dps in maybe_edges.items():
+        src, tgt = aliases.get(src, src), aliases.get(tgt, tgt)
+        if src == tgt:
+            continue
+        for dp in dps:
+            dp["src_id"] = aliases.get(dp["src_id"], dp["src_id"])
+            dp["tgt_id"] = aliases.get(dp["tgt_id"], dp["tgt_id"])
+        edges[tuple(sorted((src, tgt)))].extend(dps)
+    return nodes, edges
+
+
+def fold_aliases(name_keyed: dict[str, dict], aliases: dict[str, str]) -> dict[str, dict]:
+    """Merge the per-name dicts of aliases into the one of their canonical name"""
+    folded = {}
+    for name, value in name_keyed.items():
+        folded.setdefault(aliases.get(name, name), {}).update(value)
+    return folded
+
+
+class _UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int):
+        self.parent[self.find(i)] = self.find(j)
+
+
+class EntityCanonicalizer:
+    """Find duplicate entity names without sending every name to the LLM.
+
+    Names are blocked in three cheap passes:
+
+    1. names with the same ``normalize_entity_name`` key and compatible
+       entity types are merged right away;
+    2. key groups sharing enough character n-grams (Jaccard of at least
+       ``ngram_threshold``, n-grams in more than ``max_ngram_block`` keys are
+       too common to block on) become candidates;
+    3. so do the ``embedding_neighbors`` nearest key groups by name embedding
+       with a cosine similarity of at least ``embedding_threshold``.
+
+    Candidate clusters of at most ``max_llm_cluster`` key groups are checked
+    with the ``merge_extraction`` prompt; larger ones are left alone.  The
+    canonical name of a group is its most mentioned name.
+    """
+
+    def __init__(
+        self,
+        llm_func: callable = None,
+        embedding_func: callable = None,
+        ngram_size: int = 3,
+        ngram_threshold: float = 0.6,
+        max_ngram_block: int = 64,
+        embedding_threshold: float = 0.9,
+        embedding_neighbors: int = 5,
+        embedding_batch_size: int = 64,
+        max_llm_cluster: int = 8,
+    ):
+        self.llm_func = llm_func
+        self.embedding_func = embedding_func
+        self.ngram_size = ngram_size
+        self.ngram_threshold = ngram_threshold
+        self.max_ngram_block = max_ngram_block
+        self.embedding_threshold = embedding_threshold
+        self.embedding_neighbors = embedding_neighbors
+        self.embedding_batch_size = embedding_batch_size
+        self.max_llm_cluster = max_llm_cluster
+        self.stats = {}
+
+    @staticmethod
+    def _representative(names: list[str], entities: dict[str, dict]) -> str:
+        return min(names, key=lambda n: (-entities[n].get("weight", 1), len(n), n))
+
+    def _key_groups(self, entities: dict[str, dict]) -> list[list[str]]:
+        by_key = defaultdict(list)
+        for name in entities:
+            by_key[normalize_entity_name(_display_name(name))].append(name)
+        groups = []
+        for names in by_key.values():
+            # one group per entity type, names without a type join the largest
+            by_type = defaultdict(list)
+            for name in names:
+                by_type[_normalize_type(entities[name].get("entity_type"))].append(name)
+            untyped = [n for t in UNKNOWN_TYPES for n in by_type.pop(t, [])]
+            typed = sorted(by_type.values(), key=len, reverse=True)
+            if typed:
+                typed[0].extend(untyped)
+            else:
+                typed = [untyped]
+            groups.extend(typed)
+        return groups
+
+    def _ngram_pairs(self, keys: list[str]) -> set[tuple[int, int]]:
+        grams = [_char_ngrams(key, self.ngram_size) for key in keys]
+        postings = defaultdict(list)
+        for i, key_grams in enumerate(grams):
+            for gram in key_grams:
+                postings[gram].append(i)
+        shared = defaultdict(int)
+        for ids in postings.values():
+            if len(ids) > self.max_ngram_block:
+                continue
+            for a in range(len(ids)):
+                for b in range(a + 1, len(ids)):
+                    shared[(ids[a], ids[b])] += 1
+        return {
+            (i, j)
+            for (i, j), common in shared.items()
+            if common / (len(grams[i]) + len(grams[j]) - common) >= self.ngram_threshold
+        }
+
+    async def _embedding_pairs(self, names: list[str]) -> set[tuple[int, int]]:
+        if self.embedding_func is None or len(names) < 2:
+            return set()
+        batches = [
+            names[i : i + self.embedding_batch_size]
+            for i in range(0, len(names), self.embedding_batch_size)
+        ]
+        vectors = np.concatenate(
+            await asyncio.gather(*[self.embedding_func(batch) for batch in batches])
+        ).astype(np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        k = min(self.embedding_neighbors + 1, len(names))
+        pairs = set()
+        # exact top-k in row blocks, so the similarity matrix is never n x n
+        for start in range(0, len(names), 1024):
+            sims = vectors[start : start + 1024] @ vectors.T
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            for row, neighbors in enumerate(top):
+                i = start + row
+                for j in neighbors:
+                    if j != i and sims[row, j] >= self.embedding_threshold:
+                        pairs.add((min(i, int(j)), max(i, int(j))))
+        return pairs
+
+    async def _ask_llm(self, names: list[str]) -> list[list[str]]:
+        """Groups of ``names`` the LLM says are the same entity, canonical first"""
+        by_display = {_display_name(n).upper(): n for n in names}
+        response = await self.llm_func(
+            PROMPTS["merge_extraction"].format(
+                entity_names=", ".join(_display_name(n) for n in names)
+            )
+        )
+        groups = []
+        for item in response.split("<SEP>"):
+            if "---" not in item:
+                continue
+            members = []
+            for part in item.split("---"):
+                name = by_display.get(_display_name(part).upper())
+                if name is not None and name not in members:
+                    members.append(name)
+            if len(members) > 1:
+                groups.append(members)
+        return groups
+
+    async def canonicalize(self, entities: dict[str, dict]) -> dict[str, str]:
+        """{alias: canonical name} for ``entities`` ({name: {"entity_type", "weight"}})"""
+        groups = self._key_groups(entities)
+        representatives = [self._representative(names, entities) for names in groups]
+        # key groups of different types don't block with each other
+        group_types = [
+            _normalize_type(entities[r].get("entity_type")) for r in representatives
+        ]
+        keys = [normalize_entity_name(_display_name(r)) for r in representatives]
+        candidates = self._ngram_pairs(keys) | await self._embedding_pairs(
+            [_display_name(r) for r in representatives]
+        )
+        candidates = {(i, j) for i, j in candidates if group_types[i] == group_types[j]}
+
+        union = _UnionFind(len(groups))
+        for i, j in candidates:
+            union.union(i, j)
+        clusters = defaultdict(list)
+        for i in range(len(groups)):
+            clusters[union.find(i)].append(i)
+        ambiguous = [c for c in clusters.values() if len(c) > 1]
+        asked = [c for c in ambiguous if len(c) <= self.max_llm_cluster]
+        if self.llm_func is None:
+            asked = []
+
+        merged = _UnionFind(len(groups))
+        answers = await asyncio.gather(
+            *[self._ask_llm([representatives[i] for i in cluster]) for cluster in asked]
+        )
+        index_of = {r: i for i, r in enumerate(representatives)}
+        firsts = []
+        for llm_groups in answers:
+            for members in llm_groups:
+                firsts.append(index_of[members[0]])
+                for name in members[1:]:
+                    merged.union(index_of[name], firsts[-1])
+        # the LLM names the canonical entity first
+        canonical_group = {merged.find(first): first for first in firsts}
+
+        aliases = {}
+        for i, names in enumerate(groups):
+            root = merged.find(i)
+            canonical = representatives[canonical_group.get(root, root)]
+            for name in names:
+                if name != canonical:
+                    aliases[name] = canonical
+        self.stats = {
+            "entities": len(entities),
+            "key_groups": len(groups),
+            "candidate_pairs": len(candidates),
+            "ambiguous_clusters": len(ambiguous),
+            "llm_clusters": len(asked),
+            "skipped_clusters": len(ambiguous) - len(asked),
+            "aliases": len(aliases),
+        }
+        return aliases
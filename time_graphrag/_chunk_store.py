@@ -0,0 +1,93 @@
+import os
+
+from ._utils import load_json
+
+CHUNKS_FILE = "kv_store_text_chunks.json"
+CHUNK_REFS_FILE = "kv_store_chunk_refs.json"
+
+_LABEL_PREFIX = "data from "
+
+
+def chunk_times(chunk: dict) -> list[str]:
+    """Times a chunk of a merged index appears in, also for chunk stores
+    merged before, whose chunks carry one "data from {time}" label"""
+    if "times" in chunk:
+        return chunk["times"]
+    label = chunk.get("time")
+    if label is None:
+        return []
+    return [label[len(_LABEL_PREFIX):] if label.startswith(_LABEL_PREFIX) else label]
+
+
+def chunk_time_label(chunk: dict) -> str:
+    return ", ".join(f"{_LABEL_PREFIX}{time}" for time in chunk_times(chunk))
+
+
+def _ref(chunk: dict) -> dict:
+    return {
+        "full_doc_id": chunk.get("full_doc_id"),
+        "chunk_order_index": chunk.get("chunk_order_index"),
+    }
+
+
+class MergedChunkStore:
+    """Text chunks of every time of a merged index, each content stored once.
+
+    Chunk ids are the md5 of their content (see _chunk_document), so a text
+    that appears in the reports of several times has one id in every year
+    working dir.  ``chunks`` holds its content and tokens once, with the
+    sorted ``times`` it appears in; ``refs`` is the per-time view, {time:
+    {chunk id: {full_doc_id, chunk_order_index}}}, referencing it.  The query
+    side filters chunks by time on the refs instead of loading every content.
+    """
+
+    def __init__(self, chunks: dict = None, refs: dict = None):
+        self.chunks = {}
+        self.refs = {time: dict(time_refs) for time, time_refs in (refs or {}).items()}
+        for key, chunk in (chunks or {}).items():
+            self.chunks[key] = {
+                "content": chunk["content"],
+                "tokens": chunk.get("tokens"),
+                "times": list(chunk_times(chunk)),
+            }
+            if refs is None:
+                # stores merged before kept one time and the doc fields of the last year
+                for time in self.chunks[key]["times"]:
+                    self.refs.setdefault(time, {})[key] = _ref(chunk)
+
+    @classmethod
+    def load(cls, working_dir: str) -> "MergedChunkStore":
+        return cls(
+            load_json(os.path.join(working_dir, CHUNKS_FILE)) or {},
+            load_json(os.path.join(working_dir, CHUNK_REFS_FILE)),
+        )
+
+    def add_time(self, time: str, chunks: dict[str, dict]):
+        """Add the text chunks of one year working dir"""
+        time_refs = self.refs.setdefault(time, {})
+        for key, chunk in chunks.items():
+            entry = self.chunks.get(key)
+            if entry is None:
+                entry = self.chunks[key] = {
+                    "content": chunk["content"],
+                    "tokens": chunk.get("tokens"),
+                    "times": [],
+                }
+            if time not in entry["times"]:
+                entry["times"] = sorted(entry["times"] + [time])
+            time_refs[key] = _ref(chunk)
+
+    def stats(self) -> dict:
+        return {
+            "chunks": len(self.chunks),
+            "references": sum(len(time_refs) for time_refs in self.refs.values()),
+            "shared": sum(1 for entry in self.chunks.values() if len(entry["times"]) > 1),
+        }
+
+
+def load_time_chunk_ids(working_dir: str) -> dict[str, set[str]]:
+    """{time: ids of its chunks} of a merged index"""
+    refs = load_json(os.path.join(working_dir, CHUNK_REFS_FILE))
+    if refs is None:
+        refs = MergedChunkStore(load_json(os.path.join(working_dir, CHUNKS_FILE)) or {}).refs
+    return {time: set(time_refs) for time, time_refs in refs.items()}
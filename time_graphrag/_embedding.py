@@ -0,0 +1,176 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ._utils import EmbeddingFunc, logger
+
+# the encoder of a worker process, loaded once by _init_worker
+_WORKER_ENCODER = None
+
+
+def _init_worker(encoder_factory):
+    global _WORKER_ENCODER
+    _WORKER_ENCODER = encoder_factory()
+
+
+def _encode_shard(texts: list[str], query=None) -> np.ndarray:
+    return np.asarray(_WORKER_ENCODER(texts, query=query), dtype=np.float32)
+
+
+class SentenceTransformerEncoder:
+    """Picklable factory of a SentenceTransformer ``encode``, called once in
+    every worker process of a BulkEmbeddingExecutor"""
+
+    def __init__(self, model_dir: str, device: str = "cpu", normalize_embeddings: bool = True):
+        self.model_dir = model_dir
+        self.device = device
+        self.normalize_embeddings = normalize_embeddings
+
+    def __call__(self):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        # the pool provides the parallelism, one intra-op thread per worker
+        torch.set_num_threads(1)
+        model = SentenceTransformer(self.model_dir, device=self.device)
+
+        def encode(texts: list[str], query=None) -> np.ndarray:
+            return model.encode(texts, normalize_embeddings=self.normalize_embeddings)
+
+        return encode
+
+
+class HashEncoder:
+    """Picklable factory of the mock hashing embedding, for offline runs"""
+
+    def __init__(self, embedding_dim: int = 1536):
+        self.embedding_dim = embedding_dim
+
+    def __call__(self):
+        from ._mock import hash_embedding
+
+        def encode(texts: list[str], query=None) -> np.ndarray:
+            return hash_embedding(texts, self.embedding_dim)
+
+        return encode
+
+
+class BulkEmbeddingExecutor:
+    """Embed large text sets on a pool of worker processes.
+
+    ``encoder_factory`` is a picklable callable returning a sync
+    ``encode(texts, query=None)``; every worker calls it once at start, so a
+    local model is loaded ``num_workers`` times in total.  ``embed`` cuts its
+    texts into shards of ``shard_size``, runs them on the pool and returns
+    the vectors in input order, so a CPU-only model uses every core instead
+    of one.  ``embedding_func`` gives an EmbeddingFunc for GraphRAG, whose
+    vector storages then embed entity upserts and slice rebuilds through the
+    pool.  ``metrics`` reports texts/sec over the time the pool was busy.
+    Without ``embedding_dim`` it is read from one encoded text.
+
+    With the fork start method all workers are started by the first shard,
+    so create the executor (and call ``embedding_func``) before the process
+    starts threads or imports the model itself; the factory should import
+    heavy libraries like torch inside the worker.
+    """
+
+    def __init__(
+        self,
+        encoder_factory: callable,
+        embedding_dim: int = None,
+        max_token_size: int = 8192,
+        num_workers: int = None,
+        shard_size: int = 64,
+    ):
+        self.encoder_factory = encoder_factory
+        self.embedding_dim = embedding_dim
+        self.max_token_size = max_token_size
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.shard_size = shard_size
+        self._pool = None
+        self._texts = 0
+        self._shards = 0
+        self._busy_seconds = 0.0
+        self._in_flight = 0
+        self._busy_since = None
+
+    def __deepcopy__(self, memo):
+        # shared by every asdict(global_config) copy, like its pool
+        return self
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                initializer=_init_worker,
+                initargs=(self.encoder_factory,),
+            )
+        return self._pool
+
+    def _start(self):
+        if self._in_flight == 0:
+            self._busy_since = time.perf_counter()
+        self._in_flight += 1
+
+    def _stop(self):
+        self._in_flight -= 1
+        if self._in_flight == 0:
+            self._busy_seconds += time.perf_counter() - self._busy_since
+
+    async def embed(self, texts: list[str], query=None) -> np.ndarray:
+        if not len(texts):
+            return np.empty((0, self.embedding_dim), dtype=np.float32)
+        loop = asyncio.get_running_loop()
+        shards = [
+            texts[i : i + self.shard_size] for i in range(0, len(texts), self.shard_size)
+        ]
+        self._start()
+        try:
+            embeddings = await asyncio.gather(
+                *[
+                    loop.run_in_executor(self.pool, _encode_shard, shard, query)
+                    for shard in shards
+                ]
+            )
+        finally:
+            self._stop()
+        self._texts += len(texts)
+        self._shards += len(shards)
+        return np.concatenate(embeddings)
+
+    def embedding_func(self) -> EmbeddingFunc:
+        if self.embedding_dim is None:
+            probe = self.pool.submit(_encode_shard, ["embedding dimension probe"]).result()
+            self.embedding_dim = probe.shape[1]
+        return EmbeddingFunc(
+            embedding_dim=self.embedding_dim,
+            max_token_size=self.max_token_size,
+            func=self.embed,
+        )
+
+    def metrics(self) -> dict:
+        busy_seconds = self._busy_seconds
+        if self._in_flight:
+            busy_seconds += time.perf_counter() - self._busy_since
+        return {
+            "workers": self.num_workers,
+            "texts": self._texts,
+            "shards": self._shards,
+            "seconds": round(busy_seconds, 3),
+            "texts_per_sec": round(self._texts / busy_seconds, 1) if busy_seconds else 0.0,
+        }
+
+    def log_metrics(self):
+        logger.info(
+            "[Bulk Embedding] {texts} texts in {shards} shards on {workers} workers, "
+            "{seconds}s, {texts_per_sec} texts/sec".format(**self.metrics())
+        )
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
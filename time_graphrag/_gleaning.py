@@ -0,0 +1,115 @@
+import json
+import os
+from typing import Optional
+
+
+class GleaningPolicy:
+    """Decide from cheap signals whether another gleaning round is worth a call.
+
+    ``decide`` answers ``True`` (glean, no ``loop_check`` call needed),
+    ``False`` (stop) or ``None`` (undecided, ask the model with
+    ``entiti_if_loop_extraction`` as before).  With ``adaptive=False`` it
+    reproduces the fixed behaviour: the first round always gleans and every
+    later one asks the model.
+
+    The adaptive signals are the record density of the first extraction
+    (records per 1k tokens of the extraction input) and the number of new
+    records the previous gleaning round produced:
+
+    - inputs shorter than ``min_input_tokens`` are not gleaned,
+    - neither are first passes with ``saturated_records_per_1k`` or more,
+    - a round with fewer than ``min_new_records`` new records stops gleaning,
+    - one with ``confident_new_records`` or more gleans again without asking.
+    """
+
+    def __init__(
+        self,
+        max_gleaning: int,
+        adaptive: bool = False,
+        min_input_tokens: int = 200,
+        saturated_records_per_1k: float = 12.0,
+        min_new_records: int = 1,
+        confident_new_records: int = 4,
+    ):
+        self.max_gleaning = max_gleaning
+        self.adaptive = adaptive
+        self.min_input_tokens = min_input_tokens
+        self.saturated_records_per_1k = saturated_records_per_1k
+        self.min_new_records = min_new_records
+        self.confident_new_records = confident_new_records
+
+    def decide(
+        self,
+        round_index: int,
+        input_tokens: int,
+        records: int,
+        last_new_records: Optional[int] = None,
+    ) -> tuple[Optional[bool], str]:
+        """Whether to run gleaning round ``round_index`` (0-based), and why"""
+        if round_index >= self.max_gleaning:
+            return False, "max_gleaning"
+        if not self.adaptive:
+            return (True, "first_round") if round_index == 0 else (None, "ask")
+        if round_index == 0:
+            if input_tokens < self.min_input_tokens:
+                return False, "short_input"
+            if records * 1000 >= self.saturated_records_per_1k * max(input_tokens, 1):
+                return False, "saturated"
+            return True, "first_round"
+        if last_new_records < self.min_new_records:
+            return False, "low_yield"
+        if last_new_records >= self.confident_new_records:
+            return True, "high_yield"
+        return None, "ask"
+
+
+class GleaningStats:
+    """Per-chunk gleaning records of one extraction run, for tuning the policy"""
+
+    FILE_NAME = "gleaning_stats.jsonl"
+
+    def __init__(self, working_dir: str, run: str = None):
+        self.file_name = os.path.join(working_dir, self.FILE_NAME)
+        self.run = run
+        self.chunks: list[dict] = []
+
+    def add(
+        self,
+        chunk_key: str,
+        input_tokens: int,
+        initial_records: int,
+        new_records: list[int],
+        loop_checks: int,
+        skipped_loop_checks: int,
+        stop_reason: str,
+    ):
+        self.chunks.append(
+            {
+                "run": self.run,
+                "chunk_key": chunk_key,
+                "input_tokens": input_tokens,
+                "initial_records": initial_records,
+                "new_records": new_records,
+                "loop_checks": loop_checks,
+                "skipped_loop_checks": skipped_loop_checks,
+                "stop_reason": stop_reason,
+            }
+        )
+
+    def summary(self) -> dict:
+        rounds = [n for c in self.chunks for n in c["new_records"]]
+        return {
+            "chunks": len(self.chunks),
+            "glean_calls": len(rounds),
+            "glean_new_records": sum(rounds),
+            "loop_checks": sum(c["loop_checks"] for c in self.chunks),
+            "skipped_loop_checks": sum(c["skipped_loop_checks"] for c in self.chunks),
+        }
+
+    def write(self):
+        """Append one JSON line per chunk"""
+        if not self.chunks:
+            return
+        with open(self.file_name, "a", encoding="utf-8") as f:
+            for chunk in self.chunks:
+                f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
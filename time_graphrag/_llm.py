@@ -10,7 +10,12 @@ from tenacity import (
 )
 import os
 
-from ._utils import compute_args_hash, wrap_embedding_func_with_attrs
+from ._utils import (
+    compute_args_hash,
+    limited_attempt,
+    limits_attempts,
+    wrap_embedding_func_with_attrs,
+)
 from .base import BaseKVStorage
 
 global_openai_async_client = None
@@ -31,6 +36,23 @@ def get_azure_openai_async_client_instance():
     return global_azure_openai_async_client
 
 
+async def _create_completion(client, on_delta=None, **kwargs) -> str:
+    """Content of a chat completion, streamed to on_delta(text) if given.
+    One attempt of the retry of its caller, under the adaptive limiter"""
+    async with limited_attempt():
+        if on_delta is None:
+            response = await client.chat.completions.create(**kwargs)
+            return response.choices[0].message.content
+        content = []
+        async for chunk in await client.chat.completions.create(stream=True, **kwargs):
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                on_delta(delta)
+                content.append(delta)
+        return "".join(content)
+
+
+@limits_attempts
 @retry(
     stop=stop_after_attempt(5),
     wait=wait_exponential(multiplier=1, min=4, max=10),
@@ -41,6 +63,7 @@ async def openai_complete_if_cache(
 ) -> str:
     openai_async_client = get_openai_async_client_instance()
     hashing_kv: BaseKVStorage = kwargs.pop("hashing_kv", None)
+    on_delta = kwargs.pop("on_delta", None)
     messages = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
@@ -52,18 +75,17 @@ async def openai_complete_if_cache(
         if if_cache_return is not None:
             return if_cache_return["return"]
 
-    response = await openai_async_client.chat.completions.create(
-        model=model, messages=messages, **kwargs
+    content = await _create_completion(
+        openai_async_client, on_delta, model=model, messages=messages, **kwargs
     )
 
     if hashing_kv is not None:
-        await hashing_kv.upsert(
-            {args_hash: {"return": response.choices[0].message.content, "model": model}}
-        )
+        await hashing_kv.upsert({args_hash: {"return": content, "model": model}})
         await hashing_kv.index_done_callback()
-    return response.choices[0].message.content
+    return content
 
 
+@limits_attempts
 async def gpt_4o_complete(
     prompt, system_prompt=None, history_messages=[], **kwargs
 ) -> str:
@@ -76,6 +98,7 @@ async def gpt_4o_complete(
     )
 
 
+@limits_attempts
 async def gpt_4o_mini_complete(
     prompt, system_prompt=None, history_messages=[], **kwargs
 ) -> str:
@@ -88,6 +111,7 @@ async def gpt_4o_mini_complete(
     )
 
 
+@limits_attempts
 @wrap_embedding_func_with_attrs(embedding_dim=1536, max_token_size=8192)
 @retry(
     stop=stop_after_attempt(5),
@@ -96,12 +120,14 @@ async def gpt_4o_mini_complete(
 )
 async def openai_embedding(texts: list[str]) -> np.ndarray:
     openai_async_client = get_openai_async_client_instance()
-    response = await openai_async_client.embeddings.create(
-        model="text-embedding-3-small", input=texts, encoding_format="float"
-    )
+    async with limited_attempt():
+        response = await openai_async_client.embeddings.create(
+            model="text-embedding-3-small", input=texts, encoding_format="float"
+        )
     return np.array([dp.embedding for dp in response.data])
 
 
+@limits_attempts
 @retry(
     stop=stop_after_attempt(3),
     wait=wait_exponential(multiplier=1, min=4, max=10),
@@ -112,6 +138,7 @@ async def azure_openai_complete_if_cache(
 ) -> str:
     azure_openai_client = get_azure_openai_async_client_instance()
     hashing_kv: BaseKVStorage = kwargs.pop("hashing_kv", None)
+    on_delta = kwargs.pop("on_delta", None)
     messages = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
@@ -123,23 +150,24 @@ async def azure_openai_complete_if_cache(
         if if_cache_return is not None:
             return if_cache_return["return"]
 
-    response = await azure_openai_client.chat.completions.create(
-        model=deployment_name, messages=messages, **kwargs
+    content = await _create_completion(
+        azure_openai_client, on_delta, model=deployment_name, messages=messages, **kwargs
     )
 
     if hashing_kv is not None:
         await hashing_kv.upsert(
             {
                 args_hash: {
-                    "return": response.choices[0].message.content,
+                    "return": content,
                     "model": deployment_name,
                 }
             }
         )
         await hashing_kv.index_done_callback()
-    return response.choices[0].message.content
+    return content
 
 
+@limits_attempts
 async def azure_gpt_4o_complete(
     prompt, system_prompt=None, history_messages=[], **kwargs
 ) -> str:
@@ -152,6 +180,7 @@ async def azure_gpt_4o_complete(
     )
 
 
+@limits_attempts
 async def azure_gpt_4o_mini_complete(
     prompt, system_prompt=None, history_messages=[], **kwargs
 ) -> str:
@@ -164,6 +193,7 @@ async def azure_gpt_4o_mini_complete(
     )
 
 
+@limits_attempts
 @wrap_embedding_func_with_attrs(embedding_dim=1536, max_token_size=8192)
 @retry(
     stop=stop_after_attempt(3),
@@ -172,7 +202,8 @@ async def azure_gpt_4o_mini_complete(
 )
 async def azure_openai_embedding(texts: list[str]) -> np.ndarray:
     azure_openai_client = get_azure_openai_async_client_instance()
-    response = await azure_openai_client.embeddings.create(
-        model="text-embedding-3-small", input=texts, encoding_format="float"
-    )
+    async with limited_attempt():
+        response = await azure_openai_client.embeddings.create(
+            model="text-embedding-3-small", input=texts, encoding_format="float"
+        )
     return np.array([dp.embedding for dp in response.data])
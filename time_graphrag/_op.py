@@ -3,14 +3,18 @@ import json
 import asyncio
 import tiktoken
 from typing import Union
-from collections import Counter, defaultdict
+from collections import Counter, defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
 from ._splitter import SeparatorSplitter
 from ._utils import (
     logger,
+    ExtractionCheckpoint,
     clean_str,
     compute_mdhash_id,
     decode_tokens_by_tiktoken,
     encode_string_by_tiktoken,
+    get_tiktoken_encoder,
     is_float_regex,
     list_of_list_to_csv,
     pack_user_ass_to_openai_messages,
@@ -26,9 +30,106 @@ from .base import (
     TextChunkSchema,
     QueryParam,
 )
+from ._canonicalize import (
+    ALIASES_FILE,
+    EntityCanonicalizer,
+    apply_aliases,
+    load_aliases,
+    resolve_aliases,
+    save_aliases,
+)
+from ._chunk_store import chunk_time_label
+from ._compact import DescriptionCompactor
+from ._gleaning import GleaningPolicy, GleaningStats
 from .prompt import GRAPH_FIELD_SEP, PROMPTS
 from datetime import datetime
 
+# chunk summaries are keyed by chunk id and the summary prompt they came from
+SUMMARY_PROMPT_VERSION = compute_mdhash_id(PROMPTS["summary"])[:8]
+FUSED_SUMMARY_PROMPT_VERSION = compute_mdhash_id(PROMPTS["summary_entity_extraction"])[:8]
+
+
+def chunk_summary_key(chunk_key: str, prompt_version: str = SUMMARY_PROMPT_VERSION) -> str:
+    return f"{chunk_key}-{prompt_version}"
+
+
+def split_fused_extraction(response: str, summary_delimiter: str) -> tuple[str, str]:
+    """Split a summary_entity_extraction completion into (summary, records)"""
+    if summary_delimiter in response:
+        summary, records = response.split(summary_delimiter, 1)
+        return summary.strip(), records
+    # no delimiter: a summary never contains record tuples, so cut at the first one
+    first_record = response.find('("')
+    if first_record < 0:
+        return response.strip(), ""
+    return response[:first_record].strip(), response[first_record:]
+
+
+class ExtractionRecordStream:
+    """Cut extraction answers into records while they stream in.
+
+    ``feed`` takes the text deltas of a streaming completion and passes the
+    attributes of every ``(...)`` record to ``on_record`` as soon as the
+    record delimiter after it arrives.  ``finish`` takes the complete answer
+    and emits whatever wasn't streamed, so cached and non-streaming
+    completions go the same way.  A record that doesn't parse is counted in
+    ``malformed`` and skipped, the records before it are already out.  Each
+    normalized record is emitted once, so a retried call streaming the same
+    records again adds nothing.
+    """
+
+    def __init__(self, on_record: callable, record_delimiters: list[str], tuple_delimiter: str):
+        self.on_record = on_record
+        self.tuple_delimiter = tuple_delimiter
+        self._splitter = re.compile("|".join(re.escape(d) for d in record_delimiters))
+        self._seen = set()
+        self._bad = set()
+        self.records = 0
+        self.malformed = 0
+        self.begin()
+
+    def begin(self, start_marker: str = None):
+        """Start a new answer, records only start after start_marker if given"""
+        self._buffer = ""
+        self._start_marker = start_marker
+        self._waiting_for_start = start_marker is not None
+
+    def _emit(self, piece: str):
+        piece = piece.strip()
+        if not piece:
+            return
+        match = re.search(r"\((.*)\)", piece)
+        if match is None:
+            if piece not in self._bad:
+                self._bad.add(piece)
+                self.malformed += 1
+            return
+        body = " ".join(match.group(1).lower().split())
+        if body in self._seen:
+            return
+        self._seen.add(body)
+        self.records += 1
+        self.on_record(split_string_by_multi_markers(match.group(1), [self.tuple_delimiter]))
+
+    def feed(self, delta: str):
+        self._buffer += delta
+        if self._waiting_for_start:
+            start = self._buffer.find(self._start_marker)
+            if start < 0:
+                return
+            self._buffer = self._buffer[start + len(self._start_marker) :]
+            self._waiting_for_start = False
+        *records, self._buffer = self._splitter.split(self._buffer)
+        for record in records:
+            self._emit(record)
+
+    def finish(self, answer: str):
+        if self._start_marker is not None:
+            answer = split_fused_extraction(answer, self._start_marker)[1]
+        self.begin()
+        for record in self._splitter.split(answer):
+            self._emit(record)
+
 def chunking_by_token_size(
     tokens_list: list[list[int]],
     doc_keys,
@@ -98,24 +199,82 @@ def chunking_by_seperators(
     return results
 
 
-def get_chunks(new_docs, chunk_func=chunking_by_token_size, **chunk_func_params):
-    inserting_chunks = {}
-
-    new_docs_list = list(new_docs.items())
-    docs = [new_doc[1]["content"] for new_doc in new_docs_list]
-    doc_keys = [new_doc[0] for new_doc in new_docs_list]
-
-    ENCODER = tiktoken.encoding_for_model("gpt-4o")
-    tokens = ENCODER.encode_batch(docs, num_threads=16)
+def _chunk_document(
+    doc_key: str, content: str, encoder: tiktoken.Encoding, chunk_func, chunk_func_params: dict
+) -> dict[str, TextChunkSchema]:
+    tokens = encoder.encode(content)
     chunks = chunk_func(
-        tokens, doc_keys=doc_keys, tiktoken_model=ENCODER, **chunk_func_params
+        [tokens], doc_keys=[doc_key], tiktoken_model=encoder, **chunk_func_params
     )
+    return {compute_mdhash_id(chunk["content"], prefix="chunk-"): chunk for chunk in chunks}
 
-    for chunk in chunks:
-        inserting_chunks.update(
-            {compute_mdhash_id(chunk["content"], prefix="chunk-"): chunk}
-        )
 
+def _prefetch_doc_chunks(
+    pool: ThreadPoolExecutor, new_docs: dict, encoder, chunk_func, chunk_func_params, lookahead: int
+):
+    """Futures of the per-document chunk dicts, in document order, with at most
+    `lookahead` documents submitted ahead of the one handed out"""
+    docs = iter(new_docs.items())
+    pending: deque[Future] = deque()
+
+    def _submit_next():
+        doc = next(docs, None)
+        if doc is not None:
+            pending.append(
+                pool.submit(
+                    _chunk_document, doc[0], doc[1]["content"], encoder, chunk_func, chunk_func_params
+                )
+            )
+
+    for _ in range(lookahead):
+        _submit_next()
+    while pending:
+        future = pending.popleft()
+        _submit_next()
+        yield future
+
+
+def iter_doc_chunks(
+    new_docs,
+    chunk_func=chunking_by_token_size,
+    num_workers: int = 4,
+    tiktoken_model_name: str = "gpt-4o",
+    **chunk_func_params,
+):
+    """Yield the {chunk key: chunk} dict of every document in new_docs, in order.
+
+    Documents are tokenized and chunked by a pool of num_workers threads
+    (tiktoken releases the GIL), at most num_workers documents ahead of the
+    consumer, so only their token lists are alive at once.
+    """
+    encoder = get_tiktoken_encoder(tiktoken_model_name)
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        for future in _prefetch_doc_chunks(
+            pool, new_docs, encoder, chunk_func, chunk_func_params, num_workers
+        ):
+            yield future.result()
+
+
+async def aiter_doc_chunks(
+    new_docs,
+    chunk_func=chunking_by_token_size,
+    num_workers: int = 4,
+    tiktoken_model_name: str = "gpt-4o",
+    **chunk_func_params,
+):
+    """iter_doc_chunks that waits for the pool without blocking the event loop"""
+    encoder = get_tiktoken_encoder(tiktoken_model_name)
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        for future in _prefetch_doc_chunks(
+            pool, new_docs, encoder, chunk_func, chunk_func_params, num_workers
+        ):
+            yield await asyncio.wrap_future(future)
+
+
+def get_chunks(new_docs, chunk_func=chunking_by_token_size, **chunk_func_params):
+    inserting_chunks = {}
+    for doc_chunks in iter_doc_chunks(new_docs, chunk_func=chunk_func, **chunk_func_params):
+        inserting_chunks.update(doc_chunks)
     return inserting_chunks
 
 
@@ -142,7 +301,9 @@ async def _handle_entity_relation_summary(
     )
     use_prompt = prompt_template.format(**context_base) #通过 prompt_template 模板填充 context_base 字典，构造实际传递给模型的提示（prompt）
     logger.debug(f"Trigger summary: {entity_or_relation_name}")# 记录调试信息，输出正在处理哪个实体或关系的摘要。
-    summary = await use_llm_func(use_prompt, max_tokens=summary_max_tokens)
+    summary = await use_llm_func(
+        use_prompt, max_tokens=summary_max_tokens, stage="entity_summary"
+    )
     return summary
 
 
@@ -338,18 +499,270 @@ async def _merge_edges_then_upsert(
     return new_nodes_descriptions_chunks_dict
 
 
+def _chunk_contributions(maybe_nodes: dict, maybe_edges: dict) -> dict[str, dict]:
+    """Descriptions and weights each chunk added to the graph, for retract_chunks"""
+    contributions = defaultdict(lambda: {"nodes": defaultdict(list), "edges": []})
+    for name, dps in maybe_nodes.items():
+        for dp in dps:
+            contributions[dp["source_id"]]["nodes"][name].append(dp["description"])
+    for (src, tgt), dps in maybe_edges.items():
+        for dp in dps:
+            contributions[dp["source_id"]]["edges"].append(
+                [src, tgt, dp["description"], dp["weight"]]
+            )
+    return {
+        chunk_key: {"nodes": dict(c["nodes"]), "edges": c["edges"]}
+        for chunk_key, c in contributions.items()
+    }
+
+
+async def retract_chunks(
+    chunk_keys: list[str],
+    knwoledge_graph_inst: BaseGraphStorage,
+    entity_vdb: BaseVectorStorage,
+    chunk_contributions: BaseKVStorage,
+    description_archive: BaseKVStorage = None,
+) -> dict:
+    """Take what chunk_keys contributed back out of the graph and entity vectors.
+
+    Their ids leave every source_id, the descriptions they added leave the
+    node and edge descriptions (unless a remaining chunk added the same text,
+    compacted ones are expanded first) and their weights leave the edge
+    weights. Nodes and edges left without sources are deleted, except nodes
+    that still have edges: those keep the sources of their edges, like the end
+    nodes _merge_edges_then_upsert creates. Chunks indexed before their
+    contributions were recorded are found by scanning the graph and only lose
+    their source ids.
+    """
+    removed = set(chunk_keys)
+    records = [r for r in await chunk_contributions.get_by_ids(chunk_keys) if r is not None]
+    node_descriptions = defaultdict(set)
+    edge_descriptions = defaultdict(set)
+    edge_weights = defaultdict(float)
+    for record in records:
+        for name, descriptions in record["nodes"].items():
+            node_descriptions[name].update(descriptions)
+        for src, tgt, description, weight in record["edges"]:
+            edge_descriptions[(src, tgt)].add(description)
+            edge_weights[(src, tgt)] += weight
+            # missing end nodes were created with the edge description
+            node_descriptions[src].add(description)
+            node_descriptions[tgt].add(description)
+
+    def _sources(data: dict) -> list[str]:
+        return split_string_by_multi_markers(data.get("source_id", ""), [GRAPH_FIELD_SEP])
+
+    node_names = set(node_descriptions)
+    edge_keys = set(edge_descriptions)
+    if len(records) < len(chunk_keys):
+        logger.warning(
+            f"{len(chunk_keys) - len(records)} removed chunks have no recorded contributions, "
+            "their descriptions are kept"
+        )
+        for name, data in (await knwoledge_graph_inst.all_nodes()).items():
+            if removed.intersection(_sources(data)):
+                node_names.add(name)
+        for key, data in (await knwoledge_graph_inst.all_edges()).items():
+            if removed.intersection(_sources(data)):
+                edge_keys.add(tuple(sorted(key)))
+
+    node_names = sorted(node_names)
+    edge_keys = sorted(edge_keys)
+    nodes = await asyncio.gather(*[knwoledge_graph_inst.get_node(n) for n in node_names])
+    edges = await asyncio.gather(*[knwoledge_graph_inst.get_edge(*k) for k in edge_keys])
+    remaining_keys = sorted(
+        {s for data in nodes + edges if data is not None for s in _sources(data)} - removed
+    )
+    remaining = {
+        k: r
+        for k, r in zip(remaining_keys, await chunk_contributions.get_by_ids(remaining_keys))
+        if r is not None
+    }
+    compactor = (
+        DescriptionCompactor(summarize=None, archive=description_archive)
+        if description_archive is not None
+        else None
+    )
+
+    async def _retracted_description(name: str, data: dict, drop: set[str]) -> str:
+        description = data.get("description", "")
+        if compactor is not None:
+            description = await compactor.expand(name, description)
+        return GRAPH_FIELD_SEP.join(
+            p
+            for p in split_string_by_multi_markers(description, [GRAPH_FIELD_SEP])
+            if p not in drop
+        )
+
+    stats = {"nodes_updated": 0, "nodes_deleted": 0, "edges_updated": 0, "edges_deleted": 0}
+    for key, data in zip(edge_keys, edges):
+        if data is None:
+            continue
+        kept = [s for s in _sources(data) if s not in removed]
+        if not kept:
+            await knwoledge_graph_inst.delete_edge(*key)
+            stats["edges_deleted"] += 1
+            continue
+        kept_descriptions = {
+            description
+            for s in kept
+            for src, tgt, description, _ in remaining.get(s, {}).get("edges", [])
+            if tuple(sorted((src, tgt))) == key
+        }
+        await knwoledge_graph_inst.upsert_edge(
+            key[0],
+            key[1],
+            edge_data={
+                **data,
+                "description": await _retracted_description(
+                    str(key), data, edge_descriptions.get(key, set()) - kept_descriptions
+                ),
+                "source_id": GRAPH_FIELD_SEP.join(kept),
+                "weight": max(float(data.get("weight", 1.0)) - edge_weights.get(key, 0.0), 0.0),
+            },
+        )
+        stats["edges_updated"] += 1
+
+    updated_nodes, deleted_nodes = {}, []
+    for name, data in zip(node_names, nodes):
+        if data is None:
+            continue
+        kept = [s for s in _sources(data) if s not in removed]
+        edge_datas = []
+        if not kept:
+            node_edges = await knwoledge_graph_inst.get_node_edges(name) or []
+            if not node_edges:
+                await knwoledge_graph_inst.delete_node(name)
+                deleted_nodes.append(name)
+                continue
+            edge_datas = [
+                e
+                for e in await asyncio.gather(
+                    *[knwoledge_graph_inst.get_edge(*e) for e in node_edges]
+                )
+                if e is not None
+            ]
+            kept = sorted({s for e in edge_datas for s in _sources(e)})
+        kept_descriptions = set()
+        for s in kept:
+            record = remaining.get(s, {})
+            kept_descriptions.update(record.get("nodes", {}).get(name, []))
+            kept_descriptions.update(
+                description
+                for src, tgt, description, _ in record.get("edges", [])
+                if name in (src, tgt)
+            )
+        description = await _retracted_description(
+            name, data, node_descriptions.get(name, set()) - kept_descriptions
+        )
+        if not description and edge_datas:
+            description = GRAPH_FIELD_SEP.join(sorted({e["description"] for e in edge_datas}))
+        updated_nodes[name] = {
+            **data,
+            "description": description,
+            "source_id": GRAPH_FIELD_SEP.join(kept),
+        }
+        await knwoledge_graph_inst.upsert_node(name, node_data=updated_nodes[name])
+    stats["nodes_updated"] = len(updated_nodes)
+    stats["nodes_deleted"] = len(deleted_nodes)
+
+    if entity_vdb is not None:
+        if deleted_nodes:
+            await entity_vdb.delete(
+                [compute_mdhash_id(name, prefix="ent-") for name in deleted_nodes]
+            )
+        if updated_nodes:
+            await entity_vdb.upsert(
+                {
+                    compute_mdhash_id(name, prefix="ent-"): {
+                        "content": name + data["description"],
+                        "entity_name": name,
+                    }
+                    for name, data in updated_nodes.items()
+                }
+            )
+    return stats
+
+
+async def _run_extraction_pipeline(
+    ordered_chunks: list[tuple[str, TextChunkSchema]],
+    process_func: callable,
+    merge_func: callable,
+    num_workers: int,
+    queue_size: int,
+    emit_partial: bool = False,
+) -> list[tuple[str, BaseException]]:
+    """Producer -> fixed worker pool -> single merger, over bounded queues.
+
+    At most ``queue_size`` chunks wait for a worker and ``queue_size`` results
+    wait for the merger, so a slow merger pauses the workers and the producer
+    instead of piling up results. The merger runs alone, so upserts of the
+    same entity never interleave. With ``emit_partial`` the workers call
+    ``process_func(chunk_key_dp, emit)`` and can hand ``merge_func`` argument
+    tuples with ``await emit(...)`` before their chunk is done.
+    Returns the (chunk key, error) of failed chunks.
+    """
+    chunk_queue = asyncio.Queue(maxsize=queue_size)
+    result_queue = asyncio.Queue(maxsize=queue_size)
+    failed = []
+
+    async def producer():
+        for chunk_key_dp in ordered_chunks:
+            await chunk_queue.put(chunk_key_dp)
+        for _ in range(num_workers):
+            await chunk_queue.put(None)
+
+    async def emit(*partial):
+        await result_queue.put(partial)
+
+    async def worker():
+        while (chunk_key_dp := await chunk_queue.get()) is not None:
+            try:
+                if emit_partial:
+                    result = await process_func(chunk_key_dp, emit)
+                else:
+                    result = await process_func(chunk_key_dp)
+            except Exception as e:
+                failed.append((chunk_key_dp[0], e))
+                continue
+            await result_queue.put(result)
+
+    async def feed():
+        await asyncio.gather(producer(), *[worker() for _ in range(num_workers)])
+        await result_queue.put(None)
+
+    feed_task = asyncio.ensure_future(feed())
+    try:
+        while (result := await result_queue.get()) is not None:
+            await merge_func(*result)
+    except BaseException:
+        feed_task.cancel()
+        raise
+    await feed_task
+    return failed
+
+
 async def extract_entities(
     chunks: dict[str, TextChunkSchema],
     knwoledge_graph_inst: BaseGraphStorage, #存储和操作图形结构数据
     entity_vdb: BaseVectorStorage, #这是一个向量数据库实例，用于存储抽取出来的实体的向量表示。可能用来进行检索和相似度计算。
     global_config: dict,
+    chunk_summaries: BaseKVStorage = None,
+    chunk_contributions: BaseKVStorage = None,
 ) -> Union[BaseGraphStorage, None]: #Union 是 typing 模块中的一个类型提示，它允许函数返回多个类型中的任何一个。
     use_llm_func: callable = global_config["best_model_func"]
     entity_extract_max_gleaning = global_config["entity_extract_max_gleaning"]
+    entity_extract_chunk_retries = global_config["entity_extract_chunk_retries"]
+    entity_extract_stream_records = global_config["entity_extract_stream_records"]
+    checkpoint = ExtractionCheckpoint(global_config["working_dir"])
+    checkpointed_results = checkpoint.load()
     current_time = datetime.now().isoformat()
     ordered_chunks = list(chunks.items()) #将 chunks 字典转换成一个列表，列表中的每个元素是一个元组 (chunk_id, chunk_data)。这一步通常是为了方便按顺序处理每个文本块。
 
     entity_extract_prompt = PROMPTS["entity_extraction"]
+    entity_extract_fused_summary = global_config["entity_extract_fused_summary"]
+    fused_extract_prompt = PROMPTS["summary_entity_extraction"]
+    summary_delimiter = PROMPTS["DEFAULT_SUMMARY_DELIMITER"]
     context_base = dict(
         tuple_delimiter=PROMPTS["DEFAULT_TUPLE_DELIMITER"],# "<|>"
         record_delimiter=PROMPTS["DEFAULT_RECORD_DELIMITER"],# "##"
@@ -359,49 +772,194 @@ async def extract_entities(
     continue_prompt = PROMPTS["entiti_continue_extraction"] #这个提示信息可能用于在抽取实体过程中进行多轮交互。它可能告诉模型在实体抽取过程中，如果需要继续抽取更多的实体，应该如何处理。例如，可能会提示模型在当前文档中继续查找未识别的实体。
     if_loop_prompt = PROMPTS["entiti_if_loop_extraction"] #这个提示信息可能用于控制抽取的循环流程，尤其是在需要判断是否存在更多实体时。如果模型在抽取时判断是否还需要继续循环提取实体，这个提示可能会控制是否进入下一轮的抽取。
 
+    gleaning_policy = GleaningPolicy(
+        entity_extract_max_gleaning,
+        adaptive=global_config["entity_extract_adaptive_gleaning"],
+        **global_config["entity_extract_gleaning_policy"],
+    )
+    gleaning_stats = GleaningStats(global_config["working_dir"], run=current_time)
+
+    def _record_bodies(result: str) -> set[str]:
+        """Normalized (...) records of one extraction answer, to count new ones"""
+        bodies = set()
+        for record in split_string_by_multi_markers(
+            result, [context_base["record_delimiter"], context_base["completion_delimiter"]]
+        ):
+            match = re.search(r"\((.*)\)", record)
+            if match is not None:
+                bodies.add(" ".join(match.group(1).lower().split()))
+        return bodies
+
     already_processed = 0 #用于记录已处理的文本块数量。
     already_entities = 0 #用于记录已抽取的实体数量（包括重复的实体）
     already_relations = 0 #用于记录已识别的关系数量。
 
-    async def _process_single_content(chunk_key_dp: tuple[str, TextChunkSchema]): #内部处理单个文本块的异步函数
+    async def _extraction_call(record_stream, prompt, start_marker=None, **kwargs):
+        """One extraction/gleaning call, streamed into record_stream if given"""
+        if record_stream is None:
+            return await use_llm_func(prompt, **kwargs)
+        record_stream.begin(start_marker)
+        answer = await use_llm_func(prompt, on_delta=record_stream.feed, **kwargs)
+        record_stream.finish(answer)
+        return answer
+
+    def _record_collector(chunk_key: str, emit: callable = None) -> dict:
+        """Records of one chunk parsed as they stream in, kept across its
+        retries; with emit each one goes to the merge stage right away"""
+        collected = dict(nodes=defaultdict(list), edges=defaultdict(list), tasks=[])
+        # copies as parsed for the checkpoint, the merge stage tags the
+        # descriptions of emitted records with their time in place
+        collected["parsed"] = dict(nodes=defaultdict(list), edges=defaultdict(list))
+
+        async def _handle_record(record_attributes: list[str]):
+            if_entities = await _handle_single_entity_extraction(record_attributes, chunk_key)
+            if if_entities is not None:
+                collected["nodes"][if_entities["entity_name"]].append(if_entities)
+                collected["parsed"]["nodes"][if_entities["entity_name"]].append(dict(if_entities))
+                if emit is not None:
+                    await emit({if_entities["entity_name"]: [if_entities]}, {}, {}, "records")
+                return
+            if_relation = await _handle_single_relationship_extraction(record_attributes, chunk_key)
+            if if_relation is not None:
+                edge_key = (if_relation["src_id"], if_relation["tgt_id"])
+                collected["edges"][edge_key].append(if_relation)
+                collected["parsed"]["edges"][edge_key].append(dict(if_relation))
+                if emit is not None:
+                    await emit({}, {edge_key: [if_relation]}, {}, "records")
+
+        collected["stream"] = ExtractionRecordStream(
+            lambda attributes: collected["tasks"].append(
+                asyncio.ensure_future(_handle_record(attributes))
+            ),
+            [context_base["record_delimiter"], context_base["completion_delimiter"]],
+            context_base["tuple_delimiter"],
+        )
+        return collected
+
+    async def _summarize_then_extract(chunk_key: str, content: str, record_stream=None):
+        summary_key = chunk_summary_key(chunk_key)
+        cached_summary = (
+            await chunk_summaries.get_by_id(summary_key)
+            if chunk_summaries is not None
+            else None
+        )
+        if cached_summary is not None:
+            sum_content = cached_summary["summary"]
+        else:
+            sum_content=await use_llm_func(PROMPTS['summary'].format(text=content), stage="summary")
+            if chunk_summaries is not None:
+                await chunk_summaries.upsert(
+                    {
+                        summary_key: {
+                            "summary": sum_content,
+                            "chunk_key": chunk_key,
+                            "prompt_version": SUMMARY_PROMPT_VERSION,
+                        }
+                    }
+                )
+        hint_prompt = entity_extract_prompt.format(**context_base, input_text=sum_content)
+        final_result = await _extraction_call(record_stream, hint_prompt, stage="extract")
+        '''
+        使用 entity_extract_prompt 格式化提示语，将 context_base 和 content 插入其中，并调用大语言模型（use_llm_func）进行实体提取。
+        '''
+        history = pack_user_ass_to_openai_messages(hint_prompt, final_result) #将初步的提示语和结果打包成对话历史，并开始循环补充提取（最多 entity_extract_max_gleaning 次）
+        return sum_content, final_result, history
+
+    async def _process_single_content(chunk_key_dp: tuple[str, TextChunkSchema], collected: dict = None): #内部处理单个文本块的异步函数
         nonlocal already_processed, already_entities, already_relations
+        record_stream = collected["stream"] if collected is not None else None
         chunk_key = chunk_key_dp[0]
         chunk_dp = chunk_key_dp[1]
         sum_dict={}
         content = chunk_dp["content"]
-        sum_content=await use_llm_func(PROMPTS['summary'].format(text=content))
+        if entity_extract_fused_summary:
+            # one completion returns the summary and the first extraction round
+            hint_prompt = fused_extract_prompt.format(
+                **context_base, summary_delimiter=summary_delimiter, input_text=content
+            )
+            fused_result = await _extraction_call(
+                record_stream, hint_prompt, start_marker=summary_delimiter, stage="summary_extract"
+            )
+            sum_content, final_result = split_fused_extraction(fused_result, summary_delimiter)
+            if chunk_summaries is not None and sum_content:
+                await chunk_summaries.upsert(
+                    {
+                        chunk_summary_key(chunk_key, FUSED_SUMMARY_PROMPT_VERSION): {
+                            "summary": sum_content,
+                            "chunk_key": chunk_key,
+                            "prompt_version": FUSED_SUMMARY_PROMPT_VERSION,
+                        }
+                    }
+                )
+            history = pack_user_ass_to_openai_messages(hint_prompt, fused_result)
+        else:
+            sum_content, final_result, history = await _summarize_then_extract(
+                chunk_key, content, record_stream
+            )
         sum_dict[chunk_key]=sum_content
-        hint_prompt = entity_extract_prompt.format(**context_base, input_text=sum_content)
-        final_result = await use_llm_func(hint_prompt)
-        '''
-        使用 entity_extract_prompt 格式化提示语，将 context_base 和 content 插入其中，并调用大语言模型（use_llm_func）进行实体提取。
-        '''
-        history = pack_user_ass_to_openai_messages(hint_prompt, final_result) #将初步的提示语和结果打包成对话历史，并开始循环补充提取（最多 entity_extract_max_gleaning 次）
-        for now_glean_index in range(entity_extract_max_gleaning):
-            glean_result = await use_llm_func(continue_prompt, history_messages=history)
+        input_tokens = len(
+            encode_string_by_tiktoken(
+                content if entity_extract_fused_summary else sum_content,
+                model_name=global_config["tiktoken_model_name"],
+            )
+        )
+        seen_records = _record_bodies(final_result)
+        initial_records = len(seen_records)
+        new_records = []
+        loop_checks = skipped_loop_checks = 0
+        while True:
+            glean_index = len(new_records)
+            do_glean, reason = gleaning_policy.decide(
+                glean_index, input_tokens, initial_records, new_records[-1] if new_records else None
+            )
+            if do_glean is None:
+                if_loop_result: str = await use_llm_func(
+                    if_loop_prompt, history_messages=history, stage="loop_check"
+                )
+                loop_checks += 1
+                if_loop_result = if_loop_result.strip().strip('"').strip("'").lower()
+                do_glean, reason = if_loop_result == "yes", "loop_check"
+                #使用 if_loop_prompt 判断是否继续进行循环。如果模型返回的结果不是 "yes"，则停止循环
+            elif glean_index > 0 and reason != "max_gleaning":
+                skipped_loop_checks += 1
+            if not do_glean:
+                break
+            glean_result = await _extraction_call(
+                record_stream, continue_prompt, history_messages=history, stage="glean"
+            )
 
             history += pack_user_ass_to_openai_messages(continue_prompt, glean_result) #在每次循环中，使用 continue_prompt 继续进行实体提取，将结果追加到 final_result 中。
             final_result += glean_result
-            if now_glean_index == entity_extract_max_gleaning - 1:
-                break
-
-            if_loop_result: str = await use_llm_func(
-                if_loop_prompt, history_messages=history
-            )
-            if_loop_result = if_loop_result.strip().strip('"').strip("'").lower()
-            if if_loop_result != "yes":
-                break
-            #使用 if_loop_prompt 判断是否继续进行循环。如果模型返回的结果不是 "yes"，则停止循环
-        records = split_string_by_multi_markers(
-            final_result,
-            [context_base["record_delimiter"], context_base["completion_delimiter"]],
+            glean_records = _record_bodies(glean_result) - seen_records
+            seen_records |= glean_records
+            new_records.append(len(glean_records))
+        gleaning_stats.add(
+            chunk_key,
+            input_tokens,
+            initial_records,
+            new_records,
+            loop_checks,
+            skipped_loop_checks,
+            stop_reason=reason,
         )
+        if collected is not None:
+            # records were handled as they streamed in
+            await asyncio.gather(*collected["tasks"])
+            collected["tasks"].clear()
+            records = []
+            maybe_nodes, maybe_edges = collected["nodes"], collected["edges"]
+        else:
+            records = split_string_by_multi_markers(
+                final_result,
+                [context_base["record_delimiter"], context_base["completion_delimiter"]],
+            )
+            maybe_nodes = defaultdict(list)
+            maybe_edges = defaultdict(list)
         #print("records",records)
         '''
         使用分隔符将 final_result 切分成多个记录。分隔符包括 record_delimiter 和 completion_delimiter。
         '''
-        maybe_nodes = defaultdict(list) #defaultdict 是 Python 标准库中的一个字典类，它允许在访问不存在的键时返回一个默认值（这里是空列表）
-        maybe_edges = defaultdict(list)
+        #maybe_nodes/maybe_edges 是 defaultdict，它允许在访问不存在的键时返回一个默认值（这里是空列表）
         for record in records:
             record = re.search(r"\((.*)\)", record) #从 record 字符串中提取圆括号 () 内的内容。
             #print(record)
@@ -442,11 +1000,154 @@ async def extract_entities(
         )
         return dict(maybe_nodes), dict(maybe_edges),sum_dict
 
+    async def _process_with_checkpoint(chunk_key_dp: tuple[str, TextChunkSchema], emit=None):
+        chunk_key = chunk_key_dp[0]
+        if chunk_key in checkpointed_results:
+            return checkpointed_results[chunk_key]
+        collected = (
+            _record_collector(chunk_key, emit) if entity_extract_stream_records else None
+        )
+        for attempt in range(entity_extract_chunk_retries + 1):
+            try:
+                result = await _process_single_content(chunk_key_dp, collected)
+                break
+            except Exception as e:
+                if attempt == entity_extract_chunk_retries:
+                    raise
+                logger.warning(
+                    f"Extraction of chunk {chunk_key} failed ({e!r}), retry {attempt + 1}/{entity_extract_chunk_retries}"
+                )
+        if collected is None:
+            checkpoint.append(chunk_key, *result)
+        else:
+            parsed = collected["parsed"]
+            checkpoint.append(chunk_key, dict(parsed["nodes"]), dict(parsed["edges"]), result[2])
+            stream = collected["stream"]
+            if stream.malformed:
+                logger.debug(f"Chunk {chunk_key}: skipped {stream.malformed} malformed records")
+        if emit is not None:
+            # its records are merged already, only commit the chunk
+            return (*result, "commit")
+        return result
+
+    resumed = sum(1 for k, _ in ordered_chunks if k in checkpointed_results)
+    if resumed:
+        logger.info(f"Resuming extraction, {resumed}/{len(ordered_chunks)} chunks restored from checkpoint")
+    def _log_extraction_yield():
+        # already_* only count chunks extracted in this run, not checkpointed ones
+        if already_processed:
+            logger.info(
+                f"Extraction yield ({'fused' if entity_extract_fused_summary else 'two-call'}): "
+                f"{already_processed} chunks, {already_entities / already_processed:.2f} entities "
+                f"and {already_relations / already_processed:.2f} relations per chunk"
+            )
+            logger.info(f"Gleaning: {gleaning_stats.summary()}")
+        gleaning_stats.write()
+
+    def _raise_if_failed(failed: list[tuple[str, BaseException]]):
+        if failed:
+            raise RuntimeError(
+                f"Entity extraction failed for {len(failed)}/{len(ordered_chunks)} chunks "
+                f"(first: {failed[0][0]}: {failed[0][1]!r}); finished chunks are kept in "
+                f"{checkpoint.file_name}, rerun insert to resume"
+            ) from failed[0][1]
+
+    if global_config["entity_extract_streaming"]:
+        # upsert each chunk's nodes and edges as soon as it is extracted
+        summary_data = {}
+        nodes_descriptions_chunks_dict = {}
+        edges_descriptions_chunks_dict = {}
+        extracted_entities = 0
+        # finding new aliases needs every entity at once, so streaming only
+        # applies the ones earlier inserts found
+        known_aliases = (
+            load_aliases(os.path.join(global_config["working_dir"], ALIASES_FILE))
+            if global_config["entity_canonicalize"]
+            else {}
+        )
+
+        async def _merge_chunk_result(m_nodes: dict, m_edges: dict, sum_dict: dict, part: str = "chunk"):
+            """part is "chunk" for a whole chunk, with entity_extract_stream_records
+            "records" for records merged while their chunk streams and "commit"
+            for the chunk once they are all in"""
+            nonlocal extracted_entities
+            summary_data.update(sum_dict)
+            m_nodes, m_edges = apply_aliases(known_aliases, m_nodes, m_edges)
+            undirected_edges = defaultdict(list)
+            for k, v in m_edges.items():
+                undirected_edges[tuple(sorted(k))].extend(v)
+            if part == "commit":
+                if chunk_contributions is not None:
+                    await chunk_contributions.upsert(_chunk_contributions(m_nodes, undirected_edges))
+                return
+            node_results = await asyncio.gather(
+                *[merge_nodes_descriptions_chunks(k, v, global_config) for k, v in m_nodes.items()]
+            )
+            edge_results = await asyncio.gather(
+                *[
+                    merge_edges_descriptions_chunks(k[0], k[1], v, global_config)
+                    for k, v in undirected_edges.items()
+                ]
+            )
+            for node_result in node_results:
+                for k, v in node_result.items():
+                    nodes_descriptions_chunks_dict.setdefault(k, {}).update(v)
+            for edge_result in edge_results:
+                for k, v in edge_result.items():
+                    edges_descriptions_chunks_dict.setdefault(k, {}).update(v)
+            entities_data = await asyncio.gather(
+                *[
+                    _merge_nodes_then_upsert(k, v, knwoledge_graph_inst, global_config)
+                    for k, v in m_nodes.items()
+                ]
+            )
+            new_node_results = await asyncio.gather(
+                *[
+                    _merge_edges_then_upsert(k[0], k[1], v, knwoledge_graph_inst, global_config)
+                    for k, v in undirected_edges.items()
+                ]
+            )
+            if chunk_contributions is not None and part == "chunk":
+                await chunk_contributions.upsert(_chunk_contributions(m_nodes, undirected_edges))
+            for new_node_result in new_node_results:
+                for k, v in new_node_result.items():
+                    nodes_descriptions_chunks_dict.setdefault(k, {}).update(v)
+            extracted_entities += len(entities_data)
+
+        failed = await _run_extraction_pipeline(
+            ordered_chunks,
+            _process_with_checkpoint,
+            _merge_chunk_result,
+            num_workers=global_config["entity_extract_workers"],
+            queue_size=global_config["entity_extract_queue_size"],
+            emit_partial=entity_extract_stream_records,
+        )
+        print()  # clear the progress bar
+        _raise_if_failed(failed)
+        _log_extraction_yield()
+        sum_file = os.path.join(global_config['working_dir'], "chunk_sum.json")
+        with open(sum_file, 'w', encoding='utf-8') as file:
+            json.dump(summary_data, file, ensure_ascii=False, indent=4)
+        nodes_descriptions_chunks_file = os.path.join(global_config['working_dir'], "nodes_descriptions_chunks.json")
+        with open(nodes_descriptions_chunks_file, 'w', encoding='utf-8') as file:
+            json.dump(nodes_descriptions_chunks_dict, file, ensure_ascii=False, indent=4)
+        edges_descriptions_chunks_file = os.path.join(global_config['working_dir'], "edges_descriptions_chunks.json")
+        with open(edges_descriptions_chunks_file, 'w', encoding='utf-8') as file:
+            json.dump(edges_descriptions_chunks_dict, file, ensure_ascii=False, indent=4)
+        if not extracted_entities:
+            logger.warning("Didn't extract any entities, maybe your LLM is not working")
+            return None
+        return knwoledge_graph_inst
+
     # use_llm_func is wrapped in ascynio.Semaphore, limiting max_async callings
     results = await asyncio.gather(
-        *[_process_single_content(c) for c in ordered_chunks]
+        *[_process_with_checkpoint(c) for c in ordered_chunks], return_exceptions=True
     ) #异步处理每个文本块
     print()  # clear the progress bar
+    _raise_if_failed(
+        [(c[0], r) for c, r in zip(ordered_chunks, results) if isinstance(r, BaseException)]
+    )
+    _log_extraction_yield()
     maybe_nodes = defaultdict(list)
     maybe_edges = defaultdict(list)
     summary_data={}
@@ -462,36 +1163,10 @@ async def extract_entities(
         json.dump(summary_data, file, ensure_ascii=False, indent=4)
     #print("base node",maybe_nodes)
     #print("base edge",maybe_edges)
-    '''
-    # 统一批量处理所有节点的名称
-    entity_names = list(maybe_nodes.keys())
-    entity_names_string = ", ".join(entity_names)
-    # Prepare the merge prompt
-    entity_merge_prompt = PROMPTS["merge_extraction"].format(entity_names=entity_names_string)
-    # 使用 LLM 进行批量合并处理
-
-    merged_entity_names = await use_llm_func(entity_merge_prompt)
-    #print(type(merged_entity_names),merged_entity_names)
-    merged_entity_names = merged_entity_names.split("<SEP>")
-    print(type(merged_entity_names),merged_entity_names)
-    merger_new_name_dict={}
-    for merger_name in merged_entity_names:
-        if '---' in merger_name:
-            merger_name_list=merger_name.split('---')
-            merger_name_newlist=list(map(lambda item: f'"{item}"', merger_name_list))
-            merger_new=merger_name_newlist[0]        
-            for element in merger_name_newlist:
-                merger_new_name_dict[element]=merger_new
-
-
-    print("old entity",len(maybe_nodes))
-    maybe_nodes=merge_nodes_by_names(merged_entity_names,maybe_nodes)
-    print("new entity",len(maybe_nodes),maybe_nodes)
-    
-    print("old edge",maybe_edges)
-    maybe_edges=merge_relation_by_names(merger_new_name_dict,maybe_edges)
-    print("new edge",maybe_edges)
-    '''
+    if global_config["entity_canonicalize"]:
+        maybe_nodes, maybe_edges = await _canonicalize_extraction(
+            maybe_nodes, maybe_edges, global_config
+        )
     entities_descriptions_chunks_data=await asyncio.gather(
         *[
             merge_nodes_descriptions_chunks(k, v, global_config)
@@ -528,6 +1203,8 @@ async def extract_entities(
             for k, v in maybe_edges.items()
         ]
     )
+    if chunk_contributions is not None:
+        await chunk_contributions.upsert(_chunk_contributions(maybe_nodes, maybe_edges))
     for new_node_result in new_nodes_descriptions_chunks_dict:
         nodes_descriptions_chunks_dict.update(new_node_result)
     
@@ -546,52 +1223,36 @@ async def extract_entities(
     return knwoledge_graph_inst
 
 
-def merge_nodes_by_names(
-    merged_entity_names: list[str], maybe_nodes: defaultdict[list]
-):
-    for merger_name in merged_entity_names:
-        #print("merger_name",merger_name)
-        if '---' in merger_name:
-            merger_name_list=merger_name.split('---')
-            merger_name_newlist=list(map(lambda item: f'"{item}"', merger_name_list))
-            merger_new=merger_name_newlist[0]
-            #print("change name",merger_new)
-            for i in range(1,len(merger_name_newlist)):
-                for j in range (len(maybe_nodes[merger_name_newlist[i]])):
-                    maybe_nodes[merger_name_newlist[i]][j]['entity_name']=merger_new
-                maybe_nodes[merger_new].extend(maybe_nodes[merger_name_newlist[i]])
-                del maybe_nodes[merger_name_newlist[i]]
-            #print(merger_new,"done",maybe_nodes[merger_new])
-    #print("merge",maybe_nodes_merge)
-    #print("new entity",len(maybe_nodes),maybe_nodes)
-    return maybe_nodes
-
-def merge_relation_by_names(
-    merger_new_name_dict: dict, maybe_edges: defaultdict[list]
-):
-    for key in list(maybe_edges.keys()):
-        print(key)
-        new_key = tuple(merger_new_name_dict[element] if element in merger_new_name_dict else element for element in key)
-        print(new_key)
-        if new_key == key:
-            continue
-        if new_key:
-            if new_key in maybe_edges:
-                maybe_edges[new_key].extend(maybe_edges.pop(key))
-            else:
-                maybe_edges[new_key] = maybe_edges.pop(key)
-    for key, value in maybe_edges.items():
-    # 遍历列表中的每个字典
-        for item in value:
-            # 如果'src_id'或'tgt_id'的值存在于 merger_new_name_dict 的键中
-            if item['src_id'] in merger_new_name_dict or item['tgt_id'] in merger_new_name_dict:
-                # 如果'src_id'的值存在于 merger_new_name_dict 的键中，则更新'src_id'的值
-                if item['src_id'] in merger_new_name_dict:
-                    item['src_id'] = merger_new_name_dict[item['src_id']]
-                # 如果'tgt_id'的值存在于 merger_new_name_dict 的键中，则更新'tgt_id'的值
-                if item['tgt_id'] in merger_new_name_dict:
-                    item['tgt_id'] = merger_new_name_dict[item['tgt_id']]
-    return maybe_edges
+async def _canonicalize_extraction(
+    maybe_nodes: dict, maybe_edges: dict, global_config: dict
+) -> tuple[dict, dict]:
+    """Merge duplicate entity names of one extraction, see EntityCanonicalizer.
+
+    Aliases found by earlier inserts are applied first, new ones are added to
+    entity_aliases.json in the working dir for merge.py and the query side.
+    """
+    aliases_file = os.path.join(global_config["working_dir"], ALIASES_FILE)
+    aliases = load_aliases(aliases_file)
+    maybe_nodes, maybe_edges = apply_aliases(aliases, maybe_nodes, maybe_edges)
+    canonicalizer = EntityCanonicalizer(
+        llm_func=partial(global_config["best_model_func"], stage="canonicalize"),
+        embedding_func=partial(global_config["embedding_func"], stage="canonicalize"),
+        **global_config["entity_canonicalize_params"],
+    )
+    entities = {
+        name: {
+            "entity_type": Counter(dp["entity_type"] for dp in dps).most_common(1)[0][0],
+            "weight": len(dps),
+        }
+        for name, dps in maybe_nodes.items()
+    }
+    new_aliases = await canonicalizer.canonicalize(entities)
+    logger.info(f"Entity canonicalization: {canonicalizer.stats}")
+    if not new_aliases:
+        return maybe_nodes, maybe_edges
+    save_aliases(resolve_aliases({**aliases, **new_aliases}), aliases_file)
+    return apply_aliases(new_aliases, maybe_nodes, maybe_edges)
+
 
 def _pack_single_community_by_sub_communities(
     community: SingleCommunitySchema,
@@ -796,7 +1457,7 @@ async def generate_community_report(
             global_config=global_config,
         )
         prompt = community_report_prompt.format(input_text=describe)
-        response = await use_llm_func(prompt, **llm_extra_kwargs)
+        response = await use_llm_func(prompt, stage="community_report", **llm_extra_kwargs)
 
         data = use_string_json_convert_func(response)
         already_processed += 1
@@ -896,6 +1557,7 @@ async def _find_most_related_text_unit_from_entities(
     query_param: QueryParam,
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     knowledge_graph_inst: BaseGraphStorage,
+    chunk_summaries_db: BaseKVStorage = None,
 ):
     text_units = [
         split_string_by_multi_markers(dp["source_id"], [GRAPH_FIELD_SEP])
@@ -946,6 +1608,18 @@ async def _find_most_related_text_unit_from_entities(
     )
     all_text_units_id=[k['id'] for k in all_text_units]
     print(f"chunk排序:{all_text_units_id}")
+    if query_param.use_chunk_summaries and chunk_summaries_db is not None:
+        # compact stand-ins for the full chunk text, where a summary exists
+        summaries = await chunk_summaries_db.get_by_ids(
+            [chunk_summary_key(k) for k in all_text_units_id]
+        )
+        fused_summaries = await chunk_summaries_db.get_by_ids(
+            [chunk_summary_key(k, FUSED_SUMMARY_PROMPT_VERSION) for k in all_text_units_id]
+        )
+        summaries = [s or f for s, f in zip(summaries, fused_summaries)]
+        for t, summary in zip(all_text_units, summaries):
+            if summary is not None and t["data"] is not None:
+                t["data"] = {**t["data"], "content": summary["summary"]}
     all_text_units = truncate_list_by_token_size(
         all_text_units,
         key=lambda x: x["data"]["content"],
@@ -995,6 +1669,7 @@ async def _build_single_time_query_context(
     entities_vdb: BaseVectorStorage,
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     query_param: QueryParam,
+    chunk_summaries_db: BaseKVStorage = None,
 ):
     results = await entities_vdb.query(query, top_k=query_param.top_k)
     if not len(results):
@@ -1015,7 +1690,8 @@ async def _build_single_time_query_context(
     node_names=[r["entity_name"] for r in results]
     print("粗糙细粒度的node_names",node_names)
     use_text_units = await _find_most_related_text_unit_from_entities(
-        node_datas, query_param, text_chunks_db, knowledge_graph_inst
+        node_datas, query_param, text_chunks_db, knowledge_graph_inst,
+        chunk_summaries_db=chunk_summaries_db,
     )
     use_relations = await _find_most_related_edges_from_entities(
         node_datas, query_param, knowledge_graph_inst
@@ -1059,7 +1735,7 @@ async def _build_single_time_query_context(
 
     text_units_section_list = [["id", "data source time","content"]]
     for i, t in enumerate(use_text_units):
-        text_units_section_list.append([f"########text unit-{i}:",f"{t["time"]}" ,f"content:{t["content"]}##########"])
+        text_units_section_list.append([f"########text unit-{i}:",chunk_time_label(t) ,f"content:{t["content"]}##########"])
     text_units_context = list_of_list_to_csv(text_units_section_list)
     return f"""
 -----Entities-----
@@ -1084,6 +1760,7 @@ async def single_time_query(
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     query_param: QueryParam,
     global_config: dict,
+    chunk_summaries_db: BaseKVStorage = None,
 ) -> str:
     use_model_func = global_config["best_model_func"]
     context = await _build_single_time_query_context(
@@ -1092,6 +1769,7 @@ async def single_time_query(
         entities_vdb,
         text_chunks_db,
         query_param,
+        chunk_summaries_db=chunk_summaries_db,
     )
     if query_param.only_need_context:
         return context
@@ -1145,6 +1823,7 @@ async def _map_global_communities(
         response = await use_model_func(
             query,
             system_prompt=sys_prompt,
+            stage="global_map",
             **query_param.global_special_community_map_llm_kwargs,
         )
         data = use_string_json_convert_func(response)
@@ -1239,6 +1918,7 @@ Importance Score: {dp['score']}
         sys_prompt_temp.format(
             report_data=points_context, response_type=query_param.response_type
         ),
+        stage="final_compose",
     )
     return response
 
@@ -0,0 +1,260 @@
+import json
+import os
+import sqlite3
+import time
+from collections import Counter
+from typing import Optional
+
+import networkx as nx
+
+from ._canonicalize import ALIASES_FILE
+from ._utils import load_json, logger, write_json
+from .prompt import GRAPH_FIELD_SEP
+
+# files of a partial working dir merged key by key into the year working dir
+PART_FILES = [
+    "kv_store_full_docs.json",
+    "kv_store_text_chunks.json",
+    "kv_store_chunk_summaries.json",
+    "kv_store_chunk_contributions.json",
+    "kv_store_description_archive.json",
+    "kv_store_llm_response_cache.json",
+    "kv_store_dspy_predictions.json",
+    "chunk_sum.json",
+    "nodes_descriptions_chunks.json",
+    "edges_descriptions_chunks.json",
+    ALIASES_FILE,
+]
+GRAPH_FILE = "graph_chunk_entity_relation.graphml"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    item_id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    output TEXT,
+    error TEXT,
+    updated_at REAL
+)
+"""
+
+
+class WorkQueue:
+    """SQLite-backed queue of work items, shared by worker processes on any
+    host that mounts the same filesystem.
+
+    ``claim`` leases the oldest pending item (or one whose lease ran out) to
+    a worker for ``lease_seconds``; the worker keeps it with ``heartbeat``
+    and finishes it with ``complete`` or ``fail``.  Every call runs in its
+    own short ``BEGIN IMMEDIATE`` transaction on a fresh connection, so the
+    database lock is only held for a moment.  An item is retried until it
+    failed ``max_attempts`` times.  A worker whose lease was taken over can
+    no longer complete its item, so only one output per item is kept.
+
+    Leases compare wall clocks of different hosts, keep them in sync (NTP)
+    and ``lease_seconds`` well above the skew.  SQLite needs working file
+    locks on the shared filesystem (NFSv4 with locking enabled).
+    """
+
+    def __init__(self, file_name: str, lease_seconds: float = 300, max_attempts: int = 3):
+        self.file_name = file_name
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute(_SCHEMA)
+
+    def _transaction(self):
+        conn = sqlite3.connect(self.file_name, timeout=60, isolation_level=None)
+        return _Transaction(conn)
+
+    def enqueue(self, items: dict[str, dict]) -> int:
+        """Add {item id: payload} items, ids already in the queue are kept as they are"""
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO items (item_id, payload, updated_at) VALUES (?, ?, ?)",
+                [(k, json.dumps(v, ensure_ascii=False), time.time()) for k, v in items.items()],
+            )
+            return conn.total_changes - before
+
+    def claim(self, owner: str) -> Optional[tuple[str, dict]]:
+        """Lease the next available item to owner, None if there is none right now"""
+        now = time.time()
+        with self._transaction() as conn:
+            # expired leases that used up their attempts won't be retried
+            conn.execute(
+                "UPDATE items SET state = 'failed', owner = NULL, updated_at = ? "
+                "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT item_id, payload FROM items "
+                "WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?) "
+                "ORDER BY rowid LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE items SET state = 'leased', owner = ?, lease_until = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE item_id = ?",
+                (owner, now + self.lease_seconds, now, row[0]),
+            )
+        return row[0], json.loads(row[1])
+
+    def heartbeat(self, item_id: str, owner: str) -> bool:
+        """Extend the lease, False if owner lost it"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE items SET lease_until = ?, updated_at = ? "
+                "WHERE item_id = ? AND owner = ? AND state = 'leased'",
+                (now + self.lease_seconds, now, item_id, owner),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, item_id: str, owner: str, output: str) -> bool:
+        """Mark the item done with its output, False if owner lost the lease"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE items SET state = 'done', output = ?, error = NULL, updated_at = ? "
+                "WHERE item_id = ? AND owner = ? AND state = 'leased'",
+                (output, time.time(), item_id, owner),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, item_id: str, owner: str, error: str) -> bool:
+        """Give the item back for a retry, or fail it after max_attempts"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE items SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "owner = NULL, lease_until = NULL, error = ?, updated_at = ? "
+                "WHERE item_id = ? AND owner = ? AND state = 'leased'",
+                (self.max_attempts, error, time.time(), item_id, owner),
+            )
+            return cursor.rowcount == 1
+
+    def retry_failed(self) -> int:
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE items SET state = 'pending', attempts = 0, updated_at = ? "
+                "WHERE state = 'failed'",
+                (time.time(),),
+            )
+            return cursor.rowcount
+
+    def counts(self) -> dict[str, int]:
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT state, COUNT(*) FROM items GROUP BY state").fetchall()
+        return {state: n for state, n in rows}
+
+    def is_drained(self) -> bool:
+        """Nothing left to claim or waiting on another worker"""
+        counts = self.counts()
+        return not counts.get("pending") and not counts.get("leased")
+
+    def items(self, state: Optional[str] = None) -> list[dict]:
+        query = "SELECT item_id, payload, state, owner, attempts, output, error FROM items"
+        params = ()
+        if state is not None:
+            query += " WHERE state = ?"
+            params = (state,)
+        with self._transaction() as conn:
+            rows = conn.execute(query + " ORDER BY rowid", params).fetchall()
+        return [
+            dict(
+                item_id=item_id,
+                payload=json.loads(payload),
+                state=state,
+                owner=owner,
+                attempts=attempts,
+                output=output,
+                error=error,
+            )
+            for item_id, payload, state, owner, attempts, output, error in rows
+        ]
+
+
+class _Transaction:
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.conn.close()
+
+
+def _join_unique(values: list[str], sort: bool = True) -> str:
+    parts = {p for v in values for p in str(v).split(GRAPH_FIELD_SEP) if p}
+    return GRAPH_FIELD_SEP.join(sorted(parts) if sort else parts)
+
+
+def _merge_graphs(graphs: list[nx.Graph]) -> nx.Graph:
+    """Union of partial graphs of one time, combined the way
+    _merge_nodes_then_upsert/_merge_edges_then_upsert combine extractions"""
+    nodes, edges = {}, {}
+    for graph in graphs:
+        for node_id, attrs in graph.nodes(data=True):
+            nodes.setdefault(node_id, []).append(attrs)
+        for u, v, attrs in graph.edges(data=True):
+            edges.setdefault(tuple(sorted((u, v))), []).append(attrs)
+
+    merged = nx.Graph()
+    for node_id, parts in nodes.items():
+        data = {**parts[0]}
+        data["entity_type"] = Counter(p["entity_type"] for p in parts).most_common(1)[0][0]
+        data["description"] = _join_unique([p["description"] for p in parts])
+        data["source_id"] = _join_unique([p["source_id"] for p in parts], sort=False)
+        merged.add_node(node_id, **data)
+    for (u, v), parts in edges.items():
+        data = {**parts[0]}
+        data["weight"] = sum(float(p["weight"]) for p in parts)
+        data["order"] = min(int(p.get("order", 1)) for p in parts)
+        data["description"] = _join_unique([p["description"] for p in parts])
+        data["source_id"] = _join_unique([p["source_id"] for p in parts], sort=False)
+        merged.add_edge(u, v, **data)
+    return merged
+
+
+def collect_partial_indexes(part_dirs: list[str], working_dir: str) -> dict:
+    """Combine the partial working dirs the workers wrote for one time into
+    working_dir, which then looks like one built by a single GraphRAG.insert.
+    The files are rebuilt from the parts alone, so collecting again is safe."""
+    os.makedirs(working_dir, exist_ok=True)
+    for name in PART_FILES:
+        combined = {}
+        for part_dir in part_dirs:
+            for key, value in (load_json(os.path.join(part_dir, name)) or {}).items():
+                if isinstance(value, dict) and isinstance(combined.get(key), dict):
+                    combined[key].update(value)
+                else:
+                    combined[key] = value
+        if combined:
+            write_json(combined, os.path.join(working_dir, name))
+
+    graphs = [
+        nx.read_graphml(os.path.join(part_dir, GRAPH_FILE))
+        for part_dir in part_dirs
+        if os.path.exists(os.path.join(part_dir, GRAPH_FILE))
+    ]
+    graph = _merge_graphs(graphs)
+    nx.write_graphml(graph, os.path.join(working_dir, GRAPH_FILE))
+    logger.info(
+        f"Collected {len(part_dirs)} partial indexes into {working_dir}: "
+        f"{graph.number_of_nodes()} nodes, {graph.number_of_edges()} edges"
+    )
+    return {
+        "parts": len(part_dirs),
+        "nodes": graph.number_of_nodes(),
+        "edges": graph.number_of_edges(),
+    }
@@ -0,0 +1,81 @@
+from functools import wraps
+
+from ._utils import encode_string_by_tiktoken, logger
+
+
+class ModelRouter:
+    """Dispatch tagged LLM calls to a named model route.
+
+    Every internal call passes a ``stage`` keyword (``summary``, ``extract``,
+    ``glean``, ``loop_check``, ``entity_summary``, ``community_report``,
+    ``global_map``, ``answer``, ``final_compose``, ``time_parse``, ...).
+    ``policy`` maps a stage to either a route name, or a list of
+    ``[max_input_tokens, route]`` rules checked in order, where ``None`` as
+    the threshold matches any length::
+
+        {
+            "summary": "cheap_model",
+            "loop_check": "cheap_model",
+            "extract": [[2000, "cheap_model"], [None, "best_model"]],
+        }
+
+    Stages without a rule (or whose rules don't match) keep the route the
+    call site asked for, so an empty policy changes nothing.
+    """
+
+    def __init__(self, routes: dict, policy: dict = None, tiktoken_model_name: str = "gpt-4o"):
+        self.routes = routes
+        self.policy = policy or {}
+        self.tiktoken_model_name = tiktoken_model_name
+        for stage, rule in self.policy.items():
+            for route in self._rule_routes(rule):
+                if route not in self.routes:
+                    raise ValueError(
+                        f"Model route {route} of stage {stage} is not one of {list(self.routes)}"
+                    )
+
+    @staticmethod
+    def _rule_routes(rule) -> list[str]:
+        if isinstance(rule, str):
+            return [rule]
+        return [route for _, route in rule]
+
+    def _input_tokens(self, prompt, system_prompt, history_messages) -> int:
+        contents = [prompt, system_prompt] + [m["content"] for m in history_messages]
+        return sum(
+            len(encode_string_by_tiktoken(c, model_name=self.tiktoken_model_name))
+            for c in contents
+            if c
+        )
+
+    def select(self, stage: str, default_route: str, prompt, system_prompt=None, history_messages=[]) -> str:
+        rule = self.policy.get(stage)
+        if rule is None:
+            return default_route
+        if isinstance(rule, str):
+            return rule
+        input_tokens = self._input_tokens(prompt, system_prompt, history_messages)
+        for max_input_tokens, route in rule:
+            if max_input_tokens is None or input_tokens <= max_input_tokens:
+                return route
+        return default_route
+
+    def bind(self, default_route: str, default_stage: str = "answer"):
+        """A model func that routes by policy and falls back to ``default_route``"""
+        fallback = self.routes[default_route]
+
+        @wraps(fallback)
+        async def routed_func(prompt, system_prompt=None, history_messages=[], **kwargs):
+            stage = kwargs.pop("stage", default_stage)
+            route = self.select(stage, default_route, prompt, system_prompt, history_messages)
+            if route != default_route:
+                logger.debug(f"Route {stage} call from {default_route} to {route}")
+            return await self.routes[route](
+                prompt,
+                system_prompt=system_prompt,
+                history_messages=history_messages,
+                stage=stage,
+                **kwargs,
+            )
+
+        return routed_func
@@ -1,4 +1,8 @@
-from typing import List, Optional, Union, Literal
+from typing import List, Optional, Tuple, Union, Literal
+
+import numpy as np
+
+Span = Tuple[int, int]
 
 class SeparatorSplitter:
     def __init__(
@@ -16,8 +20,91 @@ class SeparatorSplitter:
         self._length_function = length_function
 
     def split_tokens(self, tokens: List[int]) -> List[List[int]]:
-        splits = self._split_tokens_with_separators(tokens)
-        return self._merge_splits(splits)
+        if not self._spans_are_contiguous():
+            splits = self._split_tokens_with_separators(tokens)
+            return self._merge_splits(splits)
+        return [tokens[start:end] for start, end in self.split_offsets(tokens)]
+
+    def _spans_are_contiguous(self) -> bool:
+        # separators kept at either end and len as length function: every split,
+        # merged chunk and overlapped chunk is one [start, end) range of tokens
+        return self._keep_separator in [True, "end", "start"] and self._length_function is len
+
+    def split_offsets(self, tokens: List[int]) -> List[Span]:
+        """[start, end) token offsets of the chunks that split_tokens returns.
+
+        Same result as the list based path below, but separators are located
+        with one vectorized first-token lookup and splits are merged as
+        offsets, without copying token lists.  Only for separators kept at
+        either end and len as length function.
+        """
+        spans = self._separator_spans(tokens)
+        return self._merge_spans(spans)
+
+    def _separator_spans(self, tokens: List[int]) -> List[Span]:
+        separators_by_first = {}
+        for separator in self._separators:
+            if separator:
+                separators_by_first.setdefault(separator[0], []).append(separator)
+        if not tokens:
+            return []
+        candidates = []
+        if separators_by_first:
+            first_tokens = np.fromiter(separators_by_first, dtype=np.int64)
+            candidates = np.flatnonzero(np.isin(np.asarray(tokens), first_tokens)).tolist()
+
+        spans = []
+        split_start = 0
+        consumed = 0
+        for position in candidates:
+            if position < consumed:
+                continue  # inside the separator matched just before
+            for separator in separators_by_first[tokens[position]]:
+                end = position + len(separator)
+                if tokens[position:end] == separator:
+                    break
+            else:
+                continue
+            # first matching separator in list order, as in _split_tokens_with_separators
+            cut = end if self._keep_separator in [True, "end"] else position
+            if cut > split_start:
+                spans.append((split_start, cut))
+                split_start = cut
+            consumed = end
+        if split_start < len(tokens):
+            spans.append((split_start, len(tokens)))
+        return spans
+
+    def _merge_spans(self, spans: List[Span]) -> List[Span]:
+        if not spans:
+            return []
+
+        merged = []
+        chunk_start, chunk_end = spans[0]
+        for start, end in spans[1:]:
+            if (chunk_end - chunk_start) + (end - start) <= self._chunk_size:
+                chunk_end = end
+            else:
+                merged.append((chunk_start, chunk_end))
+                chunk_start, chunk_end = start, end
+        merged.append((chunk_start, chunk_end))
+
+        if len(merged) == 1 and chunk_end - chunk_start > self._chunk_size:
+            return [
+                (i, min(i + self._chunk_size, chunk_end))
+                for i in range(chunk_start, chunk_end, self._chunk_size - self._chunk_overlap)
+                if min(i + self._chunk_size, chunk_end) - i > self._chunk_overlap
+            ]
+
+        if self._chunk_overlap > 0:
+            # the overlap is taken from the previous chunk before it got its own
+            result = [merged[0]]
+            for (prev_start, prev_end), (_, end) in zip(merged, merged[1:]):
+                start = max(prev_start, prev_end - self._chunk_overlap)
+                result.append((start, min(end, start + self._chunk_size)))
+            return result
+
+        return merged
 
     def _split_tokens_with_separators(self, tokens: List[int]) -> List[List[int]]:
         splits = []
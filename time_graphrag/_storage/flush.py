@@ -0,0 +1,106 @@
+import asyncio
+import time
+from typing import Callable, Optional
+
+from .._utils import logger
+
+
+class StorageFlusher:
+    """Write the file of a storage on a worker thread, only when it changed.
+
+    The storage calls ``mark_dirty`` on every change.  ``flush`` asks
+    ``prepare`` on the event loop for a write job (a sync callable working on
+    a snapshot, or one that runs under ``lock()``, which the storage also
+    takes around its changes) and runs it on a thread, so the loop keeps
+    serving other coroutines while a large file is written; a clean storage
+    isn't written at all.  The jobs write a temp file and rename it over the
+    old one, so a crash mid-write leaves the previous file intact.
+
+    ``request`` is what ``index_done_callback`` calls.  With ``debounce``
+    seconds it only schedules a flush that many seconds after the last
+    request, and at most ``max_wait`` seconds after the first unwritten one,
+    so a long-running service writes its llm cache once per quiet period
+    instead of after every model call.  The timer only fires while the event
+    loop runs, so ``flush`` before the process or the loop stops.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        prepare: Callable[[], Callable[[], None]],
+        debounce: float = 0.0,
+        max_wait: float = 30.0,
+        dirty: bool = False,
+    ):
+        self.name = name
+        self.prepare = prepare
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.writes = 0
+        self.skipped = 0
+        self._version = 1 if dirty else 0
+        self._flushed_version = 0
+        self._first_request = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._task: Optional[asyncio.Task] = None
+        # one lock per event loop, a storage may outlive the loop of an asyncio.run
+        self._lock = None
+        self._lock_loop = None
+
+    @property
+    def dirty(self) -> bool:
+        return self._version != self._flushed_version
+
+    def mark_dirty(self):
+        self._version += 1
+
+    def lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._lock_loop is not loop:
+            self._lock, self._lock_loop = asyncio.Lock(), loop
+        return self._lock
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    async def flush(self) -> bool:
+        """Write now if there are unwritten changes, True if it wrote"""
+        self._cancel_timer()
+        async with self.lock():
+            if not self.dirty:
+                self.skipped += 1
+                return False
+            version = self._version
+            start = time.perf_counter()
+            await asyncio.to_thread(self.prepare())
+            self._flushed_version = version
+            self._first_request = None
+            self.writes += 1
+        logger.debug(f"Flushed {self.name} in {time.perf_counter() - start:.3f}s")
+        return True
+
+    async def request(self):
+        if self.debounce <= 0:
+            await self.flush()
+            return
+        if not self.dirty:
+            self.skipped += 1
+            return
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self._first_request is None:
+            self._first_request = now
+        self._cancel_timer()
+        delay = min(self.debounce, max(self._first_request + self.max_wait - now, 0.0))
+        self._timer = loop.call_later(delay, self._flush_later)
+
+    def _flush_later(self):
+        self._timer = None
+        self._task = asyncio.ensure_future(self.flush())
+        self._task.add_done_callback(self._log_failure)
+
+    def _log_failure(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Background flush of {self.name} failed: {task.exception()!r}")
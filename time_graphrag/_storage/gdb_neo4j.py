@@ -160,6 +160,24 @@ class Neo4jStorage(BaseGraphStorage):
                 edges.append((record["source"], record["target"]))
             return edges
 
+    async def all_nodes(self) -> dict[str, dict]:
+        async with self.async_driver.session() as session:
+            result = await session.run(
+                f"MATCH (n:{self.namespace}) RETURN n.id AS id, properties(n) AS node_data"
+            )
+            return {record["id"]: record["node_data"] async for record in result}
+
+    async def all_edges(self) -> dict[tuple[str, str], dict]:
+        async with self.async_driver.session() as session:
+            result = await session.run(
+                f"MATCH (s:{self.namespace})-[r]->(t:{self.namespace}) "
+                "RETURN s.id AS source, t.id AS target, properties(r) AS edge_data"
+            )
+            return {
+                (record["source"], record["target"]): record["edge_data"]
+                async for record in result
+            }
+
     async def upsert_node(self, node_id: str, node_data: dict[str, str]):
         node_type = node_data.get("entity_type", "UNKNOWN").strip('"')
         async with self.async_driver.session() as session:
@@ -185,6 +203,22 @@ class Neo4jStorage(BaseGraphStorage):
                 edge_data=edge_data,
             )
 
+    async def delete_node(self, node_id: str):
+        async with self.async_driver.session() as session:
+            await session.run(
+                f"MATCH (n:{self.namespace} {{id: $node_id}}) DETACH DELETE n",
+                node_id=node_id,
+            )
+
+    async def delete_edge(self, source_node_id: str, target_node_id: str):
+        async with self.async_driver.session() as session:
+            await session.run(
+                f"MATCH (s:{self.namespace} {{id: $source_id}})-[r]-(t:{self.namespace} {{id: $target_id}}) "
+                "DELETE r",
+                source_id=source_node_id,
+                target_id=target_node_id,
+            )
+
     async def clustering(self, algorithm: str):
         if algorithm != "leiden":
             raise ValueError(
@@ -3,6 +3,7 @@ import json
 import os
 from collections import defaultdict
 from dataclasses import dataclass
+from functools import partial
 from typing import Any, Union, cast
 import networkx as nx
 import numpy as np
@@ -13,6 +14,7 @@ from ..base import (
     SingleCommunitySchema,
 )
 from ..prompt import GRAPH_FIELD_SEP
+from .flush import StorageFlusher
 
 
 @dataclass
@@ -30,7 +32,9 @@ class NetworkXStorage(BaseGraphStorage):
         logger.info(
             f"Writing graph with {graph.number_of_nodes()} nodes, {graph.number_of_edges()} edges"
         )
-        nx.write_graphml(graph, file_name)
+        tmp_file = f"{file_name}.tmp"
+        nx.write_graphml(graph, tmp_file)
+        os.replace(tmp_file, file_name)
 
     @staticmethod
     def stable_largest_connected_component(graph: nx.Graph) -> nx.Graph:
@@ -94,9 +98,22 @@ class NetworkXStorage(BaseGraphStorage):
         self._node_embed_algorithms = {
             "node2vec": self._node2vec_embed,
         }
+        self._flusher = StorageFlusher(
+            f"graph {self.namespace}",
+            # the copy has its own attribute dicts, the graph can change while it's written
+            lambda: partial(
+                NetworkXStorage.write_nx_graph, self._graph.copy(), self._graphml_xml_file
+            ),
+            debounce=self.global_config.get("storage_flush_debounce", 0.0),
+            max_wait=self.global_config.get("storage_flush_max_wait", 30.0),
+            dirty=not os.path.exists(self._graphml_xml_file),
+        )
 
     async def index_done_callback(self):
-        NetworkXStorage.write_nx_graph(self._graph, self._graphml_xml_file)
+        await self._flusher.request()
+
+    async def flush(self):
+        await self._flusher.flush()
 
     async def has_node(self, node_id: str) -> bool:
         return self._graph.has_node(node_id)
@@ -126,13 +143,31 @@ class NetworkXStorage(BaseGraphStorage):
             return list(self._graph.edges(source_node_id))
         return None
 
+    async def all_nodes(self) -> dict[str, dict]:
+        return dict(self._graph.nodes(data=True))
+
+    async def all_edges(self) -> dict[tuple[str, str], dict]:
+        return {(u, v): data for u, v, data in self._graph.edges(data=True)}
+
     async def upsert_node(self, node_id: str, node_data: dict[str, str]):
         self._graph.add_node(node_id, **node_data)
+        self._flusher.mark_dirty()
 
     async def upsert_edge(
         self, source_node_id: str, target_node_id: str, edge_data: dict[str, str]
     ):
         self._graph.add_edge(source_node_id, target_node_id, **edge_data)
+        self._flusher.mark_dirty()
+
+    async def delete_node(self, node_id: str):
+        if self._graph.has_node(node_id):
+            self._graph.remove_node(node_id)
+            self._flusher.mark_dirty()
+
+    async def delete_edge(self, source_node_id: str, target_node_id: str):
+        if self._graph.has_edge(source_node_id, target_node_id):
+            self._graph.remove_edge(source_node_id, target_node_id)
+            self._flusher.mark_dirty()
 
     async def clustering(self, algorithm: str):
         if algorithm not in self._clustering_algorithms:
@@ -198,6 +233,7 @@ class NetworkXStorage(BaseGraphStorage):
     def _cluster_data_to_subgraphs(self, cluster_data: dict[str, list[dict[str, str]]]):
         for node_id, clusters in cluster_data.items():
             self._graph.nodes[node_id]["clusters"] = json.dumps(clusters)
+        self._flusher.mark_dirty()
 
     async def _leiden_clustering(self):
         from graspologic.partition import hierarchical_leiden
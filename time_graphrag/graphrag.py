@@ -5,7 +5,7 @@ from datetime import datetime
 from functools import partial
 from typing import Callable, Dict, List, Optional, Type, Union, cast
 import networkx as nx
-import tiktoken,json
+import tiktoken
 
 
 from ._llm import (
@@ -17,23 +17,38 @@ from ._llm import (
     azure_gpt_4o_mini_complete,
 )
 from ._op import (
+    FUSED_SUMMARY_PROMPT_VERSION,
+    SUMMARY_PROMPT_VERSION,
+    _handle_entity_relation_summary,
+    chunk_summary_key,
     chunking_by_token_size,
     extract_entities,
+    retract_chunks,
     generate_community_report,
-    get_chunks,
+    aiter_doc_chunks,
     single_time_query,
     global_query,
     naive_query,
 )
+from ._chunk_store import CHUNK_REFS_FILE, load_time_chunk_ids
+from ._compact import DESCRIPTION_ARCHIVE_NAMESPACE, DescriptionCompactor
+from ._embedding import BulkEmbeddingExecutor
+from ._manifest import IndexManifest, file_fingerprint, prompt_versions
+from ._metrics import UsageTracker
+from ._router import ModelRouter
 from ._storage import (
     JsonKVStorage,
     NanoVectorDBStorage,
     NetworkXStorage,
 )
 from ._utils import (
+    AdaptiveConcurrencyLimiter,
     EmbeddingFunc,
+    EmbeddingMicroBatcher,
+    ExtractionCheckpoint,
     compute_mdhash_id,
     limit_async_func_call,
+    limit_async_func_call_adaptive,
     convert_response_to_json,
     always_get_an_event_loop,
     logger,
@@ -46,6 +61,23 @@ from .base import (
     QueryParam,
 )
 
+# files of a working dir the index manifest fingerprints per stage
+INSERT_OUTPUTS = [
+    "kv_store_full_docs.json",
+    "kv_store_text_chunks.json",
+    "kv_store_chunk_summaries.json",
+    "kv_store_chunk_contributions.json",
+    "graph_chunk_entity_relation.graphml",
+]
+COMPACT_OUTPUTS = [
+    "graph_chunk_entity_relation.graphml",
+    "kv_store_description_archive.json",
+]
+SLICE_OUTPUTS = [
+    "graph_chunk_entity_relation.graphml",
+    "vdb_entities.json",
+]
+
 
 @dataclass
 class GraphRAG:
@@ -75,6 +107,7 @@ class GraphRAG:
     chunk_token_size: int = 1000
     chunk_overlap_token_size: int = 100 #这个属性表示相邻文本块之间的 token 重叠数。
     tiktoken_model_name: str = "gpt-4o"
+    chunking_workers: int = 4  # threads tokenizing and chunking documents ahead of dedup
 
     # entity extraction
     entity_extract_max_gleaning: int = 1 #循环补充提取（最多 entity_extract_max_gleaning 次）。
@@ -109,8 +142,60 @@ class GraphRAG:
     cheap_model_max_token_size: int = 32768
     cheap_model_max_async: int = 16
 
+    # model routing: extra named model funcs next to best_model/cheap_model, each
+    # with its own concurrency limit, and a {stage: route} policy, see ModelRouter
+    extra_model_funcs: dict = field(default_factory=dict)
+    extra_model_max_async: dict = field(default_factory=dict)  # default 16 per route
+    model_routing_policy: dict = field(default_factory=dict)
+
+    # adaptive (AIMD) concurrency around the model and embedding funcs, per
+    # attempt of the funcs marked limits_attempts (see limited_attempt); the
+    # *_max_async values above become the starting limits
+    enable_adaptive_concurrency: bool = False
+    adaptive_concurrency_floor: int = 1
+    adaptive_concurrency_ceiling: int = 64
+    adaptive_concurrency_latency_target: float = 0.0  # seconds, 0 = only back off on 429s/timeouts
+
+    # usage accounting: {"best_model": (usd per 1k prompt tokens, usd per 1k completion tokens)}
+    model_token_prices: dict = field(default_factory=dict)
+    write_usage_report: bool = False  # append each run's snapshot to usage_report.jsonl
+
     # entity extraction
     entity_extraction_func: callable = extract_entities
+    # summarize and extract with one summary_entity_extraction call per chunk
+    # instead of a summary call followed by an extraction call
+    entity_extract_fused_summary: bool = False
+    # let a GleaningPolicy skip gleaning rounds and loop_check calls from the
+    # first pass record density and the previous round's new records, its
+    # thresholds can be overridden here; stats go to gleaning_stats.jsonl
+    entity_extract_adaptive_gleaning: bool = False
+    entity_extract_gleaning_policy: dict = field(default_factory=dict)
+    # merge duplicate entity names ("AUDI AG", "AUDI") after extraction, see
+    # EntityCanonicalizer for the params; aliases go to entity_aliases.json
+    entity_canonicalize: bool = False
+    entity_canonicalize_params: dict = field(default_factory=dict)
+    entity_extract_chunk_retries: int = 2  # per chunk, results are checkpointed as they finish
+    # stream chunks through a fixed worker pool over bounded queues and upsert
+    # each result into the graph as it arrives, instead of gathering them all
+    entity_extract_streaming: bool = False
+    entity_extract_workers: int = 16
+    entity_extract_queue_size: int = 32
+    # stream extraction answers and parse their records as they arrive (the
+    # model func must accept an on_delta(text) callback, like
+    # openai_complete_if_cache and the mock); with entity_extract_streaming
+    # each record is merged into the graph before its chunk is done
+    entity_extract_stream_records: bool = False
+    # entity_extraction.extract_entities_dspy: the DSPy extractor runs on this
+    # many threads, its predictions are cached per chunk content and module
+    # version in the dspy_predictions KV store
+    dspy_extract_workers: int = 8
+    enable_dspy_prediction_cache: bool = True
+    use_compiled_dspy_entity_relationship: bool = False
+    entity_relationship_module_path: str = None
+    # compact_descriptions summarizes each (entity, time) description set of
+    # entity_summary_to_max_tokens or more with cheap_model_func, this many at
+    # a time; the raw descriptions stay in the description_archive KV store
+    description_compaction_batch_size: int = 64
 
     # storage
     key_string_value_json_storage_cls: Type[BaseKVStorage] = JsonKVStorage #JsonKVStorage 是一个自定义的类，用于将数据存储为键值对（key-value）格式的 JSON 文件。BaseKVStorage 是它的父类
@@ -118,6 +203,21 @@ class GraphRAG:
     vector_db_storage_cls_kwargs: dict = field(default_factory=dict) #用于存储创建向量数据库存储实例时所需的额外参数（例如连接配置、索引设置等）
     graph_storage_cls: Type[BaseGraphStorage] = NetworkXStorage #NetworkXStorage 是一个用于存储图数据的类，继承自 BaseGraphStorage。它可以通过 NetworkX 库来管理和操作图形数据结构
     enable_llm_cache: bool = True
+    # an LLM response cache to use instead of the working dir's own, e.g. one
+    # shared by several GraphRAG instances; usage reports count its hits
+    shared_llm_response_cache: Optional[BaseKVStorage] = None
+    # storages rewrite their files only when they changed, on a worker thread
+    # and through a temp file and rename; with storage_flush_debounce seconds
+    # the writes after model calls and queries are coalesced (for long-running
+    # services, call flush_storages before stopping), inserts flush right away
+    storage_flush_debounce: float = 0.0
+    storage_flush_max_wait: float = 30.0
+
+    # index manifest: the inputs (doc hashes, prompt versions, model names,
+    # chunking params) and output file hashes of each stage in
+    # index_manifest.json, stages whose inputs and outputs are unchanged are skipped
+    enable_index_manifest: bool = True
+    model_names: dict = field(default_factory=dict)  # {"best_model": ..., "cheap_model": ..., "embedding": ...}
 
     # extension
     always_create_working_dir: bool = True
@@ -144,6 +244,10 @@ class GraphRAG:
             logger.info(f"Creating working directory {self.working_dir}")
             os.makedirs(self.working_dir)
 
+        self.index_manifest = (
+            IndexManifest(self.working_dir) if self.enable_index_manifest else None
+        )
+
         self.full_docs = self.key_string_value_json_storage_cls(
             namespace="full_docs", global_config=asdict(self)
         ) #具体来说，self.full_docs 存储的是原始文档数据。
@@ -151,23 +255,49 @@ class GraphRAG:
         self.text_chunks = self.key_string_value_json_storage_cls(
             namespace="text_chunks", global_config=asdict(self)
         ) #这是另一个存储类，用于存储文档的分块数据（可能是分段或分词后的文本）
+        self.chunk_summaries = self.key_string_value_json_storage_cls(
+            namespace="chunk_summaries", global_config=asdict(self)
+        )  # PROMPTS["summary"] of each chunk, reused across re-indexing and at query time
+        self.description_archive = self.key_string_value_json_storage_cls(
+            namespace=DESCRIPTION_ARCHIVE_NAMESPACE, global_config=asdict(self)
+        )  # raw descriptions and summary of each compacted (entity, time) description set
+        self.chunk_contributions = self.key_string_value_json_storage_cls(
+            namespace="chunk_contributions", global_config=asdict(self)
+        )  # descriptions and weights each chunk added to the graph, see aupdate
 
-        self.llm_response_cache = (
-            self.key_string_value_json_storage_cls(
-                namespace="llm_response_cache", global_config=asdict(self)
+        if self.shared_llm_response_cache is not None:
+            self.llm_response_cache = self.shared_llm_response_cache
+        else:
+            self.llm_response_cache = (
+                self.key_string_value_json_storage_cls(
+                    namespace="llm_response_cache", global_config=asdict(self)
+                )
+                if self.enable_llm_cache
+                else None
             )
-            if self.enable_llm_cache
-            else None
-        )
 
 
         self.chunk_entity_relation_graph = self.graph_storage_cls(
             namespace="chunk_entity_relation", global_config=asdict(self)
         )
 
-        self.embedding_func = limit_async_func_call(self.embedding_func_max_async)(
-            self.embedding_func
+        self.concurrency_limiters: dict[str, AdaptiveConcurrencyLimiter] = {}
+        if isinstance(getattr(self.embedding_func, "func", None), EmbeddingMicroBatcher):
+            self.embedding_func.func.batch_size = self.embedding_batch_num
+        elif isinstance(
+            getattr(getattr(self.embedding_func, "func", None), "__self__", None),
+            BulkEmbeddingExecutor,
+        ):
+            # vector storages call it once per embedding_batch_num texts
+            self.embedding_func.func.__self__.shard_size = self.embedding_batch_num
+        self.usage_tracker = UsageTracker(
+            tiktoken_model_name=self.tiktoken_model_name,
+            token_prices=self.model_token_prices,
         )
+        # the tracker inside the limiter, so waiting for a slot isn't counted as latency
+        self.embedding_func = self._limit_async_func_call(
+            "embedding", self.embedding_func_max_async
+        )(self.usage_tracker.wrap_embedding_func(self.embedding_func))
         self.entities_vdb = (
             self.vector_db_storage_cls(
                 namespace="entities",
@@ -188,9 +318,98 @@ class GraphRAG:
             else None
         )
 
-        self.best_model_func = limit_async_func_call(self.best_model_max_async)(
-            partial(self.best_model_func, hashing_kv=self.llm_response_cache)
+        model_routes = {
+            "best_model": (self.best_model_func, self.best_model_max_async),
+            "cheap_model": (self.cheap_model_func, self.cheap_model_max_async),
+        }
+        for name, func in self.extra_model_funcs.items():
+            model_routes[name] = (func, self.extra_model_max_async.get(name, 16))
+        self.model_router = ModelRouter(
+            {
+                name: self._limit_async_func_call(name, max_async)(
+                    self.usage_tracker.wrap_model_func(
+                        func, name, hashing_kv=self.llm_response_cache
+                    )
+                )
+                for name, (func, max_async) in model_routes.items()
+            },
+            policy=self.model_routing_policy,
+            tiktoken_model_name=self.tiktoken_model_name,
+        )
+        self.best_model_func = self.model_router.bind("best_model")
+        self.cheap_model_func = self.model_router.bind("cheap_model")
+
+    def _manifest_inputs(self, docs: dict) -> dict:
+        """Everything an insert of docs depends on, for the index manifest"""
+        return {
+            "docs": sorted(docs),
+            "time": self.time,
+            "prompts": prompt_versions(
+                [
+                    "summary",
+                    "entity_extraction",
+                    "summary_entity_extraction",
+                    "entiti_continue_extraction",
+                    "entiti_if_loop_extraction",
+                ]
+            ),
+            "models": self.model_names,
+            "chunking": {
+                "func": self.chunk_func.__name__,
+                "token_size": self.chunk_token_size,
+                "overlap_token_size": self.chunk_overlap_token_size,
+                "tiktoken_model_name": self.tiktoken_model_name,
+            },
+            "extraction": {
+                "func": self.entity_extraction_func.__name__,
+                "fused_summary": self.entity_extract_fused_summary,
+                "max_gleaning": self.entity_extract_max_gleaning,
+                "adaptive_gleaning": self.entity_extract_adaptive_gleaning,
+                "gleaning_policy": self.entity_extract_gleaning_policy,
+                "canonicalize": self.entity_canonicalize,
+                "canonicalize_params": self.entity_canonicalize_params,
+                "dspy_module": file_fingerprint(self.entity_relationship_module_path)
+                if self.use_compiled_dspy_entity_relationship
+                else None,
+            },
+        }
+
+    def _manifest_is_current(self, stage: str, inputs: dict) -> bool:
+        if self.index_manifest is None or not self.index_manifest.is_current(stage, inputs):
+            return False
+        logger.info(f"[Manifest] {stage} inputs and outputs are unchanged, skipping")
+        return True
+
+    def _manifest_record(self, stage: str, inputs: dict, outputs: list[str], upstream: tuple = ()):
+        if self.index_manifest is not None:
+            self.index_manifest.record(stage, inputs, outputs, upstream=upstream)
+
+    def _limit_async_func_call(self, name: str, max_async: int):
+        if not self.enable_adaptive_concurrency:
+            return limit_async_func_call(max_async)
+        limiter = AdaptiveConcurrencyLimiter(
+            initial=max_async,
+            floor=self.adaptive_concurrency_floor,
+            ceiling=self.adaptive_concurrency_ceiling,
+            latency_target=self.adaptive_concurrency_latency_target,
         )
+        self.concurrency_limiters[name] = limiter
+        return limit_async_func_call_adaptive(limiter)
+
+    def usage_snapshot(self) -> dict:
+        """Per-stage calls, cache hits, tokens and latency histogram of the last run"""
+        return self.usage_tracker.snapshot()
+
+    def _usage_done(self):
+        if self.write_usage_report:
+            self.usage_tracker.write(os.path.join(self.working_dir, "usage_report.jsonl"))
+
+    def concurrency_metrics(self) -> dict[str, dict]:
+        """Current limit, floor, ceiling and call counters of each adaptive limiter"""
+        return {
+            name: limiter.snapshot()
+            for name, limiter in self.concurrency_limiters.items()
+        }
     
     async def search_done(self):
         tasks = []
@@ -200,22 +419,62 @@ class GraphRAG:
         ]:
             if storage_inst is None:
                 continue
-            tasks.append(cast(StorageNameSpace, storage_inst).index_done_callback())
+            tasks.append(cast(StorageNameSpace, storage_inst).flush())
         await asyncio.gather(*tasks)    
 
+    def _search_manifest_inputs(self, param: QueryParam) -> tuple[str, dict]:
+        embedding = {
+            "model": self.model_names.get("embedding"),
+            "dim": self.embedding_func.embedding_dim,
+        }
+        if param.mode == 0:
+            # entity vectors of a year graph
+            graph_path = os.path.join(self.working_dir, 'graph_chunk_entity_relation.graphml')
+            return "embed", {"graph": file_fingerprint(graph_path), "embedding": embedding}
+        return "slice", {
+            "mode": param.mode,
+            "time": param.time,
+            "merged_graph": file_fingerprint(os.path.join(self.working_dir, 'merged_graph.graphml')),
+            "text_chunks": file_fingerprint(os.path.join(self.working_dir, 'kv_store_text_chunks.json')),
+            "chunk_refs": file_fingerprint(os.path.join(self.working_dir, CHUNK_REFS_FILE)),
+            "embedding": embedding,
+        }
+
+    def _reset_slice_storages(self):
+        for name in SLICE_OUTPUTS:
+            file_name = os.path.join(self.working_dir, name)
+            if os.path.exists(file_name):
+                os.remove(file_name)
+        self.chunk_entity_relation_graph = self.graph_storage_cls(
+            namespace="chunk_entity_relation", global_config=asdict(self)
+        )
+        if self.entities_vdb is not None:
+            self.entities_vdb = self.vector_db_storage_cls(
+                namespace="entities",
+                global_config=asdict(self),
+                embedding_func=self.embedding_func,
+                meta_fields={"entity_name"},
+            )
+
     def search_graph(self, param:QueryParam = QueryParam()):
         loop = always_get_an_event_loop()
         return loop.run_until_complete(self.asearch(param))
 
     async def asearch(self,param:QueryParam = QueryParam()):
+        self.usage_tracker.reset("search")
+        stage, manifest_inputs = self._search_manifest_inputs(param)
+        if self._manifest_is_current(stage, manifest_inputs):
+            self._usage_done()
+            return
+        if param.mode in [1, 2, 3, 4]:
+            # a slice is built from the merged graph alone, not on top of the last one
+            self._reset_slice_storages()
         if param.mode == 1:
             '''
             提取单个时间点的节点图数据
             '''
             graph_path = os.path.join(self.working_dir, 'merged_graph.graphml')
-            chunks_path=os.path.join(self.working_dir,'kv_store_text_chunks.json')
-            with open(chunks_path, 'r', encoding='utf-8') as f:
-                chunks_json = json.load(f)
+            chunk_ids_by_time = load_time_chunk_ids(self.working_dir)
             graph = nx.read_graphml(graph_path)
             nodes_data= list(graph.nodes(data=True))
             use_nodes_data=[]
@@ -235,7 +494,7 @@ class GraphRAG:
                         node_data['description'] = '<SEP>'.join(filtered_descriptions)
                         # 过滤chunks的描述
                         chunks_list=node_data['source_id'].split('<SEP>')
-                        filtered_chunks = [chunk for chunk in chunks_list if chunks_json.get(chunk, {}).get('time') == f"data from {param.time}"]
+                        filtered_chunks = [chunk for chunk in chunks_list if chunk in chunk_ids_by_time.get(param.time, ())]
                         node_data['source_id'] = '<SEP>'.join(filtered_chunks)
                         use_nodes_data.append((node_name,node_data))
                         await self.chunk_entity_relation_graph.upsert_node(node_name,node_data)# 检索图中，插入节点数据
@@ -274,7 +533,7 @@ class GraphRAG:
                         #print(node_data['description'])
                         # 过滤chunks的描述
                         chunks_list=edge_data['source_id'].split('<SEP>')
-                        filtered_chunks = [chunk for chunk in chunks_list if chunks_json.get(chunk, {}).get('time') == f"data from {param.time}"]
+                        filtered_chunks = [chunk for chunk in chunks_list if chunk in chunk_ids_by_time.get(param.time, ())]
                         edge_data['source_id'] = '<SEP>'.join(filtered_chunks)
                         use_edges_data.append((u, v, edge_data))
                         #更新权重
@@ -289,8 +548,8 @@ class GraphRAG:
 
             #loop = asyncio.get_event_loop()
             #loop.run_until_complete(self.search_done())
-            await self.chunk_entity_relation_graph.index_done_callback()
-            await self.entities_vdb.index_done_callback() 
+            await self.chunk_entity_relation_graph.flush()
+            await self.entities_vdb.flush() 
         
         
         if param.mode in [2, 3, 4]:
@@ -298,9 +557,7 @@ class GraphRAG:
             提取多个时间点的节点图数据
             '''
             graph_path = os.path.join(self.working_dir, 'merged_graph.graphml')
-            chunks_path=os.path.join(self.working_dir,'kv_store_text_chunks.json')
-            with open(chunks_path, 'r', encoding='utf-8') as f:
-                chunks_json = json.load(f)
+            chunk_ids_by_time = load_time_chunk_ids(self.working_dir)
             graph = nx.read_graphml(graph_path)
             nodes_data= list(graph.nodes(data=True))
             use_nodes_data=[]
@@ -323,10 +580,10 @@ class GraphRAG:
                         node_data['description'] = '<SEP>'.join(filtered_descriptions)
                         # 过滤chunks的描述
                         chunks_list=node_data['source_id'].split('<SEP>')
-                        filtered_chunks=[]
-                        for query_time in query_times:
-                            time_str=f"-data from {query_time}-"
-                            filtered_chunks.extend([chunk for chunk in chunks_list if chunks_json.get(chunk, {}).get('time') ==  f"data from {query_time}"])
+                        filtered_chunks = [
+                            chunk for chunk in chunks_list
+                            if any(chunk in chunk_ids_by_time.get(query_time, ()) for query_time in query_times)
+                        ]
                         node_data['source_id'] = '<SEP>'.join(filtered_chunks)
                         use_nodes_data.append((node_name,node_data))
                         await self.chunk_entity_relation_graph.upsert_node(node_name,node_data)# 检索图中，插入节点数据
@@ -368,11 +625,11 @@ class GraphRAG:
                         #print(node_data['description'])
                         # 过滤chunks的描述
                         chunks_list=edge_data['source_id'].split('<SEP>')
-                        filtered_chunks=[]
-                        for query_time in query_times:
-                            time_str=f"-data from {query_time}-"
-                            filtered_chunks.extend([chunk for chunk in chunks_list if chunks_json.get(chunk, {}).get('time') ==  f"data from {param.time}"])
-                        node_data['source_id'] = '<SEP>'.join(filtered_chunks)
+                        filtered_chunks = [
+                            chunk for chunk in chunks_list
+                            if any(chunk in chunk_ids_by_time.get(query_time, ()) for query_time in query_times)
+                        ]
+                        edge_data['source_id'] = '<SEP>'.join(filtered_chunks)
                         use_edges_data.append((u, v, edge_data))
                         #更新权重
                         weight_list=edge_data['weight'].split('<SEP>')
@@ -386,13 +643,15 @@ class GraphRAG:
 
             #loop = asyncio.get_event_loop()
             #loop.run_until_complete(self.search_done())
-            await self.chunk_entity_relation_graph.index_done_callback()
-            await self.entities_vdb.index_done_callback() 
+            await self.chunk_entity_relation_graph.flush()
+            await self.entities_vdb.flush() 
+        self._manifest_record(stage, manifest_inputs, SLICE_OUTPUTS)
+        self._usage_done()
         return     
     
-    def insert(self, string_or_strings):
+    def insert(self, string_or_strings, chunk_range: tuple[int, int] = None):
         loop = always_get_an_event_loop()
-        return loop.run_until_complete(self.ainsert(string_or_strings))
+        return loop.run_until_complete(self.ainsert(string_or_strings, chunk_range=chunk_range))
 
     def query(self, query: str, param: QueryParam = QueryParam()):
         loop = always_get_an_event_loop()
@@ -401,6 +660,7 @@ class GraphRAG:
 
 
     async def aquery(self, query: str, param: QueryParam = QueryParam()):
+        self.usage_tracker.reset("query")
         if param.mode in [1,2,3,4]:            
             response = await single_time_query(
                 query,
@@ -409,6 +669,7 @@ class GraphRAG:
                 self.text_chunks,
                 param,
                 asdict(self),
+                chunk_summaries_db=self.chunk_summaries,
             )
         elif param.mode == 10:
             response = await many_time_query(
@@ -430,19 +691,29 @@ class GraphRAG:
         else:
             raise ValueError(f"Unknown mode {param.mode}")
         await self._query_done()
+        self._usage_done()
         return response
 
-    async def ainsert(self, string_or_strings):
+    async def ainsert(self, string_or_strings, chunk_range: tuple[int, int] = None):
+        """Index string_or_strings, only the chunks with chunk_order_index in
+        [start, end) of chunk_range if given (one work item of a WorkQueue)"""
+        self.usage_tracker.reset("insert")
+        if isinstance(string_or_strings, str):
+            string_or_strings = [string_or_strings] #转化为列表
+        # ---------- new docs
+        new_docs = {
+            compute_mdhash_id(c.strip(), prefix="doc-"): {"content": c.strip()}
+            for c in string_or_strings
+        }
+        #对每个文档进行 compute_mdhash_id 操作，生成唯一的文档 ID（通过哈希计算），并将文档内容存储到 new_docs 字典中。这里使用 strip() 去除前后空白字符。
+        manifest_inputs = self._manifest_inputs(new_docs)
+        if chunk_range is not None:
+            manifest_inputs["chunk_range"] = list(chunk_range)
+        if self._manifest_is_current("insert", manifest_inputs):
+            return
+        committed = False
         await self._insert_start()
         try:
-            if isinstance(string_or_strings, str):
-                string_or_strings = [string_or_strings] #转化为列表
-            # ---------- new docs
-            new_docs = {
-                compute_mdhash_id(c.strip(), prefix="doc-"): {"content": c.strip()}
-                for c in string_or_strings
-            }
-            #对每个文档进行 compute_mdhash_id 操作，生成唯一的文档 ID（通过哈希计算），并将文档内容存储到 new_docs 字典中。这里使用 strip() 去除前后空白字符。
             _add_doc_keys = await self.full_docs.filter_keys(list(new_docs.keys()))
             new_docs = {k: v for k, v in new_docs.items() if k in _add_doc_keys}
             if not len(new_docs):
@@ -452,19 +723,27 @@ class GraphRAG:
             #使用 filter_keys 检查新文档是否已经存在于存储中，如果文档已经存在，则从 new_docs 中移除，确保只插入新的文档
             # ---------- chunking
 
-            inserting_chunks = get_chunks(
-                new_docs=new_docs,
+            # documents are chunked by a thread pool and deduplicated one at a
+            # time, so only a few documents' token lists are in memory at once
+            inserting_chunks = {}
+            async for doc_chunks in aiter_doc_chunks(
+                new_docs,
                 chunk_func=self.chunk_func,
+                num_workers=self.chunking_workers,
+                tiktoken_model_name=self.tiktoken_model_name,
                 overlap_token_size=self.chunk_overlap_token_size,
                 max_token_size=self.chunk_token_size,
-            )
-            #调用 get_chunks 方法对新文档进行分块
-            _add_chunk_keys = await self.text_chunks.filter_keys(
-                list(inserting_chunks.keys())
-            )
-            inserting_chunks = {
-                k: v for k, v in inserting_chunks.items() if k in _add_chunk_keys
-            }
+            ):
+                if chunk_range is not None:
+                    doc_chunks = {
+                        k: v
+                        for k, v in doc_chunks.items()
+                        if chunk_range[0] <= v["chunk_order_index"] < chunk_range[1]
+                    }
+                _add_chunk_keys = await self.text_chunks.filter_keys(list(doc_chunks.keys()))
+                inserting_chunks.update(
+                    {k: v for k, v in doc_chunks.items() if k in _add_chunk_keys}
+                )
             if not len(inserting_chunks):
                 logger.warning(f"All chunks are already in the storage")
                 return
@@ -479,6 +758,8 @@ class GraphRAG:
                 knwoledge_graph_inst=self.chunk_entity_relation_graph,
                 entity_vdb=self.entities_vdb,
                 global_config=asdict(self),
+                chunk_summaries=self.chunk_summaries,
+                chunk_contributions=self.chunk_contributions,
             ) #调用 entity_extraction_func 函数从文档块中提取实体，并将这些实体插入到知识图谱中。
             if maybe_new_kg is None:
                 logger.warning("No new entities found")
@@ -487,8 +768,195 @@ class GraphRAG:
             # ---------- commit upsertings and indexing
             await self.full_docs.upsert(new_docs)
             await self.text_chunks.upsert(inserting_chunks)
+            committed = True
+        except BaseException:
+            if self.entity_extract_streaming:
+                # drop the nodes/edges streamed in so far, a rerun re-merges
+                # them from the extraction checkpoint
+                self.chunk_entity_relation_graph = self.graph_storage_cls(
+                    namespace="chunk_entity_relation", global_config=asdict(self)
+                )
+            raise
         finally:
             await self._insert_done()
+            self._usage_done()
+        if committed:
+            # the chunks are in text_chunks now and won't be extracted again
+            ExtractionCheckpoint(self.working_dir).clear()
+            self._manifest_record("insert", manifest_inputs, INSERT_OUTPUTS)
+
+    def update(self, string_or_strings):
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.aupdate(string_or_strings))
+
+    async def aupdate(self, string_or_strings):
+        """Replace the stored documents with string_or_strings, e.g. after fixing
+        a typo in 2016.md, without rebuilding the index.
+
+        New chunks are extracted as in ainsert, chunks whose content is
+        unchanged are kept, and the contributions of chunks that are gone
+        are retracted from the graph, the entity vectors and the KV stores.
+        The retraction is committed before extraction starts, so a failed
+        update is resumed by running it again.
+        """
+        self.usage_tracker.reset("update")
+        if isinstance(string_or_strings, str):
+            string_or_strings = [string_or_strings]
+        new_docs = {
+            compute_mdhash_id(c.strip(), prefix="doc-"): {"content": c.strip()}
+            for c in string_or_strings
+        }
+        manifest_inputs = self._manifest_inputs(new_docs)
+        if self._manifest_is_current("update", manifest_inputs):
+            return
+        committed = False
+        await self._insert_start()
+        try:
+            old_doc_keys = set(await self.full_docs.all_keys())
+            removed_doc_keys = old_doc_keys - set(new_docs)
+            added_docs = {k: v for k, v in new_docs.items() if k not in old_doc_keys}
+            if not removed_doc_keys and not added_docs:
+                logger.warning(f"All docs are already in the storage")
+                return
+
+            doc_chunks = {}
+            async for chunks in aiter_doc_chunks(
+                added_docs,
+                chunk_func=self.chunk_func,
+                num_workers=self.chunking_workers,
+                tiktoken_model_name=self.tiktoken_model_name,
+                overlap_token_size=self.chunk_overlap_token_size,
+                max_token_size=self.chunk_token_size,
+            ):
+                doc_chunks.update(chunks)
+            chunk_keys = await self.text_chunks.all_keys()
+            chunk_docs = await self.text_chunks.get_by_ids(chunk_keys, fields={"full_doc_id"})
+            removed_chunk_keys = [
+                k
+                for k, c in zip(chunk_keys, chunk_docs)
+                if c is not None and c["full_doc_id"] in removed_doc_keys and k not in doc_chunks
+            ]
+            _add_chunk_keys = await self.text_chunks.filter_keys(list(doc_chunks.keys()))
+            inserting_chunks = {k: v for k, v in doc_chunks.items() if k in _add_chunk_keys}
+            logger.info(
+                f"[Update] {len(removed_doc_keys)} docs replaced by {len(added_docs)}: "
+                f"{len(inserting_chunks)} new chunks, {len(removed_chunk_keys)} removed, "
+                f"{len(doc_chunks) - len(inserting_chunks)} unchanged"
+            )
+
+            # ---------- retract removed chunks
+            if removed_chunk_keys:
+                stats = await retract_chunks(
+                    removed_chunk_keys,
+                    self.chunk_entity_relation_graph,
+                    self.entities_vdb,
+                    self.chunk_contributions,
+                    description_archive=self.description_archive,
+                )
+                logger.info(f"[Retract] {stats}")
+                await self.text_chunks.delete(removed_chunk_keys)
+                await self.chunk_summaries.delete(
+                    [
+                        chunk_summary_key(k, version)
+                        for k in removed_chunk_keys
+                        for version in (SUMMARY_PROMPT_VERSION, FUSED_SUMMARY_PROMPT_VERSION)
+                    ]
+                )
+                await self.chunk_contributions.delete(removed_chunk_keys)
+                if self.chunks_vdb is not None:
+                    await self.chunks_vdb.delete(removed_chunk_keys)
+                await self._insert_done()
+
+            # ---------- extract new chunks
+            if inserting_chunks:
+                logger.info("[Entity Extraction]...")
+                maybe_new_kg = await self.entity_extraction_func(
+                    inserting_chunks,
+                    knwoledge_graph_inst=self.chunk_entity_relation_graph,
+                    entity_vdb=self.entities_vdb,
+                    global_config=asdict(self),
+                    chunk_summaries=self.chunk_summaries,
+                    chunk_contributions=self.chunk_contributions,
+                )
+                if maybe_new_kg is None:
+                    logger.warning("No new entities found")
+                else:
+                    self.chunk_entity_relation_graph = maybe_new_kg
+            # ---------- commit, unchanged chunks move to the new docs
+            await self.full_docs.delete(list(removed_doc_keys))
+            await self.full_docs.upsert(added_docs)
+            await self.text_chunks.upsert(doc_chunks)
+            committed = True
+        except BaseException:
+            if self.entity_extract_streaming:
+                self.chunk_entity_relation_graph = self.graph_storage_cls(
+                    namespace="chunk_entity_relation", global_config=asdict(self)
+                )
+            raise
+        finally:
+            await self._insert_done()
+            self._usage_done()
+        if committed:
+            ExtractionCheckpoint(self.working_dir).clear()
+            self._manifest_record("update", manifest_inputs, INSERT_OUTPUTS)
+
+    def compact_descriptions(self):
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.acompact_descriptions())
+
+    async def acompact_descriptions(self) -> dict:
+        """Summarize the oversized (entity, time) description sets of the graph.
+
+        Meant to run after inserts, off the query path: summaries replace the
+        raw descriptions in the graph and the entity vectors, so query time
+        work per entity stays bounded; the raw ones stay retrievable with
+        araw_description.
+        """
+        self.usage_tracker.reset("compact")
+        manifest_inputs = {
+            "prompts": prompt_versions(["summarize_entity_descriptions"]),
+            "models": self.model_names,
+            "max_tokens": self.entity_summary_to_max_tokens,
+            "tiktoken_model_name": self.tiktoken_model_name,
+        }
+        if self._manifest_is_current("compact", manifest_inputs):
+            return {}
+        compactor = DescriptionCompactor(
+            summarize=partial(_handle_entity_relation_summary, global_config=asdict(self)),
+            archive=self.description_archive,
+            tiktoken_model_name=self.tiktoken_model_name,
+            max_tokens=self.entity_summary_to_max_tokens,
+            batch_size=self.description_compaction_batch_size,
+        )
+        try:
+            new_nodes, _ = await compactor.compact_graph(self.chunk_entity_relation_graph)
+            if self.entities_vdb is not None and new_nodes:
+                await self.entities_vdb.upsert(
+                    {
+                        compute_mdhash_id(node_name, prefix="ent-"): {
+                            "content": node_name + node_data["description"],
+                            "entity_name": node_name,
+                        }
+                        for node_name, node_data in new_nodes.items()
+                    }
+                )
+            logger.info(f"Description compaction: {compactor.stats}")
+        finally:
+            await self._compact_done()
+            self._usage_done()
+        # the graph of the insert (or update) stage is rewritten on purpose
+        self._manifest_record(
+            "compact", manifest_inputs, COMPACT_OUTPUTS, upstream=("insert", "update")
+        )
+        return compactor.stats
+
+    async def araw_description(self, entity_name: str) -> Union[str, None]:
+        """The description of a node with its compacted summaries expanded again"""
+        node = await self.chunk_entity_relation_graph.get_node(entity_name)
+        if node is None:
+            return None
+        compactor = DescriptionCompactor(summarize=None, archive=self.description_archive)
+        return await compactor.expand(entity_name, node.get("description", ""))
 
     async def _insert_start(self):
         tasks = []
@@ -505,6 +973,8 @@ class GraphRAG:
         for storage_inst in [
             self.full_docs,
             self.text_chunks,
+            self.chunk_summaries,
+            self.chunk_contributions,
             self.llm_response_cache,
             self.entities_vdb,
             self.chunks_vdb,
@@ -512,7 +982,20 @@ class GraphRAG:
         ]:
             if storage_inst is None:
                 continue
-            tasks.append(cast(StorageNameSpace, storage_inst).index_done_callback())
+            tasks.append(cast(StorageNameSpace, storage_inst).flush())
+        await asyncio.gather(*tasks)
+
+    async def _compact_done(self):
+        tasks = []
+        for storage_inst in [
+            self.description_archive,
+            self.llm_response_cache,
+            self.entities_vdb,
+            self.chunk_entity_relation_graph,
+        ]:
+            if storage_inst is None:
+                continue
+            tasks.append(cast(StorageNameSpace, storage_inst).flush())
         await asyncio.gather(*tasks)
 
     async def _query_done(self):
@@ -522,3 +1005,27 @@ class GraphRAG:
                 continue
             tasks.append(cast(StorageNameSpace, storage_inst).index_done_callback())
         await asyncio.gather(*tasks)
+
+    def flush_storages(self):
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.aflush_storages())
+
+    async def aflush_storages(self):
+        """Write every storage with unwritten changes now, e.g. before a
+        service using storage_flush_debounce stops"""
+        tasks = []
+        for storage_inst in [
+            self.full_docs,
+            self.text_chunks,
+            self.chunk_summaries,
+            self.chunk_contributions,
+            self.description_archive,
+            self.llm_response_cache,
+            self.entities_vdb,
+            self.chunks_vdb,
+            self.chunk_entity_relation_graph,
+        ]:
+            if storage_inst is None:
+                continue
+            tasks.append(cast(StorageNameSpace, storage_inst).flush())
+        await asyncio.gather(*tasks)